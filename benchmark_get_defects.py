@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+不良品讀取效能測試
+比較舊版逐格 apply 解碼與目前 query_defects 的讀取時間
+
+使用方式：python benchmark_get_defects.py [筆數]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 使用暫存資料庫，避免影響正式資料
+_work_dir = tempfile.mkdtemp(prefix='defect_benchmark_')
+os.environ['DEFECT_DB_PATH'] = os.path.join(_work_dir, 'benchmark.db')
+
+import pandas as pd
+import defect_management_system as dms
+
+
+def seed_defects(row_count):
+    """產生測試用不良品資料"""
+    levels = ['A級', 'B級', 'C級']
+    statuses = ['待處理', '處理中', '已完成']
+    depts = ['工程部', '品保部', '製造部']
+    base_time = datetime(2024, 1, 1)
+
+    rows = []
+    for i in range(row_count):
+        created = base_time + timedelta(minutes=i)
+        rows.append((
+            f'WO{i // 20:06d}', f'產品{i % 50}', '外觀不良' if i % 2 else '檢具NG', levels[i % 3],
+            i % 10 + 1, i % 20 + 1, f'問題描述 {i}', depts[i % 3], statuses[i % 3],
+            created.strftime('%Y-%m-%d %H:%M:%S'), created.strftime('%Y-%m-%d %H:%M:%S'),
+            f'負責人{i % 7}', '系統', depts[i % 3], depts[(i + 1) % 3], f'負責人{i % 7}', '',
+            '待主要單位處理', 1000
+        ))
+
+    with dms.db_transaction() as conn:
+        conn.executemany('''
+            INSERT INTO defects (work_order, product_name, defect_type, defect_level, quantity,
+                               package_number, description, responsible_dept, status, created_time,
+                               updated_time, assigned_person, logged_by, primary_dept, secondary_dept,
+                               primary_person, secondary_person, approval_status, work_order_total_qty)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def legacy_get_defects():
+    """舊版讀取方式：讀取後以 Python 函數逐格解碼"""
+    query = f"SELECT {', '.join(dms.DEFECT_COLUMNS)} FROM defects ORDER BY created_time DESC"
+    with dms.db_connection() as conn:
+        df = pd.read_sql_query(query, conn)
+
+    for col in dms.DEFECT_TEXT_COLUMNS:
+        if col in df.columns:
+            def decode_if_bytes(x):
+                if isinstance(x, bytes):
+                    try:
+                        return x.decode('utf-8')
+                    except:
+                        return str(x)
+                return str(x) if pd.notna(x) else ''
+
+            df[col] = df[col].apply(decode_if_bytes).replace('nan', '').replace('None', '')
+
+    # 舊版儀表板會再將所有文字欄位轉換一次
+    for col in df.columns:
+        if df[col].dtype == 'object':
+            df[col] = df[col].astype(str)
+    return df
+
+
+def measure(label, func, repeat=3):
+    """執行多次並回傳最短時間"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<12} {best:8.3f} 秒  ({len(df)} 筆)")
+    return best
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    dms.run_migrations()
+    print(f"產生 {row_count} 筆測試資料...")
+    seed_defects(row_count)
+
+    before = measure('舊版讀取', legacy_get_defects)
+    after = measure('query_defects', dms.query_defects)
+    print(f"加速倍數: {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import sqlite3
 import hashlib
@@ -14,16 +14,279 @@ from email.mime.multipart import MIMEMultipart
 import threading
 import requests
 import os
+import queue
+import csv
+import gzip
+import io
+import tempfile
+import zipfile
+import functools
+import copy
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# 資料庫路徑配置（可透過環境變數覆寫，所有資料存取統一使用此路徑）
+DB_PATH = os.environ.get('DEFECT_DB_PATH', os.path.join('data', 'defect_management.db'))
+# 舊版本部分函數直接連線到根目錄的資料庫檔案
+LEGACY_DB_PATH = 'defect_management.db'
+# 本程序是否已處理過舊版根目錄的資料庫
+_legacy_db_checked = False
+# 連線池保留的閒置連線數量
+DB_POOL_SIZE = int(os.environ.get('DEFECT_DB_POOL_SIZE', '8'))
+DB_TIMEOUT = 30
+# 儲存模式：wal（WAL 日誌 + 單一寫入執行緒）或 direct（各連線直接寫入）
+DB_STORAGE_MODE = os.environ.get('DEFECT_DB_STORAGE_MODE', 'wal')
+# 寫入執行緒每次群組提交最多合併的寫入意圖數
+DB_WRITER_BATCH_SIZE = 64
+# 歷史資料匯入每批處理筆數（每批一個交易）
+IMPORT_CHUNK_SIZE = 5000
+# 匯出資料時每批從資料庫讀取的筆數
+EXPORT_CHUNK_SIZE = 5000
+# 處理追蹤頁面每頁顯示筆數
+TRACKING_PAGE_SIZE = 20
+# 不良品快照增量更新時重新讀取的重疊秒數
+DEFECT_SNAPSHOT_OVERLAP_SECONDS = 5
+# 已完成超過此天數的不良品會移至月份歸檔資料庫
+DEFECT_ARCHIVE_AGE_DAYS = int(os.environ.get('DEFECT_ARCHIVE_AGE_DAYS', '60'))
+# 分析用讀取快照的更新間隔（秒）
+READ_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get('DEFECT_READ_SNAPSHOT_INTERVAL', '600'))
+
+def _count_db_rows(path):
+    """回傳 (不良品筆數, 用戶筆數)，檔案不存在或沒有資料表時視為 0"""
+    if not os.path.exists(path):
+        return 0, 0
+    conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+    try:
+        counts = []
+        for table in ('defects', 'users'):
+            try:
+                counts.append(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0])
+            except sqlite3.OperationalError:
+                counts.append(0)
+        return tuple(counts)
+    finally:
+        conn.close()
+
+def _adopt_legacy_db(db_path, legacy_path):
+    """
+    舊版讀寫的是根目錄的資料庫，但 init_database() 另外在統一路徑建立了（幾乎是空的）資料庫；
+    舊檔的不良品或用戶比統一路徑多時改用舊檔內容，統一路徑原有的檔案改名保留。
+    處理後舊檔改名為 .migrated，之後不再比較；回傳採用的檔案路徑，沒有舊檔時回傳 None
+    """
+    if not os.path.exists(legacy_path) or os.path.abspath(db_path) == os.path.abspath(legacy_path):
+        return None
+    # 先改名取得處理權，多個程序同時啟動時只有一個會執行
+    migrated_path = f'{legacy_path}.migrated'
+    try:
+        os.replace(legacy_path, migrated_path)
+    except FileNotFoundError:
+        return None
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(legacy_path + suffix):
+            os.replace(legacy_path + suffix, migrated_path + suffix)
+
+    legacy_counts = _count_db_rows(migrated_path)
+    current_counts = _count_db_rows(db_path)
+    if legacy_counts <= current_counts:
+        print(f"資料庫路徑：沿用 {db_path}（不良品/用戶 {current_counts}），舊版 {legacy_path}"
+              f"（{legacy_counts}）已改名為 {migrated_path}")
+        return db_path
+
+    if os.path.exists(db_path):
+        backup_path = f"{db_path}.replaced-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.replace(db_path + suffix, backup_path + suffix)
+        print(f"資料庫路徑：{db_path}（不良品/用戶 {current_counts}）已改名為 {backup_path}")
+    # 以備份 API 複製，舊檔 WAL 中尚未寫回的內容也會一併複製
+    source = sqlite3.connect(migrated_path)
+    target = sqlite3.connect(db_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    print(f"資料庫路徑：採用舊版 {legacy_path}（不良品/用戶 {legacy_counts}）複製至 {db_path}，"
+          f"原檔已改名為 {migrated_path}")
+    return migrated_path
 
-# 資料庫路徑配置
 def get_db_path():
     """獲取資料庫路徑"""
-    os.makedirs('data', exist_ok=True)
-    return os.path.join('data', 'defect_management.db')
+    db_dir = os.path.dirname(DB_PATH)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    # 舊版根目錄的資料庫只在第一次取得路徑時處理（需在建立任何連線之前）
+    global _legacy_db_checked
+    if not _legacy_db_checked:
+        _legacy_db_checked = True
+        _adopt_legacy_db(DB_PATH, LEGACY_DB_PATH)
+
+    return DB_PATH
+
+# 全文檢索斷詞：中日韓文字逐字切開，其餘文字交由 FTS5 unicode61 斷詞
+FTS_CJK_PATTERN = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])')
+
+def fts_segment(text):
+    """將文字轉為全文索引使用的斷詞格式，觸發器與搜尋條件共用"""
+    if text is None:
+        return ''
+    return FTS_CJK_PATTERN.sub(r' \1 ', str(text))
+
+def _register_sql_functions(conn):
+    """註冊觸發器使用的自訂 SQL 函數，所有連到主資料庫的連線都必須註冊"""
+    conn.create_function('fts_segment', 1, fts_segment, deterministic=True)
+
+class ConnectionManager:
+    """SQLite 連線池，跨會話共用已設定好的連線，避免每次操作重新連線"""
+
+    def __init__(self, db_path, pool_size=DB_POOL_SIZE, timeout=DB_TIMEOUT):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _create_connection(self):
+        """建立新連線並套用連線層級設定"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        _register_sql_functions(conn)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        if DB_STORAGE_MODE == 'wal':
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def acquire(self):
+        """從連線池借出連線，池中沒有閒置連線時建立新連線"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._create_connection()
+
+    def release(self, conn):
+        """歸還連線，池已滿時直接關閉"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """借出連線，區塊結束後自動歸還"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """借出連線並在區塊結束時提交，發生錯誤時回滾"""
+        with self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close_all(self):
+        """關閉連線池中所有閒置連線"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+class DatabaseWriter:
+    """單一寫入執行緒：依序取出寫入意圖，合併為群組交易提交，避免寫入互相鎖定"""
+
+    def __init__(self, db_path, batch_size=DB_WRITER_BATCH_SIZE, timeout=DB_TIMEOUT):
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False,
+                                     isolation_level=None)
+        _register_sql_functions(self._conn)
+        self._conn.execute(f'PRAGMA busy_timeout = {int(timeout * 1000)}')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._thread = threading.Thread(target=self._run, name='defect-db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, intent, func, *args, **kwargs):
+        """送出寫入意圖並等待提交結果，func 以 func(conn, *args, **kwargs) 執行"""
+        future = Future()
+        self._queue.put((intent, func, args, kwargs, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        """在同一個交易中執行一批寫入意圖，每個意圖以 SAVEPOINT 隔離失敗"""
+        conn = self._conn
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for intent, func, args, kwargs, future in batch:
+                conn.execute('SAVEPOINT write_intent')
+                try:
+                    result = func(conn, *args, **kwargs)
+                    conn.execute('RELEASE SAVEPOINT write_intent')
+                    results.append((future, result, None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO SAVEPOINT write_intent')
+                    conn.execute('RELEASE SAVEPOINT write_intent')
+                    print(f"寫入意圖失敗 [{intent}]: {e}")
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f"群組寫入交易失敗: {e}")
+            for _, _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        # 交易提交後才通知呼叫端
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+@st.cache_resource
+def get_connection_manager():
+    """獲取全域共用的連線管理器（跨會話及重新執行共用）"""
+    return ConnectionManager(get_db_path())
+
+@st.cache_resource
+def get_db_writer():
+    """獲取全域共用的寫入執行緒"""
+    return DatabaseWriter(get_db_path())
 
-def get_db_connection():
-    """獲取資料庫連接"""
-    return sqlite3.connect(get_db_path(), timeout=30)
+def db_connection():
+    """借出資料庫連線"""
+    return get_connection_manager().connection()
+
+def db_transaction():
+    """借出資料庫連線並以交易方式執行"""
+    return get_connection_manager().transaction()
+
+def execute_write(intent, func, *args, **kwargs):
+    """執行寫入意圖：WAL 模式交由寫入執行緒群組提交，否則直接以交易執行"""
+    if DB_STORAGE_MODE == 'wal':
+        return get_db_writer().submit(intent, func, *args, **kwargs)
+    with db_transaction() as conn:
+        return func(conn, *args, **kwargs)
 
 # 設定頁面配置
 st.set_page_config(
@@ -119,13 +382,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 資料庫初始化
+# 資料庫初始化與結構遷移
 
 
-def init_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
+def _migration_001_base_schema(cursor):
+    """建立基本資料表"""
     # 創建用戶表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -174,107 +435,6 @@ def init_database():
         )
     ''')
 
-    # 檢查是否需要新增package_number欄位（為了向後兼容）
-    cursor.execute("PRAGMA table_info(defects)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'package_number' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN package_number INTEGER DEFAULT 1')
-        st.info("📦 資料庫已更新，新增包數功能")
-
-    # 檢查是否需要新增logged_by欄位（為了向後兼容）
-    if 'logged_by' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN logged_by TEXT DEFAULT "系統"')
-        st.info("👤 資料庫已更新，新增登錄人員追蹤功能")
-
-    # 檢查是否需要新增流程管理欄位
-    if 'primary_dept' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN primary_dept TEXT')
-        st.info("🔄 資料庫已更新，新增主要責任部門功能")
-
-    if 'secondary_dept' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN secondary_dept TEXT')
-        st.info("🔄 資料庫已更新，新增次要責任部門功能")
-
-    if 'primary_person' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN primary_person TEXT')
-        st.info("👤 資料庫已更新，新增主要責任人功能")
-
-    if 'secondary_person' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN secondary_person TEXT')
-        st.info("👤 資料庫已更新，新增次要責任人功能")
-
-    if 'approval_status' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN approval_status TEXT DEFAULT "待主要單位處理"')
-        st.info("✅ 資料庫已更新，新增簽核狀態功能")
-
-    if 'approval_result' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN approval_result TEXT')
-        st.info("📋 資料庫已更新，新增簽核結果功能")
-
-    # 檢查是否需要新增supplier欄位（為了向後兼容，保留但不再使用）
-    if 'supplier' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN supplier TEXT')
-
-    # 檢查是否需要新增component欄位（為了向後兼容）
-    if 'component' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN component TEXT')
-        st.info("🔧 資料庫已更新，新增零件功能")
-
-    if 'work_order_total_qty' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN work_order_total_qty INTEGER DEFAULT 0')
-        st.info("📊 資料庫已更新，新增工單總數功能")
-
-    # 檢查是否需要新增第三責任人相關欄位
-    if 'third_dept' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN third_dept TEXT')
-        st.info("🔄 資料庫已更新，新增第三責任部門功能")
-
-    if 'third_person' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN third_person TEXT')
-        st.info("👤 資料庫已更新，新增第三責任人功能")
-
-    if 'third_approval_status' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN third_approval_status TEXT')
-        st.info("✅ 資料庫已更新，新增第三責任人簽核狀態功能")
-
-    # 檢查是否需要新增defective_component欄位（零件不良）
-    if 'defective_component' not in columns:
-        cursor.execute('ALTER TABLE defects ADD COLUMN defective_component TEXT')
-        st.info("🔧 資料庫已更新，新增零件不良追蹤功能")
-
-    # 檢查並修復現有記錄的部門分配（只在必要時執行）
-    try:
-        cursor.execute('SELECT COUNT(*) FROM defects WHERE primary_dept IS NULL OR secondary_dept IS NULL')
-        need_repair = cursor.fetchone()[0]
-
-        if need_repair > 0:
-            # 修復primary_dept和secondary_dept為空的記錄
-            cursor.execute('''
-                UPDATE defects
-                SET primary_dept = CASE
-                    WHEN defect_type IN ('外觀不良', '表面缺陷') THEN '品保部'
-                    ELSE '工程部'
-                END,
-                secondary_dept = CASE
-                    WHEN defect_type IN ('外觀不良', '表面缺陷') THEN '工程部'
-                    ELSE '品保部'
-                END
-                WHERE primary_dept IS NULL OR secondary_dept IS NULL
-            ''')
-
-            # 確保responsible_dept與primary_dept一致
-            cursor.execute('''
-                UPDATE defects
-                SET responsible_dept = primary_dept
-                WHERE approval_status = '待主要單位處理' OR approval_status IS NULL
-            ''')
-    except sqlite3.OperationalError as e:
-        # 如果數據庫被鎖定，跳過修復步驟
-        if "database is locked" in str(e).lower():
-            pass  # 靜默跳過，避免系統無法啟動
-        else:
-            raise e
-
     # 創建處理記錄表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS processing_logs (
@@ -289,8 +449,604 @@ def init_database():
         )
     ''')
 
-    conn.commit()
-    conn.close()
+def _migration_002_workflow_columns(cursor):
+    """新增包數、登錄人員、流程管理及第三責任人等欄位"""
+    # 舊版資料庫可能已透過逐欄檢查新增部分欄位，因此只補上缺少的欄位
+    new_columns = [
+        ('package_number', 'INTEGER DEFAULT 1'),
+        ('logged_by', 'TEXT DEFAULT "系統"'),
+        ('primary_dept', 'TEXT'),
+        ('secondary_dept', 'TEXT'),
+        ('primary_person', 'TEXT'),
+        ('secondary_person', 'TEXT'),
+        ('approval_status', 'TEXT DEFAULT "待主要單位處理"'),
+        ('approval_result', 'TEXT'),
+        ('supplier', 'TEXT'),  # 為了向後兼容，保留但不再使用
+        ('component', 'TEXT'),
+        ('work_order_total_qty', 'INTEGER DEFAULT 0'),
+        ('third_dept', 'TEXT'),
+        ('third_person', 'TEXT'),
+        ('third_approval_status', 'TEXT'),
+        ('defective_component', 'TEXT'),
+    ]
+    cursor.execute("PRAGMA table_info(defects)")
+    columns = [column[1] for column in cursor.fetchall()]
+    for name, definition in new_columns:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE defects ADD COLUMN {name} {definition}')
+
+def _migration_003_repair_departments(cursor):
+    """修復現有記錄的主要／次要責任部門分配"""
+    cursor.execute('SELECT COUNT(*) FROM defects WHERE primary_dept IS NULL OR secondary_dept IS NULL')
+    if cursor.fetchone()[0] == 0:
+        return
+
+    # 修復primary_dept和secondary_dept為空的記錄
+    cursor.execute('''
+        UPDATE defects
+        SET primary_dept = CASE
+            WHEN defect_type IN ('外觀不良', '表面缺陷') THEN '品保部'
+            ELSE '工程部'
+        END,
+        secondary_dept = CASE
+            WHEN defect_type IN ('外觀不良', '表面缺陷') THEN '工程部'
+            ELSE '品保部'
+        END
+        WHERE primary_dept IS NULL OR secondary_dept IS NULL
+    ''')
+
+    # 確保responsible_dept與primary_dept一致
+    cursor.execute('''
+        UPDATE defects
+        SET responsible_dept = primary_dept
+        WHERE approval_status = '待主要單位處理' OR approval_status IS NULL
+    ''')
+
+# 受管理的索引：(索引名稱, 資料表, 欄位)
+MANAGED_INDEXES = [
+    ('idx_defects_work_order', 'defects', 'work_order, package_number'),
+    ('idx_defects_status_created', 'defects', 'status, created_time'),
+    ('idx_defects_created_time', 'defects', 'created_time'),
+    ('idx_defects_updated_time', 'defects', 'updated_time'),
+    ('idx_defects_responsible_dept', 'defects', 'responsible_dept, status'),
+    ('idx_defects_assigned_person', 'defects', 'assigned_person'),
+    ('idx_processing_logs_defect', 'processing_logs', 'defect_id, timestamp'),
+    ('idx_defect_components_component', 'defect_components', 'component'),
+    ('idx_defects_status_deadline', 'defects', 'status, deadline_epoch'),
+    ('idx_defects_created_epoch', 'defects', 'created_epoch'),
+    ('idx_defects_updated_epoch', 'defects', 'updated_epoch'),
+    ('idx_defects_created_date', 'defects', 'created_date'),
+    ('idx_defects_created_week', 'defects', 'created_week'),
+    ('idx_defects_created_month', 'defects', 'created_month'),
+    ('idx_responsible_persons_department', 'responsible_persons', 'department, id'),
+]
+
+def ensure_managed_indexes(cursor):
+    """建立尚未存在的受管理索引（資料表或欄位尚未由遷移建立者略過）"""
+    for name, table, columns in MANAGED_INDEXES:
+        # table_xinfo 才會列出產生欄位
+        existing = {row[1] for row in cursor.execute(f'PRAGMA table_xinfo({table})').fetchall()}
+        if not existing.issuperset(col.strip() for col in columns.split(',')):
+            continue
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+def _migration_004_managed_indexes(cursor):
+    """建立查詢用的次要索引"""
+    ensure_managed_indexes(cursor)
+    cursor.execute('ANALYZE')
+
+def _migration_005_snapshot_tracking(cursor):
+    """建立刪除記錄表及 updated_time 索引，供快照增量更新"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS defect_tombstones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            defect_id INTEGER NOT NULL,
+            deleted_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    ensure_managed_indexes(cursor)
+
+def _create_work_order_stats_tables(cursor):
+    """工單統計表及已歸檔記錄的累計表（結構相同，統計時兩者合併）"""
+    for table in ('work_order_stats', 'archived_work_order_totals'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                work_order TEXT PRIMARY KEY,
+                total_defects INTEGER NOT NULL DEFAULT 0,
+                total_qty INTEGER NOT NULL DEFAULT 0,
+                record_count INTEGER NOT NULL DEFAULT 0,
+                max_package_number INTEGER NOT NULL DEFAULT 0,
+                completed_packages INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+def _migration_006_work_order_stats(cursor):
+    """建立工單統計表並由現有記錄重建"""
+    _create_work_order_stats_tables(cursor)
+    _rebuild_work_order_stats_tx(cursor.connection)
+
+def _migration_007_package_sequences(cursor):
+    """建立工單包數序號表，並以現有記錄的最大包數為起點"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS package_sequences (
+            work_order TEXT PRIMARY KEY,
+            last_package_number INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO package_sequences (work_order, last_package_number)
+        SELECT work_order, COALESCE(MAX(package_number), 0) FROM defects GROUP BY work_order
+    ''')
+
+def _migration_008_full_text_search(cursor):
+    """建立不良品及處理記錄的全文索引，並以觸發器與資料表同步"""
+    # 無內容（contentless）索引只保存斷詞結果，原文仍由 defects / processing_logs 讀取
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS defects_fts USING fts5(
+            description, resolution, defective_component, content=''
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS processing_logs_fts USING fts5(comment, content='')
+    ''')
+
+    # 觸發器逐一以 execute 建立：executescript 會先提交交易，使本步驟失去 BEGIN IMMEDIATE 的保護
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS defects_fts_insert AFTER INSERT ON defects BEGIN
+            INSERT INTO defects_fts (rowid, description, resolution, defective_component)
+            VALUES (new.id, fts_segment(new.description), fts_segment(new.resolution),
+                    fts_segment(new.defective_component));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS defects_fts_delete AFTER DELETE ON defects BEGIN
+            INSERT INTO defects_fts (defects_fts, rowid, description, resolution, defective_component)
+            VALUES ('delete', old.id, fts_segment(old.description), fts_segment(old.resolution),
+                    fts_segment(old.defective_component));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS defects_fts_update
+        AFTER UPDATE OF description, resolution, defective_component ON defects BEGIN
+            INSERT INTO defects_fts (defects_fts, rowid, description, resolution, defective_component)
+            VALUES ('delete', old.id, fts_segment(old.description), fts_segment(old.resolution),
+                    fts_segment(old.defective_component));
+            INSERT INTO defects_fts (rowid, description, resolution, defective_component)
+            VALUES (new.id, fts_segment(new.description), fts_segment(new.resolution),
+                    fts_segment(new.defective_component));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processing_logs_fts_insert AFTER INSERT ON processing_logs BEGIN
+            INSERT INTO processing_logs_fts (rowid, comment) VALUES (new.id, fts_segment(new.comment));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processing_logs_fts_delete AFTER DELETE ON processing_logs BEGIN
+            INSERT INTO processing_logs_fts (processing_logs_fts, rowid, comment)
+            VALUES ('delete', old.id, fts_segment(old.comment));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processing_logs_fts_update AFTER UPDATE OF comment ON processing_logs BEGIN
+            INSERT INTO processing_logs_fts (processing_logs_fts, rowid, comment)
+            VALUES ('delete', old.id, fts_segment(old.comment));
+            INSERT INTO processing_logs_fts (rowid, comment) VALUES (new.id, fts_segment(new.comment));
+        END
+    ''')
+
+    # 為既有記錄建立索引
+    cursor.execute('''
+        INSERT INTO defects_fts (rowid, description, resolution, defective_component)
+        SELECT id, fts_segment(description), fts_segment(resolution), fts_segment(defective_component)
+        FROM defects
+    ''')
+    cursor.execute('''
+        INSERT INTO processing_logs_fts (rowid, comment)
+        SELECT id, fts_segment(comment) FROM processing_logs
+    ''')
+
+def _migration_009_resolution_fields(cursor):
+    """新增結構化處理結果欄位，並解析既有的處理結果文字（含歸檔資料庫）"""
+    cursor.execute("PRAGMA table_info(defects)")
+    columns = [column[1] for column in cursor.fetchall()]
+    for name, definition in RESOLUTION_FIELD_COLUMNS:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE defects ADD COLUMN {name} {definition}')
+    _backfill_resolution_fields(cursor.connection)
+
+    for month in list_archive_months():
+        archive_conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            _sync_archive_schema(cursor.connection, archive_conn)
+            _backfill_resolution_fields(archive_conn)
+            archive_conn.commit()
+        finally:
+            archive_conn.close()
+
+def _migration_010_defect_components(cursor):
+    """建立不良零件明細表，並拆解既有的分號分隔零件文字"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS defect_components (
+            defect_id INTEGER NOT NULL,
+            component TEXT NOT NULL,
+            PRIMARY KEY (defect_id, component)
+        ) WITHOUT ROWID
+    ''')
+    ensure_managed_indexes(cursor)
+    rows = cursor.execute('''
+        SELECT id, defective_component FROM defects
+        WHERE defective_component IS NOT NULL AND defective_component != ''
+    ''').fetchall()
+    cursor.executemany('INSERT OR IGNORE INTO defect_components (defect_id, component) VALUES (?, ?)',
+                       [(defect_id, component) for defect_id, text in rows for component in split_components(text)])
+
+# 設定資料表（人員、登錄人員、產品名稱及通知設定）
+SETTINGS_TABLES = ['responsible_persons', 'operators', 'products', 'notification_settings']
+
+# 資料版本的範圍及觸發更新的資料表
+DATA_VERSION_SCOPES = {
+    'defects': ['defects', 'processing_logs'],
+    'users': ['users'],
+    'settings': SETTINGS_TABLES,
+    # 重新計算截止時間時直接遞增（沒有觸發器）
+    'sla': [],
+}
+
+def _create_data_version_triggers(cursor):
+    """建立各範圍的版本記錄及資料異動觸發器（尚未建立的資料表略過）"""
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for scope, tables in DATA_VERSION_SCOPES.items():
+        cursor.execute('INSERT OR IGNORE INTO data_version (scope, version) VALUES (?, 0)', (scope,))
+        for table in tables:
+            if table not in existing:
+                continue
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                        UPDATE data_version SET version = version + 1 WHERE scope = '{scope}';
+                    END
+                ''')
+
+def _migration_011_data_version(cursor):
+    """建立資料版本計數表，由觸發器在資料異動時遞增"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _create_data_version_triggers(cursor)
+
+def _migration_012_sla_deadline(cursor):
+    """新增以 epoch 表示的截止時間欄位及 (status, deadline_epoch) 索引，依預設處理時限回填（自訂時限於第 14 版匯入後重新計算）"""
+    cursor.execute("PRAGMA table_info(defects)")
+    if 'deadline_epoch' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE defects ADD COLUMN deadline_epoch INTEGER')
+    expression, params = _sla_deadline_sql(DEFECT_LEVEL_HOURS)
+    cursor.execute(f'UPDATE defects SET deadline_epoch = {expression}', params)
+    ensure_managed_indexes(cursor)
+
+def _migration_013_epoch_timestamps(cursor):
+    """新增 UTC epoch 時間欄位及本地日期／週／月份產生欄位，以觸發器同步並回填既有資料（含歸檔資料庫）"""
+    columns = {row[1] for row in cursor.execute('PRAGMA table_xinfo(defects)').fetchall()}
+    for _, epoch_col in DEFECT_EPOCH_COLUMNS:
+        if epoch_col not in columns:
+            cursor.execute(f'ALTER TABLE defects ADD COLUMN {epoch_col} INTEGER')
+    for name, expression in DEFECT_GENERATED_COLUMNS:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE defects ADD COLUMN {name} TEXT GENERATED ALWAYS AS ({expression}) VIRTUAL')
+
+    # 各寫入函數仍以 CURRENT_TIMESTAMP 設定時間文字，epoch 由觸發器換算
+    assignments = _epoch_assignments('new.')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS defects_epoch_insert AFTER INSERT ON defects BEGIN
+            UPDATE defects SET {assignments} WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS defects_epoch_update
+        AFTER UPDATE OF created_time, updated_time, completion_time ON defects BEGIN
+            UPDATE defects SET {assignments} WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'UPDATE defects SET {_epoch_assignments()}')
+    ensure_managed_indexes(cursor)
+
+    for month in list_archive_months():
+        archive_conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            _sync_archive_schema(cursor.connection, archive_conn)
+            archive_conn.execute(f'UPDATE defects SET {_epoch_assignments()}')
+            archive_conn.commit()
+        finally:
+            archive_conn.close()
+
+def _migration_014_settings_tables(cursor):
+    """建立人員、登錄人員、產品名稱及通知設定資料表，並匯入舊版 JSON 設定檔（檔案保留不刪除）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS responsible_persons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            department TEXT NOT NULL,
+            display_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    for table in ('operators', 'products'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _create_data_version_triggers(cursor)
+    ensure_managed_indexes(cursor)
+
+    deadline_hours = _import_legacy_settings(cursor)
+    if deadline_hours and {**DEFECT_LEVEL_HOURS, **deadline_hours} != DEFECT_LEVEL_HOURS:
+        _recompute_sla_deadlines_tx(cursor.connection, {**DEFECT_LEVEL_HOURS, **deadline_hours})
+
+def _migration_015_archived_work_order_totals(cursor):
+    """建立已歸檔記錄的工單累計表，由既有歸檔資料庫回填後重建工單統計，歸檔後累計不良及不良率不再減少"""
+    _create_work_order_stats_tables(cursor)
+    live_ids = {row[0] for row in cursor.execute('SELECT id FROM defects')}
+    totals = {}
+    for month in list_archive_months():
+        archive_conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            rows = archive_conn.execute('''
+                SELECT id, work_order, quantity, work_order_total_qty, package_number, status FROM defects
+            ''').fetchall()
+        finally:
+            archive_conn.close()
+        # 已複製但尚未從主資料庫刪除（或被重新開啟）的記錄仍由即時資料統計
+        for defect_id, work_order, quantity, total_qty, package_number, status in rows:
+            if defect_id in live_ids:
+                continue
+            entry = totals.setdefault(work_order, [0, 0, 0, 0, 0])
+            entry[0] += quantity or 0
+            entry[1] = max(entry[1], total_qty or 0)
+            entry[2] += 1
+            entry[3] = max(entry[3], package_number or 0)
+            entry[4] += 1 if status == '已完成' else 0
+    cursor.executemany('''
+        INSERT OR REPLACE INTO archived_work_order_totals (work_order, total_defects, total_qty, record_count,
+                                                          max_package_number, completed_packages)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(work_order, *entry) for work_order, entry in totals.items()])
+    _rebuild_work_order_stats_tx(cursor.connection)
+
+def _repair_ng_method(conn):
+    """重新解析 OK品判定中有 NG 數量卻沒有 NG 處理方式的記錄（早期回填時被捨棄），回傳更新筆數"""
+    rows = conn.execute('''
+        SELECT id, resolution, quantity FROM defects
+        WHERE resolution_code = ? AND ng_qty > 0 AND ng_method IS NULL
+    ''', (RESOLUTION_OK_CODE,)).fetchall()
+    updates = []
+    for defect_id, resolution, quantity in rows:
+        fields = parse_resolution(resolution, quantity)
+        if fields and fields['ng_method']:
+            updates.append((fields['ok_qty'], fields['ng_qty'], fields['ng_method'], defect_id))
+    conn.executemany('UPDATE defects SET ok_qty = ?, ng_qty = ?, ng_method = ? WHERE id = ?', updates)
+    return len(updates)
+
+def _migration_016_repair_ng_method(cursor):
+    """修復回填時遺漏的 NG 處理方式（含歸檔資料庫）"""
+    _repair_ng_method(cursor.connection)
+    for month in list_archive_months():
+        archive_conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            _repair_ng_method(archive_conn)
+            archive_conn.commit()
+        finally:
+            archive_conn.close()
+
+# 依版本順序排列的遷移步驟，新增結構變更時請在最後追加新版本
+MIGRATIONS = [
+    (1, '建立基本資料表', _migration_001_base_schema),
+    (2, '新增流程管理欄位', _migration_002_workflow_columns),
+    (3, '修復責任部門分配', _migration_003_repair_departments),
+    (4, '建立次要索引', _migration_004_managed_indexes),
+    (5, '建立快照增量更新追蹤', _migration_005_snapshot_tracking),
+    (6, '建立工單統計表', _migration_006_work_order_stats),
+    (7, '建立包數序號表', _migration_007_package_sequences),
+    (8, '建立全文檢索索引', _migration_008_full_text_search),
+    (9, '新增結構化處理結果欄位', _migration_009_resolution_fields),
+    (10, '建立不良零件明細表', _migration_010_defect_components),
+    (11, '建立資料版本計數', _migration_011_data_version),
+    (12, '建立SLA截止時間索引', _migration_012_sla_deadline),
+    (13, '建立epoch時間欄位及日期產生欄位', _migration_013_epoch_timestamps),
+    (14, '建立設定資料表', _migration_014_settings_tables),
+    (15, '建立已歸檔工單累計表', _migration_015_archived_work_order_totals),
+    (16, '修復NG處理方式', _migration_016_repair_ng_method),
+]
+
+def get_data_version(scope='defects'):
+    """讀取資料版本：該範圍的資料表有任何異動（含其他程序）時遞增，可用於判斷快取是否過期"""
+    with db_connection() as conn:
+        row = conn.execute('SELECT version FROM data_version WHERE scope = ?', (scope,)).fetchone()
+    return row[0] if row else 0
+
+def get_schema_version(conn):
+    """獲取目前資料庫結構版本"""
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def run_migrations():
+    """依序執行尚未套用的遷移步驟，回傳本次套用的版本清單"""
+    applied = []
+    with db_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= get_schema_version(conn):
+                continue
+            # 以 BEGIN IMMEDIATE 鎖定寫入，並在鎖內再確認一次版本，避免多個程序重複套用
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version > get_schema_version(conn):
+                    migrate(conn.cursor())
+                    conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                                 (version, description))
+                    applied.append(version)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    for version in applied:
+        print(f"資料庫結構已更新至版本 {version}")
+    return applied
+
+@st.cache_resource
+def init_database():
+    """初始化資料庫結構（每個程序只執行一次）"""
+    return run_migrations()
+
+# 查詢計畫分析
+
+# 系統實際執行的查詢及範例參數，修改對應函數的SQL時請同步更新
+KNOWN_QUERIES = [
+    ('下一個包數', 'SELECT last_package_number FROM package_sequences WHERE work_order = ?', ('WO',)),
+    ('工單統計', 'SELECT * FROM work_order_stats WHERE work_order = ?', ('WO',)),
+    ('工單統計更新', 'SELECT SUM(quantity), MAX(work_order_total_qty), COUNT(*), MAX(package_number) '
+               'FROM defects WHERE work_order = ? GROUP BY work_order', ('WO',)),
+    ('依狀態查詢不良品', 'SELECT * FROM defects WHERE status = ? ORDER BY created_time DESC, id DESC', ('待處理',)),
+    ('追蹤頁篩選', 'SELECT * FROM defects WHERE status = ? AND responsible_dept = ? AND defect_level = ? '
+               'ORDER BY created_time DESC, id DESC LIMIT 20', ('待處理', '工程部', 'A級')),
+    ('查詢全部不良品', 'SELECT * FROM defects ORDER BY created_time DESC, id DESC', ()),
+    ('快照增量更新', 'SELECT * FROM defects WHERE updated_epoch >= ? ORDER BY updated_epoch DESC, id DESC', (0,)),
+    ('建立時間範圍', 'SELECT * FROM defects WHERE created_epoch >= ? AND created_epoch < ?', (0, 86400)),
+    ('依月份統計', 'SELECT created_month, SUM(quantity) FROM defects WHERE created_month >= ? GROUP BY created_month',
+               ('2024-01',)),
+    ('逾期檢查', "SELECT * FROM defects WHERE status = ? AND deadline_epoch < ? "
+             "ORDER BY deadline_epoch ASC, id ASC", ('待處理', 0)),
+    ('即將到期', "SELECT COUNT(*) FROM defects WHERE status IN ('待處理', '處理中') "
+             "AND deadline_epoch >= ? AND deadline_epoch < ?", (0, 3600)),
+    ('處理記錄', 'SELECT defect_id, action, department, operator, comment, timestamp FROM processing_logs '
+             'WHERE defect_id IN (?) ORDER BY defect_id, timestamp DESC', (1,)),
+    ('批次處理記錄', 'SELECT defect_id, action, department, operator, comment, timestamp FROM processing_logs '
+               'WHERE defect_id IN (?, ?, ?) ORDER BY defect_id, timestamp DESC', (1, 2, 3)),
+    ('零件不良統計', 'SELECT defect_components.component, SUM(defects.quantity) FROM defect_components '
+               'JOIN defects ON defects.id = defect_components.defect_id GROUP BY defect_components.component', ()),
+    ('工單零件不良統計', 'SELECT defect_components.component, SUM(defects.quantity) FROM defect_components '
+                 'JOIN defects ON defects.id = defect_components.defect_id WHERE defects.work_order = ? '
+                 'GROUP BY defect_components.component', ('WO',)),
+    ('期間零件不良統計', 'SELECT defect_components.component, defects.created_date, SUM(defects.quantity) '
+                 'FROM defect_components JOIN defects ON defects.id = defect_components.defect_id '
+                 'WHERE defects.created_epoch >= ? GROUP BY defect_components.component, defects.created_date', (0,)),
+]
+
+def explain_known_queries():
+    """對已知查詢執行 EXPLAIN QUERY PLAN，標記全表掃描及暫存排序"""
+    rows = []
+    with db_connection() as conn:
+        for name, query, params in KNOWN_QUERIES:
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+            details = [row[3] for row in plan]
+            full_scan = any(d.startswith('SCAN ') and 'INDEX' not in d for d in details)
+            temp_sort = any('TEMP B-TREE' in d for d in details)
+            rows.append({
+                '查詢': name,
+                '查詢計畫': ' / '.join(details),
+                '全表掃描': full_scan,
+                '暫存排序': temp_sort,
+            })
+    return pd.DataFrame(rows)
+
+def get_missing_managed_indexes():
+    """列出資料庫中缺少的受管理索引"""
+    with db_connection() as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [name for name, _, _ in MANAGED_INDEXES if name not in existing]
+
+# 查詢快取
+
+# 快取結果的存活時間（秒）及最多保留的結果數；資料版本遞增後舊結果不再命中，由 TTL 釋放
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get('DEFECT_QUERY_CACHE_TTL', '300'))
+QUERY_CACHE_MAX_ENTRIES = 256
+
+# 已註冊的快取查詢：函數名稱 -> (資料版本範圍, 原始函數)
+CACHED_QUERIES = {}
+
+class QueryCacheStats:
+    """各快取查詢的呼叫及未命中次數（全程序共用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._misses = {}
+
+    def record_call(self, name):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def record_miss(self, name):
+        with self._lock:
+            self._misses[name] = self._misses.get(name, 0) + 1
+
+    def to_frame(self):
+        """各查詢的呼叫、命中、未命中次數及命中率"""
+        columns = ['查詢', '呼叫次數', '命中', '未命中', '命中率(%)']
+        with self._lock:
+            rows = []
+            for name, calls in sorted(self._calls.items()):
+                misses = min(self._misses.get(name, 0), calls)
+                rows.append([name, calls, calls - misses, misses, round((calls - misses) / calls * 100, 1)])
+        return pd.DataFrame(rows, columns=columns)
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._misses.clear()
+
+@st.cache_resource
+def get_query_cache_stats():
+    """獲取全域共用的查詢快取統計"""
+    return QueryCacheStats()
+
+@st.cache_data(ttl=QUERY_CACHE_TTL_SECONDS, max_entries=QUERY_CACHE_MAX_ENTRIES, show_spinner=False)
+def _run_cached_query(name, data_version, time_bucket, args, kwargs):
+    """快取鍵為 (查詢名稱, 資料版本, 時間區段, 參數)，只有未命中時才會執行"""
+    get_query_cache_stats().record_miss(name)
+    return CACHED_QUERIES[name][1](*args, **kwargs)
+
+def cached_query(scope='defects', refresh_seconds=None):
+    """
+    以 st.cache_data 快取讀取函數，所有工作階段共用同一份結果
+
+    快取鍵包含資料版本：寫入時由觸發器遞增（含其他程序的寫入），下次讀取即改用新結果。
+    結果與目前時間有關的查詢以 refresh_seconds 分段，最多延遲該秒數。原始函數可由 __wrapped__ 呼叫。
+    """
+    def decorator(func):
+        CACHED_QUERIES[func.__name__] = (scope, func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            get_query_cache_stats().record_call(func.__name__)
+            time_bucket = int(time.time() // refresh_seconds) if refresh_seconds else None
+            return _run_cached_query(func.__name__, get_data_version(scope), time_bucket, args, kwargs)
+        return wrapper
+    return decorator
+
+def clear_query_cache():
+    """清除所有快取的查詢結果及統計"""
+    _run_cached_query.clear()
+    get_query_cache_stats().reset()
 
 # 用戶認證相關函數
 
@@ -305,21 +1061,20 @@ def verify_password(password: str, password_hash: str) -> bool:
 
 def authenticate_user(username: str, password: str) -> Optional[Dict]:
     """用戶認證"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT id, username, password_hash, name, department, position, role, is_active
-        FROM users WHERE username = ? AND is_active = 1
-    ''', (username,))
+        cursor.execute('''
+            SELECT id, username, password_hash, name, department, position, role, is_active
+            FROM users WHERE username = ? AND is_active = 1
+        ''', (username,))
 
-    user = cursor.fetchone()
+        user = cursor.fetchone()
 
     if user and verify_password(password, user[2]):
         # 更新最後登入時間
-        cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user[0],))
-        conn.commit()
-        conn.close()
+        execute_write('login', lambda conn: conn.execute(
+            'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user[0],)))
 
         return {
             'id': user[0],
@@ -330,100 +1085,302 @@ def authenticate_user(username: str, password: str) -> Optional[Dict]:
             'role': user[6]
         }
 
-    conn.close()
     return None
 
+@cached_query('users')
 def get_all_users():
     """獲取所有用戶"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT id, username, name, department, position, role, created_time, last_login, is_active
-        FROM users ORDER BY created_time DESC
-    ''')
+        cursor.execute('''
+            SELECT id, username, name, department, position, role, created_time, last_login, is_active
+            FROM users ORDER BY created_time DESC
+        ''')
 
-    users = cursor.fetchall()
-    conn.close()
+        users = cursor.fetchall()
     return users
 
 def add_user(username: str, password: str, name: str, department: str, position: str, role: str) -> bool:
     """添加新用戶"""
+    password_hash = hash_password(password)
     try:
-        conn = sqlite3.connect('defect_management.db')
-        cursor = conn.cursor()
-
-        password_hash = hash_password(password)
-
-        cursor.execute('''
+        execute_write('user', lambda conn: conn.execute('''
             INSERT INTO users (username, password_hash, name, department, position, role)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (username, password_hash, name, department, position, role))
-
-        conn.commit()
-        conn.close()
+        ''', (username, password_hash, name, department, position, role)))
         return True
     except sqlite3.IntegrityError:
         return False
 
 def update_user_status(user_id: int, is_active: bool):
     """更新用戶狀態"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
-
-    cursor.execute('UPDATE users SET is_active = ? WHERE id = ?', (1 if is_active else 0, user_id))
-
-    conn.commit()
-    conn.close()
+    execute_write('user', lambda conn: conn.execute(
+        'UPDATE users SET is_active = ? WHERE id = ?', (1 if is_active else 0, user_id)))
 
 def reset_user_password(user_id: int, new_password: str):
     """重設用戶密碼"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
-
     password_hash = hash_password(new_password)
-    cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
-
-    conn.commit()
-    conn.close()
+    execute_write('user', lambda conn: conn.execute(
+        'UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id)))
 
 # 資料庫操作函數
 
+# 各等級的處理時限（小時）
+DEFECT_LEVEL_HOURS = {'A級': 4, 'B級': 8, 'C級': 24}
+
+# 時間戳記正規化
+
+# 本地時區固定為 UTC+8；產生欄位（建立日期／週／月份）的運算式以此偏移建立，結構建立後不可變更
+LOCAL_UTC_OFFSET_SECONDS = 8 * 3600
+LOCAL_TIMEZONE = timezone(timedelta(seconds=LOCAL_UTC_OFFSET_SECONDS))
+
+# 以 UTC epoch 整數儲存的時間欄位：(文字欄位, epoch 欄位)，文字欄位保留供顯示
+DEFECT_EPOCH_COLUMNS = [
+    ('created_time', 'created_epoch'),
+    ('updated_time', 'updated_epoch'),
+    ('completion_time', 'completion_epoch'),
+]
+
+# 由 created_epoch 產生的本地日期、ISO 週（YYYY-Www）及月份：(欄位名稱, 運算式)
+_LOCAL_CREATED_EPOCH = f"created_epoch + {LOCAL_UTC_OFFSET_SECONDS}, 'unixepoch'"
+DEFECT_GENERATED_COLUMNS = [
+    ('created_date', f"date({_LOCAL_CREATED_EPOCH})"),
+    # ISO 週的年份及週次以該週星期四計算
+    ('created_week', f"printf('%s-W%02d', strftime('%Y', {_LOCAL_CREATED_EPOCH}, 'weekday 0', '-3 days'), "
+                     f"(strftime('%j', {_LOCAL_CREATED_EPOCH}, 'weekday 0', '-3 days') - 1) / 7 + 1)"),
+    ('created_month', f"strftime('%Y-%m', {_LOCAL_CREATED_EPOCH})"),
+]
+
+def _epoch_assignments(prefix=''):
+    """由時間文字（UTC）換算 epoch 欄位的 SET 子句，觸發器中 prefix 為 'new.'"""
+    return ', '.join(f"{epoch_col} = CAST(strftime('%s', {prefix}{text_col}) AS INTEGER)"
+                     for text_col, epoch_col in DEFECT_EPOCH_COLUMNS)
+
+def to_epoch(value):
+    """將時間轉為 UTC epoch 秒數：數字視為 epoch，不含時區的日期／時間（含字串）視為本地時間"""
+    if value is None:
+        return None
+    if pd.api.types.is_number(value):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize(LOCAL_TIMEZONE)
+    return int(timestamp.timestamp())
+
+def local_now():
+    """目前的本地時間（UTC+8）"""
+    return datetime.now(LOCAL_TIMEZONE)
+
+def to_local_datetime(epoch):
+    """epoch 秒數轉為本地時間"""
+    return datetime.fromtimestamp(int(epoch), LOCAL_TIMEZONE)
+
+def iso_week_key(moment):
+    """與 created_week 相同格式的 ISO 週（YYYY-Www）"""
+    year, week, _ = moment.isocalendar()
+    return f'{year}-W{week:02d}'
+
+def _epoch_from_text(values, is_utc=True):
+    """時間文字欄位轉為 epoch 秒數，供缺少 epoch 欄位的舊快照及歸檔資料使用"""
+    epochs = (pd.to_datetime(values, errors='coerce') - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
+    return epochs if is_utc else epochs - LOCAL_UTC_OFFSET_SECONDS
+
+def add_local_time_columns(df):
+    """
+    為載入的不良品資料補齊分析用時間欄位，每次載入只換算一次：
+    *_epoch 整數、created_at／completed_at／deadline_at 本地時間，以及 created_date／created_week／created_month
+    """
+    # 截止時間文字為本地時間，其餘時間文字為 UTC
+    for text_col, epoch_col in DEFECT_EPOCH_COLUMNS + [('deadline', 'deadline_epoch')]:
+        epochs = df[epoch_col] if epoch_col in df.columns else pd.Series(float('nan'), index=df.index)
+        missing = epochs.isna()
+        if missing.any() and text_col in df.columns:
+            epochs = epochs.where(~missing, _epoch_from_text(df.loc[missing, text_col], is_utc=text_col != 'deadline'))
+        df[epoch_col] = epochs
+
+    offset = pd.Timedelta(seconds=LOCAL_UTC_OFFSET_SECONDS)
+    for epoch_col, target in [('created_epoch', 'created_at'), ('completion_epoch', 'completed_at'),
+                              ('deadline_epoch', 'deadline_at')]:
+        df[target] = pd.to_datetime(df[epoch_col], unit='s') + offset
+
+    created_at = df['created_at']
+    iso = created_at.dt.isocalendar()
+    derived = {
+        'created_date': created_at.dt.strftime('%Y-%m-%d'),
+        'created_week': iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2),
+        'created_month': created_at.dt.strftime('%Y-%m'),
+    }
+    for name, values in derived.items():
+        if name not in df.columns:
+            df[name] = values
+        elif df[name].isna().any():
+            df[name] = df[name].fillna(values)
+    return df
+
+# SLA 截止時間
+
+# 未結案的狀態（逾期檢查對象）
+SLA_OPEN_STATUSES = ['待處理', '處理中']
+# 儀表板「即將到期」提醒的時間範圍（分鐘）
+SLA_DUE_SOON_MINUTES = 60
+
+def get_processing_deadline_hours():
+    """各等級處理時限（小時），以通知設定為準，未設定的等級使用預設值"""
+    hours = dict(DEFECT_LEVEL_HOURS)
+    hours.update(get_notification_settings().get('processing_deadlines', {}))
+    return hours
+
+def _time_text_to_epoch(text):
+    """資料庫時間文字（與 CURRENT_TIMESTAMP 相同，為 UTC）轉為 epoch 秒數"""
+    return int(datetime.strptime(text, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+
+def compute_sla_deadline(created_epoch, defect_level, deadline_hours):
+    """依建立時間及等級時限計算截止時間，回傳 (epoch 秒數, 本地時間文字)"""
+    deadline_epoch = int(created_epoch + deadline_hours[defect_level] * 3600)
+    return deadline_epoch, to_local_datetime(deadline_epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def _sla_deadline_sql(deadline_hours):
+    """以 SQL 依 created_time 及等級時限計算截止時間 epoch，回傳 (SQL運算式, 參數)"""
+    cases = ' '.join('WHEN ? THEN ?' for _ in deadline_hours)
+    params = [value for level, hours in deadline_hours.items() for value in (level, hours * 3600)]
+    return f"CAST(strftime('%s', created_time) AS INTEGER) + (CASE defect_level {cases} END)", params
+
+def _recompute_sla_deadlines_tx(conn, deadline_hours):
+    """處理時限變更後重新計算未結案記錄的截止時間（寫入意圖），回傳更新筆數"""
+    expression, params = _sla_deadline_sql(deadline_hours)
+    placeholders = ', '.join('?' * len(SLA_OPEN_STATUSES))
+    # 截止時間為衍生資料：只更新實際改變的記錄，且不更動 updated_time（不視為使用者修改）
+    cursor = conn.execute(f'''
+        UPDATE defects
+        SET deadline_epoch = {expression}, deadline = datetime(({expression}) + ?, 'unixepoch')
+        WHERE status IN ({placeholders}) AND deadline_epoch IS NOT ({expression})
+    ''', params + params + [LOCAL_UTC_OFFSET_SECONDS] + SLA_OPEN_STATUSES + params)
+    if cursor.rowcount:
+        # updated_epoch 未變，增量快照看不到這些記錄，另以 sla 版本通知快照整批重新讀取
+        conn.execute('''
+            INSERT INTO data_version (scope, version) VALUES ('sla', 1)
+            ON CONFLICT(scope) DO UPDATE SET version = version + 1
+        ''')
+    return cursor.rowcount
+
+@cached_query(refresh_seconds=60)
+def query_overdue_defects(now=None, **filters):
+    """查詢已逾期的未結案不良品（以 status + deadline_epoch 索引範圍查詢）"""
+    now = time.time() if now is None else now
+    # status IN (...) 涵蓋多段索引範圍，SQLite 需要暫存排序；逐一狀態查詢可直接依索引順序讀取，再合併
+    frames = [query_defects(status=status, deadline_before=now, order_by='deadline_epoch', descending=False,
+                            **filters)
+              for status in SLA_OPEN_STATUSES]
+    non_empty = [frame for frame in frames if not frame.empty]
+    if not non_empty:
+        return frames[0]
+    return pd.concat(non_empty, ignore_index=True).sort_values(['deadline_epoch', 'id'], ignore_index=True)
+
+@cached_query(refresh_seconds=60)
+def count_due_soon_defects(minutes=SLA_DUE_SOON_MINUTES, now=None):
+    """計算 minutes 分鐘內即將到期（尚未逾期）的未結案不良品數量"""
+    now = time.time() if now is None else now
+    return count_defects.__wrapped__(status=SLA_OPEN_STATUSES, deadline_after=now, deadline_before=now + minutes * 60)
+
+# 工單統計彙總：依工單重新計算的SQL，單一工單更新與全部重建共用
+# 依不良品記錄彙總工單統計的欄位（與 work_order_stats 欄位順序相同）
+WORK_ORDER_STATS_COLUMNS = '''
+    work_order,
+    COALESCE(SUM(quantity), 0) AS total_defects,
+    COALESCE(MAX(work_order_total_qty), 0) AS total_qty,
+    COUNT(*) AS record_count,
+    COALESCE(MAX(package_number), 0) AS max_package_number,
+    SUM(CASE WHEN status = '已完成' THEN 1 ELSE 0 END) AS completed_packages
+'''
+
+def _work_order_stats_select(where=''):
+    """即時記錄與已歸檔累計合併的工單統計查詢，where 條件同時套用於兩者"""
+    return f'''
+        SELECT work_order, SUM(total_defects), MAX(total_qty), SUM(record_count),
+               MAX(max_package_number), SUM(completed_packages)
+        FROM (
+            SELECT {WORK_ORDER_STATS_COLUMNS} FROM defects {where} GROUP BY work_order
+            UNION ALL
+            SELECT work_order, total_defects, total_qty, record_count, max_package_number, completed_packages
+            FROM archived_work_order_totals {where}
+        )
+        GROUP BY work_order
+    '''
 
-def get_next_package_number(work_order):
-    """獲取指定工單的下一個包數"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
+def _refresh_work_order_stats(conn, work_order):
+    """在同一交易中重新計算單一工單的統計（只讀取該工單的記錄及歸檔累計）"""
+    conn.execute('DELETE FROM work_order_stats WHERE work_order = ?', (work_order,))
+    conn.execute(f'''
+        INSERT INTO work_order_stats (work_order, total_defects, total_qty, record_count,
+                                      max_package_number, completed_packages)
+        {_work_order_stats_select('WHERE work_order = ?')}
+    ''', (work_order, work_order))
+
+def _refresh_work_order_stats_for_defect(conn, defect_id):
+    """重新計算指定不良品所屬工單的統計"""
+    row = conn.execute('SELECT work_order FROM defects WHERE id = ?', (defect_id,)).fetchone()
+    if row:
+        _refresh_work_order_stats(conn, row[0])
+
+def _rebuild_work_order_stats_tx(conn):
+    """重建全部工單統計（寫入意圖），回傳工單數"""
+    conn.execute('DELETE FROM work_order_stats')
+    conn.execute(f'''
+        INSERT INTO work_order_stats (work_order, total_defects, total_qty, record_count,
+                                      max_package_number, completed_packages)
+        {_work_order_stats_select()}
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM work_order_stats').fetchone()[0]
 
-    cursor.execute('''
-        SELECT MAX(package_number) FROM defects WHERE work_order = ?
+def rebuild_work_order_stats():
+    """從不良品記錄重建工單統計表，回傳工單數"""
+    return execute_write('rebuild_stats', _rebuild_work_order_stats_tx)
+
+def _allocate_package_number(conn, work_order):
+    """在新增不良品的交易中配發工單的下一個包數（遞增後讀取，寫入鎖確保不重複）"""
+    cursor = conn.execute('''
+        UPDATE package_sequences SET last_package_number = last_package_number + 1
+        WHERE work_order = ?
     ''', (work_order,))
+    if cursor.rowcount == 0:
+        # 第一次配發時以現有記錄的最大包數為起點
+        conn.execute('''
+            INSERT INTO package_sequences (work_order, last_package_number)
+            SELECT ?, COALESCE(MAX(package_number), 0) + 1 FROM defects WHERE work_order = ?
+        ''', (work_order, work_order))
+    return conn.execute('SELECT last_package_number FROM package_sequences WHERE work_order = ?',
+                        (work_order,)).fetchone()[0]
+
+def get_next_package_number(work_order):
+    """獲取指定工單的下一個包數（僅供預覽，實際包數於新增時配發）"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT last_package_number FROM package_sequences WHERE work_order = ?
+        ''', (work_order,))
 
-    result = cursor.fetchone()[0]
-    conn.close()
+        row = cursor.fetchone()
 
-    return (result + 1) if result else 1
+    return (row[0] + 1) if row and row[0] else 1
 
+@cached_query()
 def get_work_order_stats(work_order):
     """獲取指定工單的統計信息"""
-    conn = sqlite3.connect('defect_management.db')
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    # 獲取該工單的總不良數量和工單總數
-    cursor.execute('''
-        SELECT SUM(quantity) as total_defects,
-               MAX(work_order_total_qty) as total_qty,
-               COUNT(*) as record_count
-        FROM defects
-        WHERE work_order = ?
-    ''', (work_order,))
+        # 從工單統計表讀取該工單的總不良數量和工單總數
+        cursor.execute('''
+            SELECT total_defects, total_qty, record_count, max_package_number, completed_packages
+            FROM work_order_stats
+            WHERE work_order = ?
+        ''', (work_order,))
 
-    result = cursor.fetchone()
-    conn.close()
+        result = cursor.fetchone() or (0, 0, 0, 0, 0)
 
-    total_defects = result[0] if result[0] else 0
-    total_qty = result[1] if result[1] else 0
-    record_count = result[2] if result[2] else 0
+    total_defects, total_qty, record_count, max_package_number, completed_packages = result
 
     defect_rate = (total_defects / total_qty * 100) if total_qty > 0 else 0
 
@@ -431,32 +1388,48 @@ def get_work_order_stats(work_order):
         'total_defects': total_defects,
         'total_qty': total_qty,
         'record_count': record_count,
+        'max_package_number': max_package_number,
+        'completed_packages': completed_packages,
         'defect_rate': defect_rate
     }
 
-def add_defect(defect_data):
-    conn = sqlite3.connect('defect_management.db')
+@cached_query()
+def get_all_work_order_stats():
+    """獲取所有工單的統計信息"""
+    query = '''
+        SELECT work_order, total_defects, total_qty, record_count, max_package_number, completed_packages,
+               CASE WHEN total_qty > 0 THEN total_defects * 100.0 / total_qty ELSE 0 END AS defect_rate
+        FROM work_order_stats
+    '''
+    with db_connection() as conn:
+        return pd.read_sql_query(query, conn)
+
+def _add_defect_tx(conn, defect_data, deadline_hours):
+    """新增不良品（寫入意圖），回傳 (記錄ID, 配發的包數)"""
     cursor = conn.cursor()
 
-    # 計算截止時間
-    level_hours = {'A級': 4, 'B級': 8, 'C級': 24}
-    deadline = datetime.now() + timedelta(hours=level_hours[defect_data['defect_level']])
+    # 包數於同一交易中配發，避免同時登錄同一工單時取得相同包數
+    package_number = _allocate_package_number(conn, defect_data['work_order'])
+
+    # 計算截止時間（建立時間為寫入當下）
+    deadline_epoch, deadline = compute_sla_deadline(time.time(), defect_data['defect_level'], deadline_hours)
 
     cursor.execute('''
         INSERT INTO defects (work_order, product_name, defect_type, defect_level,
-                           quantity, package_number, description, responsible_dept, deadline, assigned_person, logged_by,
+                           quantity, package_number, description, responsible_dept, deadline, deadline_epoch, assigned_person, logged_by,
                            primary_dept, secondary_dept, primary_person, secondary_person, approval_status, work_order_total_qty, supplier, component)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         defect_data['work_order'],
         defect_data['product_name'],
         defect_data['defect_type'],
         defect_data['defect_level'],
         defect_data['quantity'],
-        defect_data['package_number'],
+        package_number,
         defect_data['description'],
         defect_data['primary_dept'],  # 主要責任部門作為responsible_dept
         deadline,
+        deadline_epoch,
         defect_data['primary_person'],  # 主要責任人作為assigned_person
         defect_data.get('operator', '系統'),
         defect_data['primary_dept'],
@@ -477,60 +1450,722 @@ def add_defect(defect_data):
         VALUES (?, ?, ?, ?, ?)
     ''', (defect_id, '新增不良品', '品保部', defect_data.get('operator', '系統'), '不良品登錄'))
 
-    conn.commit()
-    conn.close()
-    return defect_id
+    _refresh_work_order_stats(conn, defect_data['work_order'])
 
-def get_defects(status=None):
-    conn = sqlite3.connect('defect_management.db')
-    query = '''
-        SELECT id, work_order, product_name, defect_type, defect_level, quantity,
-               package_number, description, responsible_dept, status, created_time, deadline,
-               assigned_person, resolution, completion_time, logged_by,
-               primary_dept, secondary_dept, primary_person, secondary_person, approval_status, approval_result,
-               work_order_total_qty, supplier, component, defective_component, third_dept, third_person, third_approval_status
-        FROM defects
-    '''
+    return defect_id, package_number
 
-    if status:
-        query += " WHERE status = ?"
-    query += " ORDER BY created_time DESC"
-
-    df = pd.read_sql_query(query, conn, params=(status,) if status else None)
-    conn.close()
-    
-    # 確保所有文本字段都是字符串格式，避免bytes類型問題
-    text_columns = ['work_order', 'product_name', 'defect_type', 'defect_level', 'description', 
-                   'responsible_dept', 'status', 'assigned_person', 'resolution', 'logged_by',
-                   'primary_dept', 'secondary_dept', 'primary_person', 'secondary_person', 
-                   'approval_status', 'approval_result', 'supplier', 'component', 'defective_component', 'third_dept', 
-                   'third_person', 'third_approval_status']
-    
-    for col in text_columns:
+def add_defect(defect_data):
+    """新增不良品，回傳 (新記錄的ID, 配發的包數)"""
+    return execute_write('register', _add_defect_tx, defect_data, get_processing_deadline_hours())
+
+# 批次登錄
+DEFECT_TYPES = ["檢具NG", "表面缺陷", "組裝不良", "功能異常", "外觀不良", "其他"]
+
+# 批次上傳檔案的欄位名稱對照（中文標題 -> 欄位）
+BULK_UPLOAD_COLUMNS = {
+    '工單號碼': 'work_order',
+    '產品名稱': 'product_name',
+    '不良類型': 'defect_type',
+    '不良等級': 'defect_level',
+    '不良數量': 'quantity',
+    '問題描述': 'description',
+    '主要責任部門': 'primary_dept',
+    '次要責任部門': 'secondary_dept',
+    '主要責任人': 'primary_person',
+    '次要責任人': 'secondary_person',
+    '工單總數': 'work_order_total_qty',
+}
+
+# 匯入歷史資料時可額外提供的欄位
+IMPORT_OPTIONAL_COLUMNS = {
+    '建立時間': 'created_time',
+    '狀態': 'status',
+    '完成時間': 'completion_time',
+}
+
+DEFECT_STATUSES = ['待處理', '處理中', '已完成']
+
+def get_default_departments(defect_type):
+    """依不良品類型判定主要和次要責任部門（外觀相關由品保主責，其餘由工程主責）"""
+    if defect_type in ["外觀不良", "表面缺陷"]:
+        return "品保部", "工程部"
+    return "工程部", "品保部"
+
+def _clean_text(value):
+    """將上傳資料的儲存格轉為去除空白的字串，空值轉為空字串"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value).strip()
+
+def _parse_time_text(value):
+    """
+    將時間字串轉為資料庫格式（UTC，與 CURRENT_TIMESTAMP 相同），不含時區的時間視為本地時間
+    空值回傳 None，格式錯誤拋出 ValueError
+    """
+    if not value:
+        return None
+    timestamp = pd.Timestamp(value)
+    if pd.isna(timestamp):
+        raise ValueError(value)
+    return datetime.fromtimestamp(to_epoch(timestamp), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def validate_defect_records(records, start_row=1):
+    """
+    驗證批次登錄資料並補上預設值
+    回傳 (正規化後的記錄列表, 錯誤訊息列表)，錯誤訊息以資料列號（從 start_row 起算）標示
+    """
+    cleaned = []
+    errors = []
+    for row_number, record in enumerate(records, start=start_row):
+        row_errors = []
+        data = {key: _clean_text(record.get(key)) for key in BULK_UPLOAD_COLUMNS.values()}
+        optional = {key: _clean_text(record.get(key)) for key in IMPORT_OPTIONAL_COLUMNS.values()}
+
+        for key, label in [('work_order', '工單號碼'), ('product_name', '產品名稱'), ('primary_person', '主要責任人'),
+                           ('secondary_person', '次要責任人')]:
+            if not data[key]:
+                row_errors.append(f"缺少{label}")
+
+        if data['defect_type'] not in DEFECT_TYPES:
+            row_errors.append(f"不良類型「{data['defect_type']}」不正確")
+        if data['defect_level'] not in DEFECT_LEVEL_HOURS:
+            row_errors.append(f"不良等級「{data['defect_level']}」不正確")
+
+        try:
+            quantity = int(float(data['quantity']))
+            if quantity <= 0:
+                raise ValueError
+        except ValueError:
+            row_errors.append(f"不良數量「{data['quantity']}」必須為正整數")
+            quantity = 0
+
+        try:
+            total_qty = int(float(data['work_order_total_qty'])) if data['work_order_total_qty'] else 0
+        except ValueError:
+            row_errors.append(f"工單總數「{data['work_order_total_qty']}」必須為整數")
+            total_qty = 0
+
+        for key, label in [('created_time', '建立時間'), ('completion_time', '完成時間')]:
+            try:
+                data[key] = _parse_time_text(optional[key])
+            except (ValueError, TypeError):
+                row_errors.append(f"{label}「{optional[key]}」格式不正確")
+        if optional['status'] and optional['status'] not in DEFECT_STATUSES:
+            row_errors.append(f"狀態「{optional['status']}」不正確")
+        data['status'] = optional['status'] or None
+
+        if row_errors:
+            errors.append(f"第{row_number}列：{'、'.join(row_errors)}")
+            continue
+
+        default_primary, default_secondary = get_default_departments(data['defect_type'])
+        data['primary_dept'] = data['primary_dept'] or default_primary
+        data['secondary_dept'] = data['secondary_dept'] or default_secondary
+        data['quantity'] = quantity
+        data['work_order_total_qty'] = total_qty
+        cleaned.append(data)
+
+    return cleaned, errors
+
+def _add_defects_bulk_tx(conn, records, operator, deadline_hours, log_comment='不良品批次登錄'):
+    """批次新增不良品（寫入意圖），回傳 [(記錄ID, 包數), ...]"""
+    # 依工單一次配發連續的包數區間
+    counts = {}
+    for record in records:
+        counts[record['work_order']] = counts.get(record['work_order'], 0) + 1
+
+    next_numbers = {}
+    for work_order, count in counts.items():
+        cursor = conn.execute('''
+            UPDATE package_sequences SET last_package_number = last_package_number + ?
+            WHERE work_order = ?
+        ''', (count, work_order))
+        if cursor.rowcount == 0:
+            conn.execute('''
+                INSERT INTO package_sequences (work_order, last_package_number)
+                SELECT ?, COALESCE(MAX(package_number), 0) + ? FROM defects WHERE work_order = ?
+            ''', (work_order, count, work_order))
+        last = conn.execute('SELECT last_package_number FROM package_sequences WHERE work_order = ?',
+                            (work_order,)).fetchone()[0]
+        next_numbers[work_order] = last - count + 1
+
+    now = time.time()
+    package_numbers = []
+    defect_rows = []
+    for record in records:
+        package_number = next_numbers[record['work_order']]
+        next_numbers[record['work_order']] += 1
+        package_numbers.append(package_number)
+        # 匯入的歷史資料以原建立時間計算截止時間，未提供時間的記錄沿用資料庫預設值
+        created_time = record.get('created_time')
+        created_epoch = _time_text_to_epoch(created_time) if created_time else now
+        deadline_epoch, deadline = compute_sla_deadline(created_epoch, record['defect_level'], deadline_hours)
+        status = record.get('status')
+        approval_status = '已簽核通過' if status == '已完成' else '待主要單位處理'
+        defect_rows.append((
+            record['work_order'], record['product_name'], record['defect_type'], record['defect_level'],
+            record['quantity'], package_number, record['description'],
+            record['primary_dept'], deadline, deadline_epoch, record['primary_person'], operator,
+            record['primary_dept'], record['secondary_dept'], record['primary_person'], record['secondary_person'],
+            approval_status, record['work_order_total_qty'], '', '',
+            created_time, status, record.get('completion_time')
+        ))
+
+    conn.executemany('''
+        INSERT INTO defects (work_order, product_name, defect_type, defect_level,
+                           quantity, package_number, description, responsible_dept, deadline, deadline_epoch, assigned_person, logged_by,
+                           primary_dept, secondary_dept, primary_person, secondary_person, approval_status, work_order_total_qty, supplier, component,
+                           created_time, status, completion_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, '待處理'), ?)
+    ''', defect_rows)
+
+    # 寫入鎖期間 AUTOINCREMENT 配發的ID連續，由最後一筆ID往回推算
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    defect_ids = list(range(last_id - len(records) + 1, last_id + 1))
+
+    conn.executemany('''
+        INSERT INTO processing_logs (defect_id, action, department, operator, comment)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(defect_id, '新增不良品', '品保部', operator, log_comment) for defect_id in defect_ids])
+
+    for work_order in counts:
+        _refresh_work_order_stats(conn, work_order)
+
+    return list(zip(defect_ids, package_numbers))
+
+def add_defects_bulk(records, operator='系統'):
+    """
+    批次新增不良品，所有記錄在同一交易中寫入
+    資料驗證失敗時不寫入任何記錄並拋出 ValueError
+    """
+    cleaned, errors = validate_defect_records(records)
+    if errors:
+        raise ValueError('\n'.join(errors))
+    if not cleaned:
+        return []
+    return execute_write('register_bulk', _add_defects_bulk_tx, cleaned, operator, get_processing_deadline_hours())
+
+def read_bulk_upload(uploaded_file):
+    """讀取批次上傳的CSV檔案，將中文欄位標題轉為資料欄位"""
+    df = pd.read_csv(uploaded_file, dtype=str, encoding='utf-8-sig', keep_default_na=False)
+    df.columns = [str(col).strip() for col in df.columns]
+    return df.rename(columns=BULK_UPLOAD_COLUMNS)
+
+# 歷史資料匯入
+
+def _iter_excel_chunks(source, chunk_size):
+    """以唯讀模式逐列讀取Excel第一個工作表，每次產生固定筆數的 DataFrame"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("匯入Excel需要安裝 openpyxl 套件（pip install openpyxl），或先轉存為CSV")
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col).strip() if col is not None else '' for col in header]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+def iter_import_chunks(source, file_type='csv', chunk_size=IMPORT_CHUNK_SIZE):
+    """逐批讀取匯入檔案，記憶體用量只與批次大小有關"""
+    if file_type in ('xlsx', 'excel'):
+        yield from _iter_excel_chunks(source, chunk_size)
+        return
+    for chunk in pd.read_csv(source, dtype=str, encoding='utf-8-sig', keep_default_na=False,
+                             chunksize=chunk_size):
+        chunk.columns = [str(col).strip() for col in chunk.columns]
+        yield chunk
+
+def import_defects_stream(source, file_type='csv', chunk_size=IMPORT_CHUNK_SIZE, operator='系統匯入',
+                          column_mapping=None, progress_callback=None, max_errors=1000):
+    """
+    串流匯入不良品歷史資料，每個批次驗證後以單一交易寫入
+
+    column_mapping 可將外部系統（MES/ERP）的欄位名稱對應到資料欄位，
+    驗證失敗的資料列會略過並記錄在回傳結果的 errors 中。
+    progress_callback(已讀取筆數, 已匯入筆數, 錯誤筆數) 於每個批次提交後呼叫。
+    """
+    mapping = {**BULK_UPLOAD_COLUMNS, **IMPORT_OPTIONAL_COLUMNS, **(column_mapping or {})}
+    deadline_hours = get_processing_deadline_hours()
+    summary = {'total': 0, 'imported': 0, 'error_count': 0, 'errors': []}
+
+    for chunk in iter_import_chunks(source, file_type, chunk_size):
+        chunk = chunk.rename(columns=mapping)
+        start_row = summary['total'] + 1
+        summary['total'] += len(chunk)
+
+        cleaned, errors = validate_defect_records(chunk.to_dict('records'), start_row=start_row)
+        if cleaned:
+            execute_write('import', _add_defects_bulk_tx, cleaned, operator, deadline_hours, '歷史資料匯入')
+            summary['imported'] += len(cleaned)
+
+        summary['error_count'] += len(errors)
+        remaining = max_errors - len(summary['errors'])
+        if remaining > 0:
+            summary['errors'].extend(errors[:remaining])
+
+        if progress_callback:
+            progress_callback(summary['total'], summary['imported'], summary['error_count'])
+
+    return summary
+
+# 不良品查詢可投影的欄位
+DEFECT_COLUMNS = [
+    'id', 'work_order', 'product_name', 'defect_type', 'defect_level', 'quantity',
+    'package_number', 'description', 'responsible_dept', 'status', 'created_time', 'updated_time', 'deadline',
+    'assigned_person', 'resolution', 'completion_time', 'logged_by',
+    'primary_dept', 'secondary_dept', 'primary_person', 'secondary_person', 'approval_status', 'approval_result',
+    'work_order_total_qty', 'supplier', 'component', 'defective_component', 'third_dept', 'third_person', 'third_approval_status',
+    'resolution_code', 'ok_qty', 'ng_qty', 'ng_method', 'resolution_note', 'deadline_epoch',
+    'created_epoch', 'updated_epoch', 'completion_epoch', 'created_date', 'created_week', 'created_month'
+]
+
+# 需要轉為字串的文字欄位
+DEFECT_TEXT_COLUMNS = ['work_order', 'product_name', 'defect_type', 'defect_level', 'description',
+                       'responsible_dept', 'status', 'assigned_person', 'resolution', 'logged_by',
+                       'primary_dept', 'secondary_dept', 'primary_person', 'secondary_person',
+                       'approval_status', 'approval_result', 'supplier', 'component', 'defective_component', 'third_dept',
+                       'third_person', 'third_approval_status', 'resolution_code', 'ng_method', 'resolution_note']
+
+# 可排序的欄位
+DEFECT_SORT_COLUMNS = ['created_time', 'updated_time', 'deadline', 'completion_time', 'id', 'quantity', 'work_order',
+                       'created_epoch', 'updated_epoch', 'deadline_epoch']
+
+def _build_defect_filters(status=None, responsible_dept=None, defect_level=None, work_order=None,
+                          assigned_person=None, created_from=None, created_to=None, updated_since=None,
+                          deadline_after=None, deadline_before=None):
+    """組合不良品查詢條件，回傳 (WHERE子句列表, 參數列表)"""
+    conditions = []
+    params = []
+    for column, value in [('status', status), ('responsible_dept', responsible_dept),
+                          ('defect_level', defect_level), ('work_order', work_order),
+                          ('assigned_person', assigned_person)]:
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            values = list(value)
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        else:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    # 時間範圍以 epoch 秒數比較（to_epoch：數字為 epoch，不含時區的時間為本地時間）
+    if created_from is not None:
+        conditions.append("created_epoch >= ?")
+        params.append(to_epoch(created_from))
+    if created_to is not None:
+        conditions.append("created_epoch < ?")
+        params.append(to_epoch(created_to))
+    if updated_since is not None:
+        conditions.append("updated_epoch >= ?")
+        params.append(to_epoch(updated_since))
+    if deadline_after is not None:
+        conditions.append("deadline_epoch >= ?")
+        params.append(int(deadline_after))
+    if deadline_before is not None:
+        conditions.append("deadline_epoch < ?")
+        params.append(int(deadline_before))
+    return conditions, params
+
+def _defect_select_list(columns):
+    """組合查詢欄位，文字欄位以 CAST 轉為 TEXT，舊資料中的 BLOB 也由驅動程式直接解碼為字串"""
+    return ', '.join(f'CAST({col} AS TEXT) AS {col}' if col in DEFECT_TEXT_COLUMNS else col
+                     for col in columns)
+
+def _normalize_text_columns(df):
+    """將文字欄位的空值及 'nan'／'None' 字串統一為空字串（逐欄向量化處理）"""
+    for col in DEFECT_TEXT_COLUMNS:
         if col in df.columns:
-            # 處理bytes類型的中文字符
-            def decode_if_bytes(x):
-                if isinstance(x, bytes):
-                    try:
-                        return x.decode('utf-8')
-                    except:
-                        return str(x)
-                return str(x) if pd.notna(x) else ''
-            
-            df[col] = df[col].apply(decode_if_bytes).replace('nan', '').replace('None', '')
-    
+            values = df[col]
+            empty_mask = values.isna() | values.isin(('nan', 'None'))
+            if empty_mask.any():
+                df[col] = values.mask(empty_mask, '')
     return df
 
-def update_defect_status(defect_id, new_status, resolution=None, operator=None):
-    conn = sqlite3.connect('defect_management.db')
+def query_defects(status=None, responsible_dept=None, defect_level=None, work_order=None,
+                  assigned_person=None, created_from=None, created_to=None, updated_since=None,
+                  deadline_after=None, deadline_before=None, columns=None,
+                  order_by='created_time', descending=True, limit=None, offset=None, after=None):
+    """
+    查詢不良品，篩選、排序及分頁皆在SQL中完成
+
+    篩選值可為單一值或列表；created_from（含）／created_to（不含）為建立時間範圍，
+    updated_since（含）只取該時間之後有更新的記錄；deadline_after（含）／deadline_before（不含）為截止時間範圍。
+    時間可為 epoch 秒數或日期／時間（不含時區時視為本地時間），皆以 epoch 欄位的索引範圍查詢。
+    after 為鍵集分頁游標 (排序欄位值, id)，取得上一頁最後一筆之後的資料。
+    """
+    if order_by not in DEFECT_SORT_COLUMNS:
+        raise ValueError(f"不支援的排序欄位: {order_by}")
+    if columns is None:
+        columns = DEFECT_COLUMNS
+    unknown = [col for col in columns if col not in DEFECT_COLUMNS]
+    if unknown:
+        raise ValueError(f"不支援的欄位: {', '.join(unknown)}")
+
+    conditions, params = _build_defect_filters(status, responsible_dept, defect_level, work_order,
+                                               assigned_person, created_from, created_to, updated_since,
+                                               deadline_after, deadline_before)
+    direction = 'DESC' if descending else 'ASC'
+    if after is not None:
+        conditions.append(f"({order_by}, id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+
+    query = f"SELECT {_defect_select_list(columns)} FROM defects"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {order_by} {direction}, id {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+        if offset:
+            query += " OFFSET ?"
+            params.append(int(offset))
+
+    with db_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+
+    return _normalize_text_columns(df)
+
+@cached_query()
+def count_defects(**filters):
+    """計算符合篩選條件的不良品筆數"""
+    conditions, params = _build_defect_filters(**filters)
+    query = "SELECT COUNT(*) FROM defects"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    with db_connection() as conn:
+        return conn.execute(query, params).fetchone()[0]
+
+@cached_query()
+def get_defects(status=None, **filters):
+    """快取的不良品查詢，參數同 query_defects"""
+    return query_defects(status=status, **filters)
+
+# 零件不良統計
+
+def split_components(text):
+    """將以分號分隔的不良零件文字拆為零件清單（去除空白及重複）"""
+    if text is None or (isinstance(text, float) and pd.isna(text)):
+        return []
+    components = []
+    for component in str(text).split(';'):
+        component = component.strip()
+        if component and component not in components:
+            components.append(component)
+    return components
+
+def _set_defect_components(conn, defect_id, defective_component):
+    """以不良零件文字重設該不良品的零件明細"""
+    conn.execute('DELETE FROM defect_components WHERE defect_id = ?', (defect_id,))
+    conn.executemany('INSERT INTO defect_components (defect_id, component) VALUES (?, ?)',
+                     [(defect_id, component) for component in split_components(defective_component)])
+
+@cached_query()
+def get_component_stats(**filters):
+    """
+    以零件明細表彙總零件不良數量，篩選條件同 query_defects
+    回傳依 (零件, 不良類型, 產品, 日期) 分組的 component / defect_type / product_name / date / quantity / record_count
+    """
+    conditions, params = _build_defect_filters(**filters)
+    query = '''
+        SELECT defect_components.component, defects.defect_type, defects.product_name,
+               defects.created_date AS date, SUM(defects.quantity) AS quantity, COUNT(*) AS record_count
+        FROM defect_components JOIN defects ON defects.id = defect_components.defect_id
+    '''
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY defect_components.component, defects.defect_type, defects.product_name, date"
+    with db_connection() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def component_stats_from_frame(df):
+    """
+    由已載入的不良品資料計算與 get_component_stats 相同格式的彙總（欄式快照及歸檔資料使用）
+    資料需已經過 add_local_time_columns 補上 created_date
+    """
+    columns = ['component', 'defect_type', 'product_name', 'date', 'quantity', 'record_count']
+    if df.empty or 'defective_component' not in df.columns:
+        return pd.DataFrame(columns=columns)
+    expanded = df[['defective_component', 'defect_type', 'product_name', 'created_date', 'quantity']].assign(
+        component=df['defective_component'].map(split_components)).explode('component')
+    expanded = expanded[expanded['component'].notna()]
+    if expanded.empty:
+        return pd.DataFrame(columns=columns)
+    expanded = expanded.rename(columns={'created_date': 'date'})
+    return expanded.groupby(['component', 'defect_type', 'product_name', 'date']).agg(
+        quantity=('quantity', 'sum'), record_count=('quantity', 'size')).reset_index()
+
+# 全文檢索
+
+def _build_fts_match(text):
+    """將搜尋字串轉為 FTS5 查詢：以空白分隔的每個詞皆須符合，英數結尾的詞可前綴比對"""
+    phrases = []
+    for term in text.split():
+        tokens = re.findall(r'\w+', fts_segment(term))
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        if not FTS_CJK_PATTERN.fullmatch(tokens[-1]):
+            phrase += ' *'
+        phrases.append(phrase)
+    return ' '.join(phrases) or None
+
+def _build_search_query(text, **filters):
+    """組合全文檢索查詢，回傳 (SQL, 參數)；搜尋字串沒有可用的詞時回傳 (None, None)"""
+    match = _build_fts_match(text)
+    if match is None:
+        return None, None
+
+    # 描述、處理結果、不良零件與處理記錄備註任一符合即列入，取最佳的 bm25 分數排序
+    query = '''
+        WITH hits AS (
+            SELECT rowid AS defect_id, bm25(defects_fts) AS score
+            FROM defects_fts WHERE defects_fts MATCH ?
+            UNION ALL
+            SELECT processing_logs.defect_id, bm25(processing_logs_fts) AS score
+            FROM processing_logs_fts
+            JOIN processing_logs ON processing_logs.id = processing_logs_fts.rowid
+            WHERE processing_logs_fts MATCH ?
+        ), ranked AS (
+            SELECT defect_id, MIN(score) AS score FROM hits GROUP BY defect_id
+        )
+    '''
+    params = [match, match]
+    conditions, filter_params = _build_defect_filters(**filters)
+    query += "SELECT {columns} FROM ranked JOIN defects ON defects.id = ranked.defect_id"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params + filter_params
+
+@cached_query()
+def search_defects(text, columns=None, limit=None, offset=0, **filters):
+    """以全文檢索搜尋不良品，依相關度排序（相同分數時新的在前），可搭配一般篩選條件"""
+    columns = columns or DEFECT_COLUMNS
+    query, params = _build_search_query(text, **filters)
+    if query is None:
+        return pd.DataFrame(columns=columns)
+
+    query = query.format(columns=_defect_select_list(columns)) + " ORDER BY ranked.score, defects.id DESC"
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+    with db_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return _normalize_text_columns(df)
+
+@cached_query()
+def count_search_defects(text, **filters):
+    """計算全文檢索符合的不良品筆數"""
+    query, params = _build_search_query(text, **filters)
+    if query is None:
+        return 0
+    with db_connection() as conn:
+        return conn.execute(query.format(columns='COUNT(*)'), params).fetchone()[0]
+
+class DefectSnapshot:
+    """
+    全程序共用的不良品快照，以 updated_epoch 為水位線增量更新
+
+    每次讀取只查詢水位線之後有更新的記錄及新的刪除記錄（tombstone），
+    合併進快取的 DataFrame，避免各頁面重新讀取整張資料表。
+    """
+
+    def __init__(self, overlap_seconds=DEFECT_SNAPSHOT_OVERLAP_SECONDS):
+        # updated_epoch 只精確到秒，且寫入可能在水位線之後才提交，因此每次多重讀一小段時間
+        self.overlap = overlap_seconds
+        self._lock = threading.Lock()
+        self._df = None
+        self._watermark = None
+        self._tombstone_id = 0
+        self._version = None
+        self._sla_version = None
+
+    def _latest_tombstone_id(self):
+        with db_connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM defect_tombstones').fetchone()[0]
+
+    def _load_full(self):
+        self._tombstone_id = self._latest_tombstone_id()
+        self._df = query_defects()
+        self._update_watermark(self._df)
+
+    def _update_watermark(self, df):
+        if not df.empty and df['updated_epoch'].notna().any():
+            latest = int(df['updated_epoch'].max())
+            if self._watermark is None or latest > self._watermark:
+                self._watermark = latest
+
+    def _apply_delta(self):
+        with db_connection() as conn:
+            tombstones = conn.execute(
+                'SELECT id, defect_id FROM defect_tombstones WHERE id > ? ORDER BY id',
+                (self._tombstone_id,)).fetchall()
+        if self._watermark is not None:
+            changed = query_defects(updated_since=self._watermark - self.overlap, order_by='updated_epoch')
+        else:
+            changed = query_defects()
+
+        deleted_ids = {defect_id for _, defect_id in tombstones}
+        if tombstones:
+            self._tombstone_id = tombstones[-1][0]
+        if changed.empty and not deleted_ids:
+            return
+
+        drop_ids = deleted_ids | set(changed['id'])
+        df = self._df[~self._df['id'].isin(drop_ids)]
+        changed = changed[~changed['id'].isin(deleted_ids)]
+        if not changed.empty:
+            # 空的 DataFrame 欄位型別為 object，直接取用新資料以保留數值型別
+            df = pd.concat([df, changed], ignore_index=True) if not df.empty else changed
+            df = df.sort_values(['created_time', 'id'], ascending=False, ignore_index=True)
+        self._df = df.reset_index(drop=True)
+        self._update_watermark(changed)
+
+    def get(self):
+        """取得最新快照（回傳副本，呼叫端可自由修改）"""
+        with self._lock:
+            # 先讀取資料版本，版本未變時不需查詢；讀取期間若有寫入，下次版本不同會再更新
+            version = get_data_version('defects')
+            sla_version = get_data_version('sla')
+            if self._df is None or sla_version != self._sla_version:
+                self._load_full()
+            elif version != self._version:
+                self._apply_delta()
+            self._version = version
+            self._sla_version = sla_version
+            return self._df.copy()
+
+    def invalidate(self):
+        """清除快照，下次讀取時重新完整載入"""
+        with self._lock:
+            self._df = None
+            self._watermark = None
+            self._version = None
+
+@st.cache_resource
+def get_defect_snapshot():
+    """獲取全域共用的不良品快照"""
+    return DefectSnapshot()
+
+def get_defects_snapshot():
+    """從增量快照讀取全部不良品"""
+    return get_defect_snapshot().get()
+
+# 結構化處理結果
+
+# 處理結果欄位：(欄位名稱, 欄位定義)
+RESOLUTION_FIELD_COLUMNS = [
+    ('resolution_code', 'TEXT'),
+    ('ok_qty', 'INTEGER'),
+    ('ng_qty', 'INTEGER'),
+    ('ng_method', 'TEXT'),
+    ('resolution_note', 'TEXT'),
+]
+
+# 判定為OK品的處理結果，可能有部分剩餘NG品另行處理
+RESOLUTION_OK_CODE = 'TRA11 判定後為OK品'
+
+def build_resolution(code, quantity, ok_qty=None, ng_method=None, note=''):
+    """
+    組合處理結果：回傳結構化欄位及顯示用的處理結果文字
+    OK品判定時 ok_qty 為OK品數量、其餘為NG品；其他處理方式則全部數量皆為NG品
+    """
+    quantity = int(quantity or 0)
+    if code == RESOLUTION_OK_CODE:
+        ok_qty = quantity if ok_qty is None else int(ok_qty)
+        ng_qty = quantity - ok_qty
+        ng_method = ng_method if ng_qty > 0 else None
+        text = f"{code}（OK品：{ok_qty} pcs"
+        text += f"，剩餘NG品：{ng_qty} pcs - {ng_method}）" if ng_qty > 0 else "）"
+    else:
+        ok_qty, ng_qty, ng_method = 0, quantity, code
+        text = code
+
+    note = (note or '').strip()
+    if note:
+        text += f" - {note}"
+    return {
+        'resolution': text,
+        'resolution_code': code,
+        'ok_qty': ok_qty,
+        'ng_qty': ng_qty,
+        'ng_method': ng_method,
+        'resolution_note': note or None,
+    }
+
+def parse_resolution(text, quantity):
+    """由處理結果文字解析結構化欄位（用於既有資料回填），無法解析時回傳 None"""
+    if text is None or not str(text).strip():
+        return None
+    text = str(text).strip()
+
+    match = re.match(re.escape(RESOLUTION_OK_CODE) + r'(?:（(.*?)）)?(?: - (.*))?$', text, re.S)
+    if match:
+        detail = match.group(1) or ''
+        ok_match = re.search(r'OK品：(\d+) pcs', detail)
+        ng_match = re.search(r'剩餘NG品：(\d+) pcs - (.+)', detail)
+        fields = build_resolution(RESOLUTION_OK_CODE, quantity, int(ok_match.group(1)) if ok_match else None,
+                                  note=match.group(2))
+        # 文字中有列出數量時以文字為準，不依 quantity 重新推算（否則明載的 NG 處理方式可能被捨棄）
+        if ok_match or ng_match:
+            fields['ng_qty'] = int(ng_match.group(1)) if ng_match else 0
+            fields['ng_method'] = ng_match.group(2).strip() if ng_match else None
+            if not ok_match:
+                fields['ok_qty'] = max(int(quantity or 0) - fields['ng_qty'], 0)
+    else:
+        code, _, note = text.partition(' - ')
+        fields = build_resolution(code.strip(), quantity, note=note)
+    # 保留原始文字，避免回填時改寫既有內容
+    fields['resolution'] = text
+    return fields
+
+def _resolution_update_params(fields):
+    return [fields[name] for name, _ in RESOLUTION_FIELD_COLUMNS]
+
+def _backfill_resolution_fields(conn):
+    """解析尚未有結構化欄位的處理結果文字並寫回，回傳更新筆數"""
+    rows = conn.execute('''
+        SELECT id, resolution, quantity FROM defects
+        WHERE resolution IS NOT NULL AND resolution != '' AND resolution_code IS NULL
+    ''').fetchall()
+    updates = []
+    for defect_id, resolution, quantity in rows:
+        fields = parse_resolution(resolution, quantity)
+        if fields:
+            updates.append(_resolution_update_params(fields) + [defect_id])
+    conn.executemany('''
+        UPDATE defects SET resolution_code = ?, ok_qty = ?, ng_qty = ?, ng_method = ?, resolution_note = ?
+        WHERE id = ?
+    ''', updates)
+    return len(updates)
+
+def _update_defect_status_tx(conn, defect_id, new_status, resolution, operator):
+    """更新不良品狀態（寫入意圖）"""
     cursor = conn.cursor()
 
     if new_status == '已完成':
+        quantity = cursor.execute('SELECT quantity FROM defects WHERE id = ?', (defect_id,)).fetchone()
+        fields = parse_resolution(resolution, quantity[0] if quantity else 0) or dict.fromkeys(
+            name for name, _ in RESOLUTION_FIELD_COLUMNS)
         cursor.execute('''
             UPDATE defects
-            SET status = ?, resolution = ?, completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
+            SET status = ?, resolution = ?, resolution_code = ?, ok_qty = ?, ng_qty = ?, ng_method = ?,
+                resolution_note = ?, completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
             WHERE id = ?
-        ''', (new_status, resolution, defect_id))
+        ''', [new_status, resolution] + _resolution_update_params(fields) + [defect_id])
     else:
         cursor.execute('''
             UPDATE defects
@@ -544,12 +2179,14 @@ def update_defect_status(defect_id, new_status, resolution=None, operator=None):
         VALUES (?, ?, ?, ?, ?)
     ''', (defect_id, f'狀態更新為{new_status}', '系統', operator or '系統', resolution or ''))
 
-    conn.commit()
-    conn.close()
+    _refresh_work_order_stats_for_defect(conn, defect_id)
 
-def transfer_defect(defect_id, target_dept, transfer_reason, operator=None):
-    """轉交不良品到其他部門"""
-    conn = sqlite3.connect('defect_management.db')
+def update_defect_status(defect_id, new_status, resolution=None, operator=None):
+    """更新不良品狀態"""
+    execute_write('status', _update_defect_status_tx, defect_id, new_status, resolution, operator)
+
+def _transfer_defect_tx(conn, defect_id, target_dept, transfer_reason, operator, default_person):
+    """轉交不良品（寫入意圖）"""
     cursor = conn.cursor()
 
     # 先獲取不良品的責任部門和負責人信息
@@ -571,12 +2208,8 @@ def transfer_defect(defect_id, target_dept, transfer_reason, operator=None):
         elif target_dept == primary_dept and primary_person:
             assigned_person = primary_person
         else:
-            # 轉交到其他部門，根據部門獲取預設負責人
-            personnel_settings = load_personnel_settings()
-            dept_persons = [person['display_name'] for person in personnel_settings.get('responsible_persons', [])
-                           if person['department'] == target_dept]
-            if dept_persons:
-                assigned_person = dept_persons[0]  # 使用該部門的第一個負責人
+            # 轉交到其他部門，使用該部門的預設負責人
+            assigned_person = default_person
 
     # 更新責任部門和負責人，狀態改為待處理
     cursor.execute('''
@@ -595,90 +2228,896 @@ def transfer_defect(defect_id, target_dept, transfer_reason, operator=None):
         VALUES (?, ?, ?, ?, ?)
     ''', (defect_id, transfer_log, target_dept, operator or '系統', transfer_reason))
 
-    conn.commit()
-    conn.close()
+    _refresh_work_order_stats_for_defect(conn, defect_id)
+
+def transfer_defect(defect_id, target_dept, transfer_reason, operator=None):
+    """轉交不良品到其他部門"""
+    # 人員設定在呼叫端讀取，寫入執行緒只負責資料庫操作
+    dept_persons = get_responsible_persons_by_dept(target_dept)
+    default_person = dept_persons[0] if dept_persons else ''  # 使用該部門的第一個負責人
+    execute_write('transfer', _transfer_defect_tx, defect_id, target_dept, transfer_reason, operator, default_person)
+
+def _add_processing_log(conn, defect_id, action, department, operator, comment):
+    """新增處理記錄"""
+    conn.execute('''
+        INSERT INTO processing_logs (defect_id, action, department, operator, comment)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (defect_id, action, department, operator, comment))
+
+def _submit_defect_resolution_tx(conn, defect_id, resolution, target_dept, assigned_person,
+                                 defective_component, primary_dept, operator):
+    """主要單位處理完成並提交次要單位簽核（寫入意圖），resolution 為 build_resolution() 的結果"""
+    conn.execute('''
+        UPDATE defects
+        SET status = '處理中', resolution = ?, resolution_code = ?, ok_qty = ?, ng_qty = ?, ng_method = ?,
+            resolution_note = ?, approval_status = '待次要單位簽核',
+            responsible_dept = ?, assigned_person = ?, defective_component = ?, updated_time = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', [resolution['resolution']] + _resolution_update_params(resolution) +
+        [target_dept, assigned_person, defective_component, defect_id])
+
+    _set_defect_components(conn, defect_id, defective_component)
+
+    log_comment = f"{resolution['resolution']} - 不良零件: {defective_component}"
+    _add_processing_log(conn, defect_id, f'主要單位({primary_dept})處理完成，提交簽核', primary_dept,
+                        operator, log_comment)
+
+def submit_defect_resolution(defect_id, resolution, target_dept, assigned_person, defective_component,
+                             primary_dept, operator):
+    """提交處理結果（build_resolution() 的結果），轉交次要單位簽核"""
+    execute_write('submit', _submit_defect_resolution_tx, defect_id, resolution, target_dept,
+                  assigned_person, defective_component, primary_dept, operator)
+
+def _approve_defect_tx(conn, defect_id, approver_dept, operator, note, third_info):
+    """次要單位簽核通過（寫入意圖）"""
+    if third_info:
+        # 需要第三責任人簽核，更新為待第三責任人簽核狀態
+        conn.execute('''
+            UPDATE defects
+            SET approval_status = '待第三責任人簽核',
+                third_dept = ?, third_person = ?, third_approval_status = '待簽核',
+                updated_time = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (third_info['dept'], third_info['person'], defect_id))
+        comment = f"簽核通過，轉交{third_info['dept']}({third_info['person']})簽核"
+    else:
+        # 不需要第三責任人簽核，直接完成
+        conn.execute('''
+            UPDATE defects
+            SET status = '已完成', approval_status = '已簽核通過',
+                completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (defect_id,))
+        comment = "簽核通過"
+
+    if note:
+        comment += f" - {note}"
+    _add_processing_log(conn, defect_id, f'{approver_dept}簽核通過', approver_dept, operator, comment)
+    if not third_info:
+        _refresh_work_order_stats_for_defect(conn, defect_id)
+
+def approve_defect(defect_id, approver_dept, operator, note='', third_info=None):
+    """次要單位簽核通過，視處理結果轉交第三責任人或直接結案"""
+    execute_write('approve', _approve_defect_tx, defect_id, approver_dept, operator, note, third_info)
+
+def _final_approve_defect_tx(conn, defect_id, third_dept, operator, note):
+    """第三責任人最終簽核通過（寫入意圖）"""
+    conn.execute('''
+        UPDATE defects
+        SET status = '已完成', approval_status = '已簽核通過',
+            third_approval_status = '已簽核',
+            completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (defect_id,))
+
+    comment = "最終簽核通過"
+    if note:
+        comment += f" - {note}"
+    _add_processing_log(conn, defect_id, f'{third_dept}最終簽核通過', third_dept, operator, comment)
+    _refresh_work_order_stats_for_defect(conn, defect_id)
+
+def final_approve_defect(defect_id, third_dept, operator, note=''):
+    """第三責任人最終簽核通過，案件結案"""
+    execute_write('approve', _final_approve_defect_tx, defect_id, third_dept, operator, note)
+
+def _reject_defect_tx(conn, defect_id, rejecting_dept, target_primary_dept, primary_person,
+                      operator, reason, final_stage):
+    """簽核退回主要單位（寫入意圖）"""
+    if final_stage:
+        conn.execute('''
+            UPDATE defects
+            SET approval_status = '主要單位處理中',
+                responsible_dept = ?, assigned_person = ?,
+                third_approval_status = '已退回',
+                updated_time = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (target_primary_dept, primary_person, defect_id))
+        action = f'{rejecting_dept}最終簽核退回'
+    else:
+        conn.execute('''
+            UPDATE defects
+            SET approval_status = '主要單位處理中',
+                responsible_dept = ?, assigned_person = ?, updated_time = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (target_primary_dept, primary_person, defect_id))
+        action = f'{rejecting_dept}簽核退回'
+
+    _add_processing_log(conn, defect_id, action, rejecting_dept, operator, reason)
+
+def reject_defect(defect_id, rejecting_dept, target_primary_dept, primary_person, operator, reason,
+                  final_stage=False):
+    """簽核退回主要單位重新處理（final_stage 表示第三責任人退回）"""
+    execute_write('reject', _reject_defect_tx, defect_id, rejecting_dept, target_primary_dept,
+                  primary_person, operator, reason, final_stage)
+
+PROCESSING_LOG_COLUMNS = ['action', 'department', 'operator', 'comment', 'timestamp']
 
 def get_processing_logs(defect_id):
-    conn = sqlite3.connect('defect_management.db')
-    query = '''
-        SELECT action, department, operator, comment, timestamp
+    return get_processing_logs_bulk([defect_id])[defect_id]
+
+@cached_query()
+def get_processing_logs_bulk(defect_ids):
+    """以單一查詢讀取多筆不良品的處理記錄，回傳 {不良品編號: DataFrame}（沒有記錄者為空表）"""
+    defect_ids = [int(defect_id) for defect_id in dict.fromkeys(defect_ids)]
+    logs = {defect_id: pd.DataFrame(columns=PROCESSING_LOG_COLUMNS) for defect_id in defect_ids}
+    if not defect_ids:
+        return logs
+
+    placeholders = ', '.join('?' * len(defect_ids))
+    query = f'''
+        SELECT defect_id, {', '.join(PROCESSING_LOG_COLUMNS)}
         FROM processing_logs
-        WHERE defect_id = ?
-        ORDER BY timestamp DESC
+        WHERE defect_id IN ({placeholders})
+        ORDER BY defect_id, timestamp DESC
     '''
-    df = pd.read_sql_query(query, conn, params=(defect_id,))
-    conn.close()
-    return df
+    with db_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=defect_ids)
+    for defect_id, group in df.groupby('defect_id', sort=False):
+        logs[defect_id] = group[PROCESSING_LOG_COLUMNS].reset_index(drop=True)
+    return logs
+
+def _delete_defect_tx(conn, defect_id):
+    """刪除不良品及其處理記錄（寫入意圖），回傳被刪除記錄的資訊"""
+    cursor = conn.cursor()
+
+    # 先獲取要刪除的記錄信息（用於記錄日誌）
+    cursor.execute("SELECT work_order, product_name, defect_type FROM defects WHERE id = ?", (defect_id,))
+    defect_info = cursor.fetchone()
+
+    if defect_info:
+        # 刪除處理記錄
+        cursor.execute("DELETE FROM processing_logs WHERE defect_id = ?", (defect_id,))
+
+        # 刪除不良品記錄及零件明細
+        cursor.execute("DELETE FROM defect_components WHERE defect_id = ?", (defect_id,))
+        cursor.execute("DELETE FROM defects WHERE id = ?", (defect_id,))
+
+        # 記錄刪除，供快照增量更新時移除
+        cursor.execute("INSERT INTO defect_tombstones (defect_id) VALUES (?)", (defect_id,))
+
+        _refresh_work_order_stats(conn, defect_info[0])
+
+    return defect_info
 
 def delete_defect(defect_id, operator=None):
     """刪除不良品記錄（包含相關的處理記錄）"""
     try:
-        conn = sqlite3.connect('defect_management.db')
-        cursor = conn.cursor()
-
-        # 先獲取要刪除的記錄信息（用於記錄日誌）
-        cursor.execute("SELECT work_order, product_name, defect_type FROM defects WHERE id = ?", (defect_id,))
-        defect_info = cursor.fetchone()
+        defect_info = execute_write('delete', _delete_defect_tx, defect_id)
 
         if defect_info:
             work_order, product_name, defect_type = defect_info
-
-            # 刪除處理記錄
-            cursor.execute("DELETE FROM processing_logs WHERE defect_id = ?", (defect_id,))
-
-            # 刪除不良品記錄
-            cursor.execute("DELETE FROM defects WHERE id = ?", (defect_id,))
-
-            conn.commit()
-            conn.close()
             return True, f"記錄已刪除 - 工單:{work_order}, 產品:{product_name}, 類型:{defect_type}"
         else:
-            conn.close()
             return False, "找不到指定的記錄"
 
     except Exception as e:
         return False, f"刪除失敗: {str(e)}"
 
-# 人員管理函數
-
+# 資料匯出
+
+# 匯出欄位及中文標題
+EXPORT_COLUMNS = [
+    ('id', '編號'), ('work_order', '工單號碼'), ('package_number', '包數'), ('product_name', '產品名稱'),
+    ('defect_type', '不良類型'), ('defect_level', '不良等級'), ('quantity', '數量(pcs)'),
+    ('description', '問題描述'), ('responsible_dept', '責任部門'), ('assigned_person', '負責人'),
+    ('status', '處理狀態'), ('resolution', '處理結果'), ('created_time', '建立時間'),
+    ('deadline', '處理截止時間'), ('completion_time', '完成時間'),
+]
+
+# 匯出格式：(副檔名, MIME類型)
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'gzip': ('.csv.gz', 'application/gzip'),
+    'zip': ('.zip', 'application/zip'),
+}
+
+@contextmanager
+def _open_export_stream(path, compression, inner_name):
+    """開啟匯出檔案的文字串流，依格式直接寫入壓縮檔"""
+    if compression == 'gzip':
+        with gzip.open(path, 'wt', encoding='utf-8-sig', newline='') as stream:
+            yield stream
+    elif compression == 'zip':
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(inner_name, 'w', force_zip64=True) as raw:
+                with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as stream:
+                    yield stream
+    else:
+        with open(path, 'w', encoding='utf-8-sig', newline='') as stream:
+            yield stream
 
-def load_personnel_settings():
-    """載入人員設定"""
+def _write_cursor_rows(writer, cursor, chunk_size):
+    """將查詢結果分批寫入 CSV，回傳寫入筆數"""
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return row_count
+        writer.writerows(rows)
+        row_count += len(rows)
+
+def _write_archived_rows(writer, conditions, params, created_from, chunk_size):
+    """
+    依相同條件將月份歸檔資料庫中的不良品寫入 CSV（由新到舊），仍在主資料庫的記錄以即時資料為準不重複匯出
+    回傳寫入筆數
+    """
+    from_bound = to_epoch(created_from)
+    # 歸檔檔案依 created_time（UTC）的月份分檔，created_from 之前的月份不會開啟
+    from_month = datetime.fromtimestamp(from_bound, timezone.utc).strftime('%Y-%m') if from_bound is not None else None
+    row_count = 0
+    for month in reversed(list_archive_months()):
+        if from_month and month < from_month:
+            break
+        conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            conn.execute('ATTACH DATABASE ? AS live', (f'file:{os.path.abspath(get_db_path())}?mode=ro',))
+            query = f"SELECT {_defect_select_list([col for col, _ in EXPORT_COLUMNS])} FROM main.defects"
+            query += " WHERE " + " AND ".join(conditions + ['id NOT IN (SELECT id FROM live.defects)'])
+            query += " ORDER BY created_time DESC, id DESC"
+            row_count += _write_cursor_rows(writer, conn.execute(query, params), chunk_size)
+        finally:
+            conn.close()
+    return row_count
+
+def export_defects_csv(compression='csv', chunk_size=EXPORT_CHUNK_SIZE, file_prefix='不良品管理資料',
+                       include_archive=False, **filters):
+    """
+    以資料庫游標分批讀取不良品並逐批寫入暫存CSV檔（可選 gzip／zip 壓縮）
+    include_archive 為 True 時接著匯出符合條件的歸檔資料（與統計分析合併歸檔資料時一致）
+    回傳 (暫存檔路徑, 下載檔名, 匯出筆數)，呼叫端使用後應刪除暫存檔
+    """
+    extension, _ = EXPORT_FORMATS[compression]
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    file_name = f"{file_prefix}_{timestamp}{extension}"
+    fd, path = tempfile.mkstemp(prefix='defect_export_', suffix=extension)
+    os.close(fd)
+
+    conditions, params = _build_defect_filters(**filters)
+    query = f"SELECT {_defect_select_list([col for col, _ in EXPORT_COLUMNS])} FROM defects"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY created_time DESC, id DESC"
+
+    row_count = 0
     try:
-        with open('personnel_settings.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # 如果檔案不存在，創建預設設定
-        default_settings = {
-            "responsible_persons": []
+        with _open_export_stream(path, compression, f"{file_prefix}_{timestamp}.csv") as stream:
+            writer = csv.writer(stream)
+            writer.writerow([header for _, header in EXPORT_COLUMNS])
+            with db_connection() as conn:
+                row_count += _write_cursor_rows(writer, conn.execute(query, params), chunk_size)
+            if include_archive:
+                row_count += _write_archived_rows(writer, conditions, params,
+                                                  filters.get('created_from'), chunk_size)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return path, file_name, row_count
+
+def export_download_button(label, compression='csv', key=None, help=None, **filters):
+    """產生匯出檔並顯示下載按鈕，暫存檔讀取後立即刪除"""
+    path, file_name, row_count = export_defects_csv(compression=compression, **filters)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.remove(path)
+
+    if row_count == 0:
+        st.warning("沒有資料可匯出")
+        return 0
+
+    st.download_button(
+        label=label,
+        data=data,
+        file_name=file_name,
+        mime=EXPORT_FORMATS[compression][1],
+        key=key,
+        help=help
+    )
+    return row_count
+
+# 已完成資料歸檔（依月份分檔）
+
+def get_archive_dir():
+    """獲取歸檔資料庫目錄（與資料庫同一目錄）"""
+    return os.path.join(os.path.dirname(get_db_path()) or '.', 'archive')
+
+def _archive_path(month):
+    """月份格式為 YYYY-MM，對應 defects_archive_YYYY_MM.db"""
+    return os.path.join(get_archive_dir(), f"defects_archive_{month.replace('-', '_')}.db")
+
+def list_archive_months():
+    """列出已存在的歸檔月份（由舊到新）"""
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        match = re.fullmatch(r'defects_archive_(\d{4})_(\d{2})\.db', name)
+        if match:
+            months.append(f"{match.group(1)}-{match.group(2)}")
+    return sorted(months)
+
+def _table_columns(conn, table):
+    """回傳 [(欄位名稱, 宣告型別), ...]"""
+    return [(row[1], row[2]) for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def _sync_archive_schema(main_conn, archive_conn):
+    """建立歸檔資料表，並補上主資料庫後來新增的欄位"""
+    for table in ('defects', 'processing_logs'):
+        columns = _table_columns(main_conn, table)
+        existing = {name for name, _ in _table_columns(archive_conn, table)}
+        if not existing:
+            column_defs = ', '.join('id INTEGER PRIMARY KEY' if name == 'id' else f'{name} {col_type}'
+                                    for name, col_type in columns)
+            archive_conn.execute(f'CREATE TABLE {table} ({column_defs})')
+        else:
+            for name, col_type in columns:
+                if name not in existing:
+                    archive_conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {col_type}')
+    archive_conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_defects_created ON defects (created_time)')
+    archive_conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_logs_defect ON processing_logs (defect_id)')
+    if 'created_epoch' in {name for name, _ in _table_columns(archive_conn, 'defects')}:
+        archive_conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_defects_created_epoch ON defects (created_epoch)')
+
+def _copy_rows(main_conn, archive_conn, table, key_column, ids):
+    """將主資料庫指定記錄複製到歸檔資料庫（以 id 覆蓋，可重複執行；產生欄位不複製）"""
+    placeholders = ', '.join('?' * len(ids))
+    columns = [name for name, _ in _table_columns(main_conn, table)]
+    cursor = main_conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {key_column} IN ({placeholders})", ids)
+    archive_conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        cursor.fetchall())
+
+def _purge_archived_tx(conn, defect_ids):
+    """從主資料庫刪除已歸檔的記錄（寫入意圖），期間被重新開啟的記錄會保留"""
+    placeholders = ', '.join('?' * len(defect_ids))
+    rows = conn.execute(f'''
+        SELECT id, work_order FROM defects WHERE id IN ({placeholders}) AND status = '已完成'
+    ''', defect_ids).fetchall()
+    purge_ids = [row[0] for row in rows]
+    if not purge_ids:
+        return 0
+
+    placeholders = ', '.join('?' * len(purge_ids))
+    # 刪除前將這些記錄累加至歸檔累計，工單統計維持含歸檔記錄的總數
+    conn.execute(f'''
+        INSERT INTO archived_work_order_totals (work_order, total_defects, total_qty, record_count,
+                                                max_package_number, completed_packages)
+        SELECT {WORK_ORDER_STATS_COLUMNS} FROM defects WHERE id IN ({placeholders}) GROUP BY work_order
+        ON CONFLICT(work_order) DO UPDATE SET
+            total_defects = total_defects + excluded.total_defects,
+            total_qty = MAX(total_qty, excluded.total_qty),
+            record_count = record_count + excluded.record_count,
+            max_package_number = MAX(max_package_number, excluded.max_package_number),
+            completed_packages = completed_packages + excluded.completed_packages
+    ''', purge_ids)
+    conn.execute(f'DELETE FROM processing_logs WHERE defect_id IN ({placeholders})', purge_ids)
+    conn.execute(f'DELETE FROM defect_components WHERE defect_id IN ({placeholders})', purge_ids)
+    conn.execute(f'DELETE FROM defects WHERE id IN ({placeholders})', purge_ids)
+    conn.executemany('INSERT INTO defect_tombstones (defect_id) VALUES (?)', [(i,) for i in purge_ids])
+    for work_order in {row[1] for row in rows}:
+        _refresh_work_order_stats(conn, work_order)
+    return len(purge_ids)
+
+def archive_completed_defects(age_days=DEFECT_ARCHIVE_AGE_DAYS, batch_size=IMPORT_CHUNK_SIZE):
+    """
+    將完成超過 age_days 天的不良品及其處理記錄移至依建立月份分檔的歸檔資料庫
+    先寫入歸檔檔案並提交，再由寫入執行緒從主資料庫刪除，中途失敗重新執行即可
+    回傳 {月份: 歸檔筆數}
+    """
+    cutoff = int(time.time()) - age_days * 86400
+    with db_connection() as conn:
+        candidates = conn.execute('''
+            SELECT id, substr(created_time, 1, 7) FROM defects
+            WHERE status = '已完成' AND completion_epoch < ?
+            ORDER BY id
+        ''', (cutoff,)).fetchall()
+
+    by_month = {}
+    for defect_id, month in candidates:
+        by_month.setdefault(month, []).append(defect_id)
+
+    os.makedirs(get_archive_dir(), exist_ok=True)
+    archived = {}
+    for month, ids in sorted(by_month.items()):
+        archived[month] = 0
+        archive_conn = sqlite3.connect(_archive_path(month), timeout=DB_TIMEOUT)
+        try:
+            with db_connection() as conn:
+                _sync_archive_schema(conn, archive_conn)
+                for start in range(0, len(ids), batch_size):
+                    batch = ids[start:start + batch_size]
+                    _copy_rows(conn, archive_conn, 'defects', 'id', batch)
+                    _copy_rows(conn, archive_conn, 'processing_logs', 'defect_id', batch)
+                    archive_conn.commit()
+                    archived[month] += execute_write('archive', _purge_archived_tx, batch)
+        finally:
+            archive_conn.close()
+    return archived
+
+def get_archive_summary():
+    """列出各歸檔月份的筆數及檔案大小"""
+    summary = []
+    for month in list_archive_months():
+        path = _archive_path(month)
+        conn = sqlite3.connect(path)
+        try:
+            row_count = conn.execute('SELECT COUNT(*) FROM defects').fetchone()[0]
+        finally:
+            conn.close()
+        summary.append({'月份': month, '筆數': row_count, '檔案大小(KB)': os.path.getsize(path) // 1024})
+    return pd.DataFrame(summary)
+
+def query_archived_defects(created_from=None):
+    """讀取歸檔資料庫中的不良品，created_from 之前的月份不會開啟"""
+    from_bound = to_epoch(created_from)
+    # 歸檔檔案依 created_time（UTC）的月份分檔
+    from_month = datetime.fromtimestamp(from_bound, timezone.utc).strftime('%Y-%m') if from_bound is not None else None
+    frames = []
+    for month in list_archive_months():
+        if from_month and month < from_month:
+            continue
+        conn = sqlite3.connect(_archive_path(month))
+        try:
+            columns = [col for col in DEFECT_COLUMNS if col in {name for name, _ in _table_columns(conn, 'defects')}]
+            query = f"SELECT {_defect_select_list(columns)} FROM defects"
+            params = []
+            if from_bound is not None:
+                query += " WHERE created_epoch >= ?"
+                params.append(from_bound)
+            frames.append(pd.read_sql_query(query, conn, params=params))
+        finally:
+            conn.close()
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=DEFECT_COLUMNS)
+    return _normalize_text_columns(pd.concat(frames, ignore_index=True))
+
+def load_defects_with_archive(created_from=None):
+    """合併即時資料與歸檔資料的統一讀取，同一筆記錄以即時資料為準"""
+    live = get_defects_snapshot()
+    if created_from is not None:
+        live = live[live['created_epoch'] >= to_epoch(created_from)]
+    archived = query_archived_defects(created_from)
+    if archived.empty:
+        return live
+    archived = archived[~archived['id'].isin(live['id'])]
+    combined = pd.concat([live, archived], ignore_index=True) if not live.empty else archived
+    return combined.sort_values(['created_time', 'id'], ascending=False, ignore_index=True)
+
+# 欄式快照（Arrow IPC）
+
+# 以字典編碼儲存的低基數欄位
+COLUMNAR_DICTIONARY_COLUMNS = {
+    'defects': ['status', 'defect_level', 'defect_type', 'responsible_dept', 'primary_dept', 'secondary_dept',
+                'third_dept', 'approval_status', 'third_approval_status', 'product_name', 'logged_by',
+                'resolution_code', 'ng_method'],
+    'processing_logs': ['action', 'department', 'operator'],
+}
+
+def get_columnar_snapshot_dir():
+    """獲取欄式快照目錄（與資料庫同一目錄）"""
+    return os.path.join(os.path.dirname(get_db_path()) or '.', 'snapshots')
+
+def _columnar_snapshot_path(table):
+    return os.path.join(get_columnar_snapshot_dir(), f'{table}.arrow')
+
+def _write_arrow_table(df, table, snapshot_time, data_version=0):
+    """將 DataFrame 以字典編碼寫入未壓縮的 Arrow IPC 檔（可直接記憶體映射讀取）"""
+    import pyarrow as pa
+
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    for col in COLUMNAR_DICTIONARY_COLUMNS[table]:
+        if col in arrow_table.column_names:
+            index = arrow_table.column_names.index(col)
+            arrow_table = arrow_table.set_column(index, col, arrow_table.column(col).dictionary_encode())
+    arrow_table = arrow_table.replace_schema_metadata({
+        'snapshot_time': snapshot_time,
+        'row_count': str(arrow_table.num_rows),
+        'data_version': str(data_version),
+    })
+
+    # 先寫入名稱不重複的暫存檔再替換，讀取端不會讀到寫到一半的檔案，其他程序同時更新也不會互相覆寫
+    path = _columnar_snapshot_path(table)
+    fd, temp_path = tempfile.mkstemp(prefix=f'{table}.', suffix='.arrow', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return arrow_table.num_rows
+
+# 同一程序內同時按下「更新快照」時依序執行
+_columnar_snapshot_lock = threading.Lock()
+
+def write_columnar_snapshot():
+    """將 defects 及 processing_logs 寫入欄式快照，回傳各表筆數"""
+    os.makedirs(get_columnar_snapshot_dir(), exist_ok=True)
+    with _columnar_snapshot_lock:
+        snapshot_time = local_now().strftime('%Y-%m-%d %H:%M:%S')
+        # 先記錄資料版本，讀取期間若有寫入，快照會被視為過期
+        data_version = get_data_version('defects')
+
+        defects = query_defects()
+        with db_connection() as conn:
+            logs = pd.read_sql_query('''
+                SELECT id, defect_id, action, department, operator, comment, timestamp
+                FROM processing_logs ORDER BY id
+            ''', conn)
+
+        return {
+            'defects': _write_arrow_table(defects, 'defects', snapshot_time, data_version),
+            'processing_logs': _write_arrow_table(logs, 'processing_logs', snapshot_time, data_version),
         }
-        save_personnel_settings(default_settings)
-        return default_settings
-    except Exception as e:
-        st.error(f"載入人員設定時發生錯誤: {e}")
-        return {"responsible_persons": []}
 
-def save_personnel_settings(settings):
-    """儲存人員設定"""
+def get_columnar_snapshot_info(table='defects'):
+    """讀取欄式快照的建立時間及筆數，快照不存在時回傳 None"""
+    path = _columnar_snapshot_path(table)
+    if not os.path.exists(path):
+        return None
+    import pyarrow as pa
+
+    with pa.memory_map(path, 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return {
+        'snapshot_time': metadata.get(b'snapshot_time', b'').decode(),
+        'row_count': int(metadata.get(b'row_count', b'0')),
+        'data_version': int(metadata.get(b'data_version', b'-1')),
+        'file_size': os.path.getsize(path),
+    }
+
+def load_columnar_snapshot(table='defects'):
+    """以記憶體映射讀取欄式快照，字典編碼欄位還原為一般字串欄位"""
+    import pyarrow as pa
+
+    with pa.memory_map(_columnar_snapshot_path(table), 'r') as source:
+        arrow_table = pa.ipc.open_file(source).read_all()
+    df = arrow_table.to_pandas()
+    for col in COLUMNAR_DICTIONARY_COLUMNS[table]:
+        if col in df.columns:
+            df[col] = df[col].astype(object)
+    return df
+
+# 讀取快照（線上備份）
+
+def get_read_snapshot_path():
+    """分析用唯讀快照的資料庫檔案路徑"""
+    return os.path.join(get_columnar_snapshot_dir(), 'read_snapshot.db')
+
+# 同一程序內的背景更新與手動更新依序執行
+_read_snapshot_lock = threading.Lock()
+
+def create_read_snapshot():
+    """
+    以 SQLite 線上備份 API 複製資料庫到唯讀快照，完成後才替換舊快照
+    WAL 模式下一次複製全部頁面只佔用讀取交易、不會阻擋寫入；分段複製遇到寫入提交會重新開始，
+    持續寫入時可能無法完成
+    回傳 {'as_of': 快照時間, 'data_version': 資料版本}
+    """
+    os.makedirs(get_columnar_snapshot_dir(), exist_ok=True)
+    path = get_read_snapshot_path()
+    with _read_snapshot_lock:
+        # 暫存檔名稱不重複，其他程序同時更新時不會刪除或覆寫彼此的暫存檔
+        fd, temp_path = tempfile.mkstemp(prefix='read_snapshot.', suffix='.tmp', dir=os.path.dirname(path))
+        os.close(fd)
+
+        data_version = get_data_version('defects')
+        target = sqlite3.connect(temp_path)
+        try:
+            with db_connection() as conn:
+                conn.backup(target, pages=-1)
+            as_of = local_now().strftime('%Y-%m-%d %H:%M:%S')
+            # 快照改為一般日誌模式，唯讀開啟時不需要 WAL 檔
+            target.execute('PRAGMA journal_mode = DELETE')
+            target.execute('CREATE TABLE read_snapshot_info (as_of TEXT NOT NULL, data_version INTEGER NOT NULL)')
+            target.execute('INSERT INTO read_snapshot_info (as_of, data_version) VALUES (?, ?)', (as_of, data_version))
+            target.commit()
+        except BaseException:
+            target.close()
+            os.remove(temp_path)
+            raise
+        target.close()
+        os.replace(temp_path, path)
+        return {'as_of': as_of, 'data_version': data_version}
+
+@contextmanager
+def read_snapshot_connection():
+    """以唯讀模式開啟讀取快照"""
+    conn = sqlite3.connect(f'file:{get_read_snapshot_path()}?mode=ro', uri=True)
     try:
-        with open('personnel_settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        st.error(f"儲存人員設定時發生錯誤: {e}")
-        return False
+        yield conn
+    finally:
+        conn.close()
+
+def get_read_snapshot_info():
+    """讀取快照的時間及資料版本，快照不存在時回傳 None"""
+    if not os.path.exists(get_read_snapshot_path()):
+        return None
+    with read_snapshot_connection() as conn:
+        as_of, data_version = conn.execute('SELECT as_of, data_version FROM read_snapshot_info').fetchone()
+    return {'as_of': as_of, 'data_version': data_version}
+
+def load_read_snapshot_defects():
+    """從讀取快照載入全部不良品"""
+    with read_snapshot_connection() as conn:
+        existing = {row[1] for row in conn.execute('PRAGMA table_xinfo(defects)')}
+        columns = [col for col in DEFECT_COLUMNS if col in existing]
+        df = pd.read_sql_query(
+            f"SELECT {_defect_select_list(columns)} FROM defects ORDER BY created_time DESC, id DESC", conn)
+    return _normalize_text_columns(df)
+
+def read_snapshot_background_task(interval=READ_SNAPSHOT_INTERVAL_SECONDS):
+    """定期更新讀取快照，資料版本未變時略過"""
+    while True:
+        try:
+            info = get_read_snapshot_info()
+            if info is None or info['data_version'] != get_data_version('defects'):
+                create_read_snapshot()
+        except Exception as e:
+            print(f"讀取快照背景任務錯誤: {e}")
+        time.sleep(interval)
+
+@st.cache_resource
+def start_read_snapshot_job():
+    """啟動讀取快照背景執行緒（每個程序只啟動一次）"""
+    thread = threading.Thread(target=read_snapshot_background_task, name='defect-read-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+# 設定資料（SQLite）
+
+# 舊版 JSON 設定檔於遷移時匯入一次，工作目錄沒有時改讀「配置文件」目錄中的副本
+LEGACY_SETTINGS_DIRS = ['.', '配置文件']
+
+# 通知設定預設值，資料表中沒有的項目使用此值
+DEFAULT_NOTIFICATION_SETTINGS = {
+    'email_enabled': False,
+    'email_smtp_server': 'smtp.gmail.com',
+    'email_smtp_port': 587,
+    'email_username': '',
+    'email_password': '',
+    'email_recipients': [],
+    'telegram_enabled': False,
+    'telegram_bot_token': '',
+    'telegram_chat_ids': [],
+    'browser_notification_enabled': False,
+    'notification_methods': ['email'],  # 可選: email, telegram, browser
+    'notification_intervals': {
+        'A級': 2,  # 2小時提醒一次
+        'B級': 4,  # 4小時提醒一次
+        'C級': 8   # 8小時提醒一次
+    },
+    'processing_deadlines': {
+        'A級': 4,  # 4小時內處理
+        'B級': 8,  # 8小時內處理
+        'C級': 24  # 24小時內處理
+    }
+}
+
+def _read_legacy_settings(filename):
+    """讀取舊版 JSON 設定檔，不存在或格式錯誤時回傳 None"""
+    for directory in LEGACY_SETTINGS_DIRS:
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError as e:
+            print(f"略過無法解析的設定檔 {path}: {e}")
+            return None
+    return None
+
+def _import_legacy_settings(cursor):
+    """由舊版 JSON 設定檔匯入人員、登錄人員、產品名稱及通知設定，回傳匯入的處理時限（沒有時為 None）"""
+    persons = (_read_legacy_settings('personnel_settings.json') or {}).get('responsible_persons', [])
+    cursor.executemany('INSERT OR IGNORE INTO responsible_persons (name, department, display_name) VALUES (?, ?, ?)',
+                       [(p['name'], p['department'], p.get('display_name') or f"{p['department']}-{p['name']}")
+                        for p in persons])
+    for table, filename, key in [('operators', 'operator_settings.json', 'operators'),
+                                 ('products', 'product_settings.json', 'products')]:
+        names = (_read_legacy_settings(filename) or {}).get(key, [])
+        cursor.executemany(f'INSERT OR IGNORE INTO {table} (name) VALUES (?)', [(name,) for name in names])
+
+    notification = _read_legacy_settings('notification_settings.json') or {}
+    cursor.executemany('INSERT OR IGNORE INTO notification_settings (key, value) VALUES (?, ?)',
+                       [(key, json.dumps(value, ensure_ascii=False)) for key, value in notification.items()])
+    return notification.get('processing_deadlines')
+
+def _load_personnel_rows():
+    with db_connection() as conn:
+        rows = conn.execute('SELECT name, department, display_name FROM responsible_persons ORDER BY id').fetchall()
+    return {'responsible_persons': [{'name': name, 'department': department, 'display_name': display_name}
+                                    for name, department, display_name in rows]}
+
+def _load_name_rows(table, key):
+    with db_connection() as conn:
+        return {key: [row[0] for row in conn.execute(f'SELECT name FROM {table} ORDER BY id')]}
+
+def _load_notification_rows():
+    with db_connection() as conn:
+        rows = conn.execute('SELECT key, value FROM notification_settings').fetchall()
+    settings = copy.deepcopy(DEFAULT_NOTIFICATION_SETTINGS)
+    settings.update((key, json.loads(value)) for key, value in rows)
+    return settings
+
+def _build_personnel_index(settings):
+    """人員設定的查詢索引：全部顯示名稱、顯示名稱集合及各部門的人員"""
+    persons = settings.get('responsible_persons', [])
+    by_dept = {}
+    for person in persons:
+        by_dept.setdefault(person['department'], []).append(person['display_name'])
+    return {
+        'display_names': tuple(person['display_name'] for person in persons),
+        'display_name_set': frozenset(person['display_name'] for person in persons),
+        'by_dept': {dept: tuple(names) for dept, names in by_dept.items()},
+    }
+
+# 設定名稱 -> (讀取函數, 索引建立函數)
+SETTINGS_LOADERS = {
+    'personnel': (_load_personnel_rows, _build_personnel_index),
+    'operators': (lambda: _load_name_rows('operators', 'operators'), None),
+    'products': (lambda: _load_name_rows('products', 'products'), None),
+    'notification': (_load_notification_rows, None),
+}
+
+class SettingsStore:
+    """
+    設定資料的記憶體快取（全程序共用）
+
+    讀取時不查詢資料庫；每次執行腳本開始時（及背景任務每輪）呼叫 revalidate，
+    以 settings 範圍的資料版本判斷是否有任何工作階段或程序修改設定，有變更才清除快取重新讀取。
+    快取的內容及索引為共用物件，呼叫端不可修改（load_* 函數會回傳副本）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 已驗證的資料版本（尚未驗證時為 None）
+        self._version = None
+        # 設定名稱 -> (內容, 索引)
+        self._entries = {}
+
+    def revalidate(self):
+        """讀取一次資料版本，與快取的版本不同時清除全部快取"""
+        version = get_data_version('settings')
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+
+    def get(self, name):
+        """回傳 (內容, 索引)"""
+        if self._version is None:
+            self.revalidate()
+        with self._lock:
+            entry = self._entries.get(name)
+            version = self._version
+        if entry:
+            return entry
+
+        # 在已驗證的版本之後才讀取資料：讀取期間若有寫入，下次驗證時版本不同會再重新載入
+        loader, build_index = SETTINGS_LOADERS[name]
+        content = loader()
+        entry = (content, build_index(content) if build_index else None)
+        with self._lock:
+            # 讀取期間快取已被清除（版本已更新）時不保存，避免放回較舊的內容
+            if self._version == version:
+                self._entries[name] = entry
+        return entry
+
+@st.cache_resource
+def get_settings_store():
+    """獲取全域共用的設定資料快取"""
+    return SettingsStore()
+
+def _execute_settings_write(func, *args):
+    """執行設定寫入並立即重新驗證快取，本程序的修改在同一次執行中即可讀到"""
+    result = execute_write('settings', func, *args)
+    get_settings_store().revalidate()
+    return result
+
+def _add_setting_names_tx(conn, table, names):
+    """新增名稱清單型設定（寫入意圖），已存在的名稱略過，回傳新增筆數"""
+    return conn.executemany(f'INSERT OR IGNORE INTO {table} (name) VALUES (?)', [(name,) for name in names]).rowcount
+
+def _delete_setting_name_tx(conn, table, name):
+    """刪除名稱清單型設定（寫入意圖），回傳刪除筆數"""
+    return conn.execute(f'DELETE FROM {table} WHERE name = ?', (name,)).rowcount
+
+def get_notification_settings():
+    """目前的通知設定（共用物件，請勿直接修改）"""
+    return get_settings_store().get('notification')[0]
+
+def _save_notification_settings_tx(conn, changes, deadline_hours):
+    """寫入變更的通知設定項目（寫入意圖），處理時限變更時於同一交易重新計算截止時間"""
+    conn.executemany('''
+        INSERT INTO notification_settings (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_time = CURRENT_TIMESTAMP
+    ''', changes)
+    if deadline_hours is None:
+        return 0
+    return _recompute_sla_deadlines_tx(conn, deadline_hours)
+
+def save_notification_settings(settings, original=None):
+    """
+    儲存通知設定，只寫入與 original（頁面載入時的設定，未指定時為目前設定）不同的項目，
+    其他工作階段同時修改的其他項目不會被覆蓋；回傳依新處理時限重新計算截止時間的筆數
+    """
+    original = get_notification_settings() if original is None else original
+    changes = [(key, json.dumps(value, ensure_ascii=False))
+               for key, value in settings.items() if original.get(key) != value]
+    if not changes:
+        return 0
+    deadline_hours = None
+    if 'processing_deadlines' in settings and settings['processing_deadlines'] != original.get('processing_deadlines'):
+        deadline_hours = {**DEFECT_LEVEL_HOURS, **settings['processing_deadlines']}
+    return _execute_settings_write(_save_notification_settings_tx, changes, deadline_hours)
+
+# 人員管理函數
+
+def load_personnel_settings():
+    """載入人員設定（回傳副本）"""
+    return copy.deepcopy(get_settings_store().get('personnel')[0])
+
+def get_personnel_index():
+    """人員索引（唯讀）：display_names／display_name_set／by_dept"""
+    return get_settings_store().get('personnel')[1]
+
+def _add_responsible_persons_tx(conn, persons):
+    """新增負責人員（寫入意圖），顯示名稱已存在者略過，回傳新增筆數"""
+    return conn.executemany(
+        'INSERT OR IGNORE INTO responsible_persons (name, department, display_name) VALUES (?, ?, ?)',
+        [(name, department, f"{department}-{name}") for department, name in persons]).rowcount
+
+def add_responsible_persons(persons):
+    """新增負責人員，persons 為 [(部門, 姓名), ...]，回傳新增筆數"""
+    return _execute_settings_write(_add_responsible_persons_tx, list(persons))
+
+def _delete_responsible_person_tx(conn, display_name):
+    return conn.execute('DELETE FROM responsible_persons WHERE display_name = ?', (display_name,)).rowcount
+
+def delete_responsible_person(display_name):
+    """刪除負責人員，回傳是否有刪除"""
+    return _execute_settings_write(_delete_responsible_person_tx, display_name) > 0
 
 def get_responsible_persons_list():
     """獲取負責人列表（用於下拉選單）"""
-    settings = load_personnel_settings()
-    persons = settings.get('responsible_persons', [])
-    return [person['display_name'] for person in persons]
+    return list(get_personnel_index()['display_names'])
 
 def get_responsible_persons_by_dept(department):
     """根據部門獲取負責人列表"""
-    settings = load_personnel_settings()
-    persons = settings.get('responsible_persons', [])
-    return [person['display_name'] for person in persons if person['department'] == department]
+    return list(get_personnel_index()['by_dept'].get(department, ()))
+
+def is_registered_person(display_name):
+    """檢查顯示名稱是否已在人員設定中"""
+    return display_name in get_personnel_index()['display_name_set']
 
 def get_third_responsible_info(resolution):
     """根據處理結果獲取第三責任人資訊"""
@@ -703,47 +3142,18 @@ def get_third_responsible_info(resolution):
 
 # 通知設定類
 class NotificationManager:
-    def __init__(self):
-        self.settings = self.load_notification_settings()
+    @property
+    def settings(self):
+        """目前的通知設定（由設定資料快取取得，唯讀）"""
+        return get_notification_settings()
 
     def load_notification_settings(self):
-        """載入通知設定"""
-        try:
-            with open('notification_settings.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            # 預設設定
-            default_settings = {
-                'email_enabled': False,
-                'email_smtp_server': 'smtp.gmail.com',
-                'email_smtp_port': 587,
-                'email_username': '',
-                'email_password': '',
-                'email_recipients': [],
-                'telegram_enabled': False,
-                'telegram_bot_token': '',
-                'telegram_chat_ids': [],
-                'browser_notification_enabled': False,
-                'notification_methods': ['email'],  # 可選: email, telegram, browser
-                'notification_intervals': {
-                    'A級': 2,  # 2小時提醒一次
-                    'B級': 4,  # 4小時提醒一次
-                    'C級': 8   # 8小時提醒一次
-                },
-                'processing_deadlines': {
-                    'A級': 4,  # 4小時內處理
-                    'B級': 8,  # 8小時內處理
-                    'C級': 24  # 24小時內處理
-                }
-            }
-            self.save_notification_settings(default_settings)
-            return default_settings
+        """載入通知設定（回傳副本）"""
+        return copy.deepcopy(get_notification_settings())
 
-    def save_notification_settings(self, settings):
-        """儲存通知設定"""
-        with open('notification_settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        self.settings = settings
+    def save_notification_settings(self, settings, original=None):
+        """儲存通知設定，回傳重新計算截止時間的筆數"""
+        return save_notification_settings(settings, original)
 
     def send_email_notification(self, subject, message, recipients=None):
         """發送郵件通知"""
@@ -859,31 +3269,8 @@ class NotificationManager:
             return False
 
     def check_overdue_defects(self):
-        """檢查逾期不良品"""
-        conn = sqlite3.connect('defect_management.db')
-        query = """
-        SELECT * FROM defects
-        WHERE status IN ('待處理', '處理中')
-        AND datetime('now', 'localtime') > datetime(created_time, '+' ||
-            CASE defect_level
-                WHEN 'A級' THEN ?
-                WHEN 'B級' THEN ?
-                WHEN 'C級' THEN ?
-            END || ' hours')
-        """
-
-        overdue_defects = pd.read_sql_query(
-            query,
-            conn,
-            params=[
-                self.settings['processing_deadlines']['A級'],
-                self.settings['processing_deadlines']['B級'],
-                self.settings['processing_deadlines']['C級']
-            ]
-        )
-        conn.close()
-
-        return overdue_defects
+        """檢查逾期不良品（截止時間已依處理時限存入 deadline_epoch）"""
+        return query_overdue_defects()
 
     def send_overdue_notifications(self):
         """發送逾期通知"""
@@ -917,10 +3304,8 @@ class NotificationManager:
                     """
 
                     for _, defect in defects.iterrows():
-                        created_time = pd.to_datetime(defect['created_time'])
-                        deadline_hours = self.settings['processing_deadlines'][defect['defect_level']]
-                        deadline = created_time + timedelta(hours=deadline_hours)
-                        overdue_hours = (datetime.now() - deadline).total_seconds() / 3600
+                        created_time = to_local_datetime(defect['created_epoch'])
+                        overdue_hours = (time.time() - defect['deadline_epoch']) / 3600
 
                         email_message += """
                         <tr>
@@ -954,10 +3339,8 @@ class NotificationManager:
 📋 <b>詳細案件：</b>"""
 
                     for _, defect in defects.iterrows():
-                        created_time = pd.to_datetime(defect['created_time'])
-                        deadline_hours = self.settings['processing_deadlines'][defect['defect_level']]
-                        deadline = created_time + timedelta(hours=deadline_hours)
-                        overdue_hours = (datetime.now() - deadline).total_seconds() / 3600
+                        created_time = to_local_datetime(defect['created_epoch'])
+                        overdue_hours = (time.time() - defect['deadline_epoch']) / 3600
 
                         telegram_message += """
 ━━━━━━━━━━━━━━━━━━━━
@@ -985,8 +3368,14 @@ notification_manager = NotificationManager()
 
 def notification_background_task():
     """背景通知任務"""
+    # 通知設定存放於資料庫，背景執行緒可能早於 main() 執行，先確認資料表已建立
+    try:
+        init_database()
+    except Exception as e:
+        print(f"通知背景任務錯誤: {e}")
     while True:
         try:
+            get_settings_store().revalidate()
             if notification_manager.settings.get('email_enabled', False) or notification_manager.settings.get('telegram_enabled', False):
                 notification_manager.send_overdue_notifications()
             time.sleep(3600)  # 每小時檢查一次
@@ -1046,7 +3435,7 @@ def user_management_page():
         st.error("❌ 您沒有權限訪問此頁面！")
         return
 
-    tab1, tab2 = st.tabs(["用戶列表", "新增用戶"])
+    tab1, tab2, tab3 = st.tabs(["用戶列表", "新增用戶", "資料庫效能"])
 
     with tab1:
         st.subheader("📋 用戶列表")
@@ -1116,11 +3505,63 @@ def user_management_page():
                 else:
                     st.error("❌ 請填寫所有必填欄位！")
 
+    with tab3:
+        st.subheader("🗂️ 索引與查詢計畫")
+
+        missing_indexes = get_missing_managed_indexes()
+        if missing_indexes:
+            st.warning(f"⚠️ 缺少索引：{', '.join(missing_indexes)}")
+            if st.button("建立缺少的索引"):
+                execute_write('index', lambda conn: ensure_managed_indexes(conn.cursor()))
+                st.success("✅ 索引已建立")
+                st.rerun()
+        else:
+            st.success(f"✅ {len(MANAGED_INDEXES)} 個受管理索引皆已建立")
+
+        plan_df = explain_known_queries()
+        st.dataframe(plan_df, use_container_width=True)
+
+        flagged = plan_df[plan_df['全表掃描'] | plan_df['暫存排序']]
+        if not flagged.empty:
+            st.warning(f"⚠️ 以下查詢會進行全表掃描或暫存排序：{', '.join(flagged['查詢'])}")
+
+        st.subheader("📊 工單統計表")
+        st.caption("工單統計於新增、刪除及狀態變更時同步更新；若資料曾被外部修改，可由不良品記錄重建")
+        if st.button("重建工單統計"):
+            work_order_count = rebuild_work_order_stats()
+            st.success(f"✅ 已重建 {work_order_count} 個工單的統計")
+
+        st.subheader("🧮 查詢快取")
+        st.caption(f"讀取查詢依資料版本快取（最長 {QUERY_CACHE_TTL_SECONDS} 秒），所有使用者共用同一份結果，"
+                   "資料異動後自動改用新結果")
+        cache_stats = get_query_cache_stats().to_frame()
+        if cache_stats.empty:
+            st.info("尚無快取查詢記錄")
+        else:
+            st.dataframe(cache_stats, use_container_width=True, hide_index=True)
+        if st.button("清除查詢快取"):
+            clear_query_cache()
+            st.success("✅ 查詢快取已清除")
+
+        st.subheader("🗄️ 已完成資料歸檔")
+        st.caption(f"已完成超過 {DEFECT_ARCHIVE_AGE_DAYS} 天的不良品及處理記錄會依建立月份移至歸檔資料庫，"
+                   "統計分析查詢較長時間範圍時會合併讀取")
+        archive_summary = get_archive_summary()
+        if not archive_summary.empty:
+            st.dataframe(archive_summary, use_container_width=True, hide_index=True)
+        if st.button("執行歸檔"):
+            with st.spinner("正在歸檔..."):
+                archived = archive_completed_defects()
+            if archived:
+                st.success("✅ 已歸檔：" + "、".join(f"{month} {count} 筆" for month, count in archived.items()))
+            else:
+                st.info("沒有需要歸檔的記錄")
+
 # 主要應用程式
 
 
 def main():
-    # 初始化資料庫（添加錯誤處理）
+    # 初始化資料庫（每個程序只執行一次遷移，添加錯誤處理）
     try:
         init_database()
         st.session_state.db_initialized = True
@@ -1130,6 +3571,12 @@ def main():
         st.session_state.db_initialized = False
         st.stop()
 
+    # 每次執行只查詢一次設定資料版本，其餘設定讀取皆由記憶體快取提供
+    get_settings_store().revalidate()
+
+    # 分析用讀取快照由背景執行緒定期更新
+    start_read_snapshot_job()
+
     # 初始化認證狀態
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
@@ -1231,18 +3678,17 @@ def dashboard_page():
                 else:
                     st.info("ℹ️ 通知功能未啟用或無收件人設定")
 
-    # 獲取所有不良品資料
-    all_defects = get_defects()
+    due_soon_count = count_due_soon_defects()
+    if due_soon_count:
+        st.warning(f"⏰ **{due_soon_count} 件案件將於 {SLA_DUE_SOON_MINUTES} 分鐘內到期**")
+
+    # 獲取所有不良品資料（從增量快照讀取）
+    all_defects = get_defects_snapshot()
 
     if all_defects.empty:
         st.warning("📝 目前沒有不良品資料，請先登記不良品資訊。")
         return
 
-    # 確保數據格式正確，轉換所有可能的bytes類型為字符串
-    for col in all_defects.columns:
-        if all_defects[col].dtype == 'object':
-            all_defects[col] = all_defects[col].astype(str)
-
     # 統計指標
     col1, col2, col3, col4 = st.columns(4)
 
@@ -1359,6 +3805,66 @@ def dashboard_page():
 
 
 
+def bulk_registration_section():
+    """批次上傳登錄：上傳檢驗單CSV，驗證後一次寫入"""
+    st.write("**📤 批次上傳檢驗單**")
+    st.caption("CSV欄位：" + "、".join(BULK_UPLOAD_COLUMNS.keys()) +
+               "（責任部門留空時依不良類型自動判定）")
+
+    template = pd.DataFrame(columns=list(BULK_UPLOAD_COLUMNS.keys()))
+    st.download_button(
+        label="📥 下載範本",
+        data=template.to_csv(index=False, encoding='utf-8-sig'),
+        file_name="批次登錄範本.csv",
+        mime="text/csv"
+    )
+
+    uploaded_file = st.file_uploader("選擇CSV檔案", type=['csv'], key="bulk_upload_file")
+    if uploaded_file is None:
+        return
+
+    # 以檔案內容識別批次，同一檔案送出後即鎖定，避免重複點擊或重新執行時再次登錄
+    batch_key = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    if st.session_state.get('bulk_upload_submitted') == batch_key:
+        st.info("ℹ️ 此檔案已完成批次登錄，如需再次登錄請重新上傳檔案")
+        return
+
+    try:
+        upload_df = read_bulk_upload(uploaded_file)
+    except Exception as e:
+        st.error(f"❌ 檔案讀取失敗: {str(e)}")
+        return
+
+    records = upload_df.to_dict('records')
+    cleaned, errors = validate_defect_records(records)
+
+    st.write(f"📊 共 {len(records)} 筆資料，驗證通過 {len(cleaned)} 筆")
+    st.dataframe(upload_df.head(100), use_container_width=True)
+
+    if errors:
+        st.error("❌ 以下資料有誤，請修正後重新上傳：")
+        st.text('\n'.join(errors[:50]))
+        if len(errors) > 50:
+            st.text(f"... 另有 {len(errors) - 50} 筆錯誤")
+        return
+
+    if st.button("✅ 確認批次登錄", type="primary", key="bulk_upload_submit"):
+        if st.session_state.get('bulk_upload_submitted') == batch_key:
+            return
+        # 寫入前先鎖定，登錄失敗時解除以便修正後重試
+        st.session_state['bulk_upload_submitted'] = batch_key
+        operator = st.session_state.user['name'] if st.session_state.get('user') else '系統'
+        start_time = time.time()
+        try:
+            # add_defects_bulk 會自行驗證，傳入原始資料列（時間轉換為 UTC 只能執行一次）
+            results = add_defects_bulk(records, operator)
+        except Exception as e:
+            st.session_state.pop('bulk_upload_submitted', None)
+            st.error(f"❌ 批次登錄失敗: {str(e)}")
+            return
+        elapsed = time.time() - start_time
+        st.success(f"✅ 批次登錄完成！共 {len(results)} 筆，耗時 {elapsed:.2f} 秒")
+
 def defect_registration_page():
     st.header("📋 不良品登錄")
 
@@ -1389,6 +3895,11 @@ def defect_registration_page():
     </style>
     """, unsafe_allow_html=True)
 
+    registration_mode = st.radio("登錄方式", ["單筆登錄", "批次上傳"], horizontal=True, key="registration_mode")
+    if registration_mode == "批次上傳":
+        bulk_registration_section()
+        return
+
     # 先在表單外部選擇不良品類型，以便即時更新責任部門
     col1_preview, col2_preview = st.columns(2)
 
@@ -1606,9 +4117,6 @@ def defect_registration_page():
                 if not secondary_person:
                     st.error("   • 請選擇次要責任人")
             else:
-                # 確保使用最新的包數
-                final_package_number = get_next_package_number(work_order) if work_order else 1
-
                 # 移除零件選擇功能，直接使用空值
                 final_component = ""
                 final_supplier = ""
@@ -1619,7 +4127,6 @@ def defect_registration_page():
                     'defect_type': defect_type,
                     'defect_level': actual_level,
                     'quantity': quantity,
-                    'package_number': final_package_number,
                     'description': description,
                     'primary_dept': primary_dept,
                     'secondary_dept': secondary_dept,
@@ -1631,7 +4138,8 @@ def defect_registration_page():
                     'component': final_component
                 }
 
-                defect_id = add_defect(defect_data)
+                # 包數於寫入時配發，以實際配發結果為準
+                defect_id, final_package_number = add_defect(defect_data)
 
                 # 簡潔的成功提示
                 st.success(f"✅ 登錄成功！編號：{defect_id}")
@@ -1645,8 +4153,7 @@ def defect_registration_page():
                     st.info(f"🔄 次要責任：{secondary_dept} - 待分配")
 
                 # 處理時限提醒
-                level_hours = {'A級': 4, 'B級': 8, 'C級': 24}
-                deadline = datetime.now() + timedelta(hours=level_hours[actual_level])
+                deadline = local_now() + timedelta(hours=get_processing_deadline_hours()[actual_level])
                 st.warning(f"⏰ 處理截止：{deadline.strftime('%m/%d %H:%M')}")
 
 def tracking_page():
@@ -1666,26 +4173,51 @@ def tracking_page():
     with col3:
         level_filter = st.selectbox("等級篩選", ["全部", "A級", "B級", "C級"])
 
-    # 獲取資料
-    all_defects = get_defects()
+    search_text = st.text_input("🔎 全文搜尋", key="tracking_search",
+                                placeholder="搜尋問題描述、處理結果、不良零件及處理記錄，多個關鍵字以空白分隔").strip()
 
-    if all_defects.empty:
-        st.info("目前沒有不良品記錄")
-        return
+    # 篩選條件直接交由資料庫處理
+    filters = {
+        'status': status_filter if status_filter != "全部" else None,
+        'responsible_dept': dept_filter if dept_filter != "全部" else None,
+        'defect_level': level_filter if level_filter != "全部" else None,
+    }
+    if search_text:
+        total_count = count_search_defects(search_text, **filters)
+    else:
+        total_count = count_defects(**filters)
 
-    # 應用篩選器
-    filtered_defects = all_defects.copy()
+    if total_count == 0:
+        if not any(filters.values()) and not search_text and count_defects() == 0:
+            st.info("目前沒有不良品記錄")
+            return
+        st.write("📊 共找到 0 筆記錄")
+        return
 
-    if status_filter != "全部":
-        filtered_defects = filtered_defects[filtered_defects['status'] == status_filter]
+    # 分頁
+    page_size = TRACKING_PAGE_SIZE
+    total_pages = (total_count - 1) // page_size + 1
+    if total_pages > 1:
+        page_number = st.number_input("頁數", min_value=1, max_value=total_pages, value=1, step=1,
+                                      key="tracking_page_number")
+    else:
+        page_number = 1
 
-    if dept_filter != "全部":
-        filtered_defects = filtered_defects[filtered_defects['responsible_dept'] == dept_filter]
+    if search_text:
+        # 搜尋結果依相關度排序
+        filtered_defects = search_defects(search_text, **filters, limit=page_size,
+                                          offset=(page_number - 1) * page_size)
+    else:
+        filtered_defects = get_defects(**filters, limit=page_size, offset=(page_number - 1) * page_size)
 
-    if level_filter != "全部":
-        filtered_defects = filtered_defects[filtered_defects['defect_level'] == level_filter]
+    st.write(f"📊 共找到 {total_count} 筆記錄" +
+             (f"（第 {page_number}/{total_pages} 頁）" if total_pages > 1 else ""))
 
-    st.write(f"📊 共找到 {len(filtered_defects)} 筆記錄")
+    # 處理記錄只讀取勾選顯示的不良品，整頁以單一查詢取得
+    show_all_logs = st.checkbox("顯示本頁全部處理記錄", key="tracking_show_all_logs")
+    log_ids = [defect_id for defect_id in filtered_defects['id']
+               if show_all_logs or st.session_state.get(f"show_logs_{defect_id}")]
+    page_logs = get_processing_logs_bulk(log_ids)
 
     # 顯示不良品列表
     for _, defect in filtered_defects.iterrows():
@@ -1724,16 +4256,15 @@ def tracking_page():
             with col2:
                 st.write(f"**建立時間:** {defect['created_time']}")
 
-                if pd.notna(defect['deadline']):
-                    deadline = pd.to_datetime(defect['deadline'])
-                    time_left = deadline - datetime.now()
+                if pd.notna(defect['deadline_epoch']):
+                    time_left = defect['deadline_epoch'] - time.time()
 
                     if defect['status'] != '已完成':
-                        if time_left.total_seconds() < 0:
+                        if time_left < 0:
                             st.error("⏰ 已超時")
                         else:
-                            hours = int(time_left.total_seconds()/3600)
-                            minutes = int((time_left.total_seconds() % 3600) / 60)
+                            hours = int(time_left / 3600)
+                            minutes = int((time_left % 3600) / 60)
                             st.info(f"⏳ 剩餘: {hours}h{minutes}m")
 
                 if defect['completion_time']:
@@ -1793,14 +4324,10 @@ def tracking_page():
 
                 # 如果沒有設定負責人，根據部門獲取預設負責人
                 if not primary_person:
-                    personnel_settings = load_personnel_settings()
-                    if primary_dept in personnel_settings:
-                        primary_person = personnel_settings[primary_dept][0] if personnel_settings[primary_dept] else ''
+                    primary_person = next(iter(get_responsible_persons_by_dept(primary_dept)), '')
 
                 if not secondary_person:
-                    personnel_settings = load_personnel_settings()
-                    if secondary_dept in personnel_settings:
-                        secondary_person = personnel_settings[secondary_dept][0] if personnel_settings[secondary_dept] else ''
+                    secondary_person = next(iter(get_responsible_persons_by_dept(secondary_dept)), '')
 
                 st.write(f"**🔄 流程狀態:** {approval_status}")
                 if primary_dept and secondary_dept:
@@ -1925,45 +4452,19 @@ def tracking_page():
                                         st.error("請選擇剩餘NG品的處理方式")
                                         return
 
-                                # 組合處理結果和備註
-                                final_resolution = resolution
-
-                                # 如果是OK品，添加數量信息
-                                if resolution == "TRA11 判定後為OK品":
-                                    remaining_defects = int(defect['quantity']) - ok_quantity
-                                    final_resolution += f"（OK品：{ok_quantity} pcs"
-                                    if remaining_defects > 0:
-                                        final_resolution += f"，剩餘NG品：{remaining_defects} pcs - {ng_resolution}）"
-                                    else:
-                                        final_resolution += "）"
-
-                                if resolution_note:
-                                    final_resolution += f" - {resolution_note}"
+                                # 組合處理結果：OK品數量、NG品數量及處理方式分別存入欄位
+                                final_resolution = build_resolution(
+                                    resolution, defect['quantity'],
+                                    ok_qty=ok_quantity if resolution == RESOLUTION_OK_CODE else None,
+                                    ng_method=ng_resolution or None, note=resolution_note
+                                )
 
                                 # 更新為待次要單位簽核狀態
-                                conn = sqlite3.connect('defect_management.db')
-                                cursor = conn.cursor()
-
                                 # 確保secondary_dept不為空，如果為空則使用默認值
                                 target_dept = secondary_dept if secondary_dept else '品保部'
+                                submit_defect_resolution(defect['id'], final_resolution, target_dept, secondary_person,
+                                                         defective_component, primary_dept, st.session_state.user['name'])
 
-                                cursor.execute('''
-                                    UPDATE defects
-                                    SET status = '處理中', resolution = ?, approval_status = '待次要單位簽核',
-                                        responsible_dept = ?, assigned_person = ?, defective_component = ?, updated_time = CURRENT_TIMESTAMP
-                                    WHERE id = ?
-                                ''', (final_resolution, target_dept, secondary_person, defective_component, defect['id']))
-
-                                # 添加處理記錄
-                                log_comment = f"{final_resolution} - 不良零件: {defective_component}"
-                                cursor.execute('''
-                                    INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (defect['id'], f'主要單位({primary_dept})處理完成，提交簽核', primary_dept,
-                                     st.session_state.user['name'], log_comment))
-
-                                conn.commit()
-                                conn.close()
                                 st.success(f"✅ 處理完成！已轉交{target_dept}簽核")
                                 st.rerun()
                             else:
@@ -2026,58 +4527,13 @@ def tracking_page():
                             # 檢查是否需要第三責任人簽核
                             third_info = get_third_responsible_info(defect['resolution']) if defect['resolution'] else None
 
-                            conn = sqlite3.connect('defect_management.db')
-                            cursor = conn.cursor()
+                            approve_defect(defect['id'], secondary_dept, st.session_state.user['name'], approve_note, third_info)
 
                             if third_info:
-                                # 需要第三責任人簽核，更新為待第三責任人簽核狀態
-                                cursor.execute('''
-                                    UPDATE defects
-                                    SET approval_status = '待第三責任人簽核',
-                                        third_dept = ?, third_person = ?, third_approval_status = '待簽核',
-                                        updated_time = CURRENT_TIMESTAMP
-                                    WHERE id = ?
-                                ''', (third_info['dept'], third_info['person'], defect['id']))
-
-                                # 添加簽核記錄
-                                comment = f"簽核通過，轉交{third_info['dept']}({third_info['person']})簽核"
-                                if approve_note:
-                                    comment += f" - {approve_note}"
-
-                                cursor.execute('''
-                                    INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (defect['id'], f'{secondary_dept}簽核通過', secondary_dept,
-                                     st.session_state.user['name'], comment))
-
-                                conn.commit()
-                                conn.close()
                                 st.success(f"✅ 簽核通過！已轉交{third_info['dept']}({third_info['person']})簽核")
-                                st.rerun()
                             else:
-                                # 不需要第三責任人簽核，直接完成
-                                cursor.execute('''
-                                    UPDATE defects
-                                    SET status = '已完成', approval_status = '已簽核通過',
-                                        completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
-                                    WHERE id = ?
-                                ''', (defect['id'],))
-
-                                # 添加簽核記錄
-                                comment = "簽核通過"
-                                if approve_note:
-                                    comment += f" - {approve_note}"
-
-                                cursor.execute('''
-                                    INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (defect['id'], f'{secondary_dept}簽核通過', secondary_dept,
-                                     st.session_state.user['name'], comment))
-
-                                conn.commit()
-                                conn.close()
                                 st.success("✅ 簽核通過！案件已完成")
-                                st.rerun()
+                            st.rerun()
 
                     with col_approve2:
                         st.write("**❌ 簽核退回**")
@@ -2090,28 +4546,11 @@ def tracking_page():
                         if st.button("❌ 退回", key=f"approve_ng_{defect['id']}", use_container_width=True):
                             if reject_reason:
                                 # 退回給主要單位重新處理
-                                conn = sqlite3.connect('defect_management.db')
-                                cursor = conn.cursor()
-
                                 # 確保primary_dept不為空，如果為空則使用默認值
                                 target_primary_dept = primary_dept if primary_dept else '工程部'
+                                reject_defect(defect['id'], secondary_dept, target_primary_dept, primary_person,
+                                              st.session_state.user['name'], reject_reason)
 
-                                cursor.execute('''
-                                    UPDATE defects
-                                    SET approval_status = '主要單位處理中',
-                                        responsible_dept = ?, assigned_person = ?, updated_time = CURRENT_TIMESTAMP
-                                    WHERE id = ?
-                                ''', (target_primary_dept, primary_person, defect['id']))
-
-                                # 添加退回記錄
-                                cursor.execute('''
-                                    INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (defect['id'], f'{secondary_dept}簽核退回', secondary_dept,
-                                     st.session_state.user['name'], reject_reason))
-
-                                conn.commit()
-                                conn.close()
                                 st.success(f"⚠️ 已退回{target_primary_dept}重新處理")
                                 st.rerun()
                             else:
@@ -2152,29 +4591,8 @@ def tracking_page():
 
                         if st.button("✅ 最終通過", key=f"third_approve_ok_{defect['id']}", use_container_width=True):
                             # 更新為已完成狀態
-                            conn = sqlite3.connect('defect_management.db')
-                            cursor = conn.cursor()
-                            cursor.execute('''
-                                UPDATE defects
-                                SET status = '已完成', approval_status = '已簽核通過',
-                                    third_approval_status = '已簽核',
-                                    completion_time = CURRENT_TIMESTAMP, updated_time = CURRENT_TIMESTAMP
-                                WHERE id = ?
-                            ''', (defect['id'],))
-
-                            # 添加最終簽核記錄
-                            comment = "最終簽核通過"
-                            if third_approve_note:
-                                comment += f" - {third_approve_note}"
-
-                            cursor.execute('''
-                                INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                VALUES (?, ?, ?, ?, ?)
-                            ''', (defect['id'], f'{third_dept}最終簽核通過', third_dept,
-                                 st.session_state.user['name'], comment))
-
-                            conn.commit()
-                            conn.close()
+                            final_approve_defect(defect['id'], third_dept, st.session_state.user['name'], third_approve_note)
+
                             st.success("✅ 最終簽核通過！案件已完成")
                             st.rerun()
 
@@ -2189,30 +4607,11 @@ def tracking_page():
                         if st.button("❌ 退回重處理", key=f"third_approve_ng_{defect['id']}", use_container_width=True):
                             if third_reject_reason:
                                 # 退回給主要單位重新處理
-                                conn = sqlite3.connect('defect_management.db')
-                                cursor = conn.cursor()
-
                                 # 確保primary_dept不為空，如果為空則使用默認值
                                 target_primary_dept = primary_dept if primary_dept else '工程部'
+                                reject_defect(defect['id'], third_dept, target_primary_dept, primary_person,
+                                              st.session_state.user['name'], third_reject_reason, final_stage=True)
 
-                                cursor.execute('''
-                                    UPDATE defects
-                                    SET approval_status = '主要單位處理中',
-                                        responsible_dept = ?, assigned_person = ?,
-                                        third_approval_status = '已退回',
-                                        updated_time = CURRENT_TIMESTAMP
-                                    WHERE id = ?
-                                ''', (target_primary_dept, primary_person, defect['id']))
-
-                                # 添加退回記錄
-                                cursor.execute('''
-                                    INSERT INTO processing_logs (defect_id, action, department, operator, comment)
-                                    VALUES (?, ?, ?, ?, ?)
-                                ''', (defect['id'], f'{third_dept}最終簽核退回', third_dept,
-                                     st.session_state.user['name'], third_reject_reason))
-
-                                conn.commit()
-                                conn.close()
                                 st.success(f"⚠️ 已退回{target_primary_dept}重新處理")
                                 st.rerun()
                             else:
@@ -2220,20 +4619,59 @@ def tracking_page():
 
             # 處理記錄
             st.subheader("📝 處理記錄")
-            logs = get_processing_logs(defect['id'])
-            if not logs.empty:
-                for _, log in logs.iterrows():
-                    st.write(f"**{log['timestamp']}** - {log['department']} ({log['operator']}): {log['action']}")
-                    if log['comment']:
-                        st.write(f"備註: {log['comment']}")
-                    st.write("---")
-            else:
-                st.write("暫無處理記錄")
+            if not show_all_logs:
+                st.checkbox("顯示處理記錄", key=f"show_logs_{defect['id']}")
+            if defect['id'] in page_logs:
+                logs = page_logs[defect['id']]
+                if not logs.empty:
+                    for _, log in logs.iterrows():
+                        st.write(f"**{log['timestamp']}** - {log['department']} ({log['operator']}): {log['action']}")
+                        if log['comment']:
+                            st.write(f"備註: {log['comment']}")
+                        st.write("---")
+                else:
+                    st.write("暫無處理記錄")
 
 def analytics_page():
     st.header("📈 統計分析")
 
-    all_defects = get_defects()
+    # 資料來源：即時資料直接讀取資料庫，欄式快照以記憶體映射讀取，不與寫入競爭
+    data_source = st.radio("資料來源", ["即時資料", "欄式快照", "讀取快照"], horizontal=True, key="analytics_data_source")
+
+    if data_source == "欄式快照":
+        snapshot_info = get_columnar_snapshot_info()
+        col_snap1, col_snap2 = st.columns([3, 1])
+        with col_snap2:
+            if st.button("🔄 更新快照", key="refresh_columnar_snapshot"):
+                with st.spinner("正在建立欄式快照..."):
+                    counts = write_columnar_snapshot()
+                st.success(f"✅ 快照已更新：{counts['defects']} 筆不良品、{counts['processing_logs']} 筆處理記錄")
+                snapshot_info = get_columnar_snapshot_info()
+        with col_snap1:
+            if snapshot_info is None:
+                st.info("📦 尚未建立欄式快照，請點擊「更新快照」")
+                return
+            st.caption(f"📦 快照時間：{snapshot_info['snapshot_time']}｜{snapshot_info['row_count']} 筆｜"
+                       f"{snapshot_info['file_size'] / 1024 / 1024:.1f} MB")
+            if snapshot_info['data_version'] != get_data_version('defects'):
+                st.caption("⚠️ 快照建立後資料已有異動，可點擊「更新快照」取得最新資料")
+        all_defects = load_columnar_snapshot()
+    elif data_source == "讀取快照":
+        # 讀取快照為資料庫的唯讀備份，大量分析不會與登錄及簽核寫入競爭
+        read_info = get_read_snapshot_info()
+        col_snap1, col_snap2 = st.columns([3, 1])
+        with col_snap2:
+            if st.button("🔄 立即更新", key="refresh_read_snapshot"):
+                with st.spinner("正在備份資料庫..."):
+                    read_info = create_read_snapshot()
+        with col_snap1:
+            if read_info is None:
+                st.info("📦 讀取快照尚未建立，請點擊「立即更新」")
+                return
+            st.caption(f"🕒 資料時間（as of）：{read_info['as_of']}｜每 {READ_SNAPSHOT_INTERVAL_SECONDS // 60} 分鐘自動更新")
+        all_defects = load_read_snapshot_defects()
+    else:
+        all_defects = get_defects_snapshot()
 
     if all_defects.empty:
         st.info("📊 目前沒有資料可供分析，請先到「不良品登錄」頁面登錄一些記錄")
@@ -2244,9 +4682,12 @@ def analytics_page():
         st.write("3. 回到此頁面查看統計分析")
         return
 
+    # 時間欄位一次換算為 epoch／本地時間，以下各區塊直接使用，不再重複解析時間文字
+    all_defects = add_local_time_columns(all_defects)
+
     # 顯示資料概況
     st.write(f"📊 **資料概況：** 共 {len(all_defects)} 筆記錄，總數量 {all_defects['quantity'].sum()} pcs")
-    st.write(f"📅 **時間範圍：** {pd.to_datetime(all_defects['created_time']).min().strftime('%Y-%m-%d')} 至 {pd.to_datetime(all_defects['created_time']).max().strftime('%Y-%m-%d')}")
+    st.write(f"📅 **時間範圍：** {all_defects['created_date'].min()} 至 {all_defects['created_date'].max()}")
     st.divider()
 
     # 分析控制面板
@@ -2262,10 +4703,18 @@ def analytics_page():
         if st.button("🔄 刷新數據"):
             st.rerun()
 
-    if date_range != "全部":
-        days_map = {"最近7天": 7, "最近30天": 30, "最近90天": 90}
-        cutoff_date = datetime.now() - timedelta(days=days_map[date_range])
-        all_defects = all_defects[pd.to_datetime(all_defects['created_time']) >= cutoff_date]
+    days_map = {"最近7天": 7, "最近30天": 30, "最近90天": 90}
+    cutoff_epoch = int(time.time()) - days_map[date_range] * 86400 if date_range != "全部" else None
+
+    # 時間範圍超過歸檔天數時，合併讀取即時資料與月份歸檔資料
+    include_archive = (data_source == "即時資料" and bool(list_archive_months())
+                       and (cutoff_epoch is None or days_map[date_range] > DEFECT_ARCHIVE_AGE_DAYS))
+    if include_archive:
+        all_defects = add_local_time_columns(load_defects_with_archive(cutoff_epoch))
+    elif cutoff_epoch is not None:
+        all_defects = all_defects[all_defects['created_epoch'] >= cutoff_epoch]
+    # 零件統計只有即時資料可直接由資料庫彙總
+    use_component_table = data_source == "即時資料" and not include_archive
 
     # 整體統計
     col1, col2, col3, col4 = st.columns(4)
@@ -2290,8 +4739,7 @@ def analytics_page():
         # 計算平均處理時間
         completed_defects = all_defects[all_defects['status'] == '已完成']
         if not completed_defects.empty:
-            avg_time = (pd.to_datetime(completed_defects['completion_time']) -
-                       pd.to_datetime(completed_defects['created_time'])).dt.total_seconds().mean() / 3600
+            avg_time = (completed_defects['completion_epoch'] - completed_defects['created_epoch']).mean() / 3600
             st.metric("平均處理時間", f"{avg_time:.1f}小時")
         else:
             st.metric("平均處理時間", "無資料")
@@ -2301,31 +4749,18 @@ def analytics_page():
     # 工單不良率分析
     st.subheader("📊 工單不良率分析")
 
-    # 計算每個工單的不良率
-    work_order_stats = []
-    work_orders = all_defects['work_order'].unique()
-
-    for wo in work_orders:
-        wo_data = all_defects[all_defects['work_order'] == wo]
-        total_defects = wo_data['quantity'].sum()
-        total_qty = wo_data['work_order_total_qty'].max()  # 取最大值作為工單總數
-        record_count = len(wo_data)
-
-        if total_qty > 0:
-            defect_rate = (total_defects / total_qty) * 100
-        else:
-            defect_rate = 0
-
-        work_order_stats.append({
-            'work_order': wo,
-            'total_defects': total_defects,
-            'total_qty': total_qty,
-            'record_count': record_count,
-            'defect_rate': defect_rate
-        })
-
-    if work_order_stats:
-        wo_df = pd.DataFrame(work_order_stats)
+    # 計算每個工單的不良率：全部期間直接讀取工單統計表，指定期間則依篩選後資料分組計算
+    if date_range == "全部" and data_source == "即時資料" and not include_archive:
+        wo_df = get_all_work_order_stats()
+    else:
+        wo_df = all_defects.groupby('work_order').agg(
+            total_defects=('quantity', 'sum'),
+            total_qty=('work_order_total_qty', 'max'),  # 取最大值作為工單總數
+            record_count=('id', 'size')
+        ).reset_index()
+        wo_df['defect_rate'] = (wo_df['total_defects'] / wo_df['total_qty'].where(wo_df['total_qty'] > 0) * 100).fillna(0)
+
+    if not wo_df.empty:
         wo_df = wo_df.sort_values('defect_rate', ascending=False)
 
         col1, col2 = st.columns(2)
@@ -2492,37 +4927,22 @@ def analytics_page():
     # 零件不良分析
     st.subheader("🔧 零件不良分析")
 
-    # 檢查是否有零件不良資料
-    # 先檢查 defective_component 欄位是否存在
-    if 'defective_component' in analysis_data.columns:
-        component_data = analysis_data[analysis_data['defective_component'].notna() & (analysis_data['defective_component'] != '')]
+    # 即時資料直接由零件明細表彙總，欄式快照及歸檔資料則由已載入的資料計算
+    if use_component_table:
+        comp_df = get_component_stats(created_from=cutoff_epoch,
+                                      work_order=selected_wo if selected_wo != '全部工單' else None)
     else:
-        component_data = pd.DataFrame()  # 建立空的 DataFrame
+        comp_df = component_stats_from_frame(analysis_data)
+    has_components = not comp_df.empty
 
-    if not component_data.empty:
+    if has_components:
+        comp_stats = comp_df.groupby('component')['quantity'].sum().sort_values(ascending=False)
         col1, col2 = st.columns(2)
 
         with col1:
             st.write("**📊 零件不良統計**")
 
-            # 處理複合零件（用分號分隔的）
-            component_expanded = []
-            for _, row in component_data.iterrows():
-                components = str(row['defective_component']).split(';')
-                for comp in components:
-                    comp = comp.strip()
-                    if comp:
-                        component_expanded.append({
-                            'component': comp,
-                            'quantity': row['quantity'],
-                            'defect_type': row['defect_type'],
-                            'product_name': row['product_name']
-                        })
-
-            if component_expanded:
-                comp_df = pd.DataFrame(component_expanded)
-                comp_stats = comp_df.groupby('component')['quantity'].sum().sort_values(ascending=False)
-
+            if has_components:
                 fig_component = px.bar(
                     x=comp_stats.index,
                     y=comp_stats.values,
@@ -2554,7 +4974,7 @@ def analytics_page():
             st.write("**🔍 零件不良詳細分析**")
 
             # 零件佔比表
-            if component_expanded:
+            if has_components:
                 comp_total = comp_stats.sum()
                 comp_percent_df = pd.DataFrame({
                     '零件類型': comp_stats.index,
@@ -2579,18 +4999,10 @@ def analytics_page():
         # 零件趨勢分析
         st.write("**📈 零件不良趨勢分析**")
         
-        if component_expanded:
+        if has_components:
             # 按日期統計零件不良
-            comp_df_with_date = pd.merge(
-                pd.DataFrame(component_expanded),
-                component_data[['created_time']].reset_index(),
-                left_index=True,
-                right_index=True,
-                how='left'
-            )
-            
-            comp_df_with_date['date'] = pd.to_datetime(comp_df_with_date['created_time']).dt.date
-            daily_comp_stats = comp_df_with_date.groupby(['date', 'component'])['quantity'].sum().reset_index()
+            daily_comp_stats = comp_df.groupby(['date', 'component'])['quantity'].sum().reset_index()
+            daily_comp_stats['date'] = pd.to_datetime(daily_comp_stats['date']).dt.date
             
             if not daily_comp_stats.empty:
                 fig_trend = px.line(
@@ -2618,7 +5030,7 @@ def analytics_page():
         # 零件不良改善建議
         st.write("**💡 零件不良改善建議**")
         
-        if component_expanded:
+        if has_components:
             # 找出最常見的不良零件
             top_component = comp_stats.index[0]
             top_quantity = comp_stats.iloc[0]
@@ -2714,9 +5126,8 @@ def analytics_page():
                      # 調試信息：顯示原始資料
                      st.write(f"🔍 **調試信息：** 原始資料筆數 {len(all_defects_copy)}")
 
-                     # 轉換日期格式
-                     all_defects_copy['created_time'] = pd.to_datetime(all_defects_copy['created_time'])
-                     all_defects_copy['date'] = all_defects_copy['created_time'].dt.date
+                     # 建立日期（本地時間）
+                     all_defects_copy['date'] = all_defects_copy['created_at'].dt.date
 
                      # 按日期分組統計
                      daily_quantity = all_defects_copy.groupby('date')['quantity'].sum().reset_index()
@@ -2889,9 +5300,8 @@ def analytics_page():
             if not completed_defects.empty:
                 completed_defects_copy = completed_defects.copy()
                 completed_defects_copy['processing_hours'] = (
-                    pd.to_datetime(completed_defects_copy['completion_time']) -
-                    pd.to_datetime(completed_defects_copy['created_time'])
-                ).dt.total_seconds() / 3600
+                    completed_defects_copy['completion_epoch'] - completed_defects_copy['created_epoch']
+                ) / 3600
 
                 fig_hist = px.histogram(
                     completed_defects_copy,
@@ -2913,15 +5323,10 @@ def analytics_page():
     else:  # 對比視圖
         st.subheader("📈 時間對比分析")
 
-        # 本週vs上週對比
-        current_week = datetime.now().isocalendar()[1]
-        current_year = datetime.now().year
-
-        all_defects['week'] = pd.to_datetime(all_defects['created_time']).dt.isocalendar().week
-        all_defects['year'] = pd.to_datetime(all_defects['created_time']).dt.year
-
-        current_week_data = all_defects[(all_defects['week'] == current_week) & (all_defects['year'] == current_year)]
-        last_week_data = all_defects[(all_defects['week'] == current_week-1) & (all_defects['year'] == current_year)]
+        # 本週vs上週對比（以 ISO 週比較，跨年亦正確）
+        now = local_now()
+        current_week_data = all_defects[all_defects['created_week'] == iso_week_key(now)]
+        last_week_data = all_defects[all_defects['created_week'] == iso_week_key(now - timedelta(days=7))]
 
         col1, col2, col3 = st.columns(3)
 
@@ -2946,70 +5351,18 @@ def analytics_page():
     # 獲取已完成的案件進行處理方式分析
     completed_defects = all_defects[all_defects['status'] == '已完成']
 
-    if not completed_defects.empty and 'resolution' in completed_defects.columns:
-        # 解析處理方式
-        resolution_data = []
-        for _, defect in completed_defects.iterrows():
-            resolution = defect['resolution']
-            quantity = defect['quantity']
+    if not completed_defects.empty and {'ok_qty', 'ng_qty', 'ng_method'}.issubset(completed_defects.columns):
+        # 直接讀取結構化欄位：OK品數量歸入「OK品判定」，NG品數量依處理方式分組
+        base_columns = {'work_order': '工單', 'product_name': '產品', 'responsible_dept': '部門'}
+        ok_part = completed_defects[completed_defects['ok_qty'].fillna(0) > 0]
+        ng_part = completed_defects[(completed_defects['ng_qty'].fillna(0) > 0) & (completed_defects['ng_method'].fillna('') != '')]
+        resolution_df = pd.concat([
+            ok_part[list(base_columns)].rename(columns=base_columns).assign(處理方式='OK品判定', 數量=ok_part['ok_qty']),
+            ng_part[list(base_columns)].rename(columns=base_columns).assign(處理方式=ng_part['ng_method'], 數量=ng_part['ng_qty']),
+        ], ignore_index=True)
+        resolution_df['數量'] = resolution_df['數量'].astype(int)
 
-            if pd.isna(resolution) or resolution == '':
-                continue
-
-            # 解析不同的處理方式
-            if 'TRA11 判定後為OK品' in resolution:
-                # 解析OK品和NG品處理
-                if '剩餘NG品：' in resolution:
-                    # 有剩餘NG品的情況
-                    try:
-                        # 提取OK品數量
-                        ok_match = re.search(r'OK品：(\d+) pcs', resolution)
-                        ng_match = re.search(r'剩餘NG品：(\d+) pcs - (\w+)', resolution)
-
-                        if ok_match:
-                            ok_qty = int(ok_match.group(1))
-                            resolution_data.append({
-                                '處理方式': 'OK品判定',
-                                '數量': ok_qty,
-                                '工單': defect['work_order'],
-                                '產品': defect['product_name'],
-                                '部門': defect['responsible_dept']
-                            })
-
-                        if ng_match:
-                            ng_qty = int(ng_match.group(1))
-                            ng_method = ng_match.group(2)
-                            resolution_data.append({
-                                '處理方式': ng_method,
-                                '數量': ng_qty,
-                                '工單': defect['work_order'],
-                                '產品': defect['product_name'],
-                                '部門': defect['responsible_dept']
-                            })
-                    except:
-                        pass
-                else:
-                    # 全部為OK品
-                    resolution_data.append({
-                        '處理方式': 'OK品判定',
-                        '數量': quantity,
-                        '工單': defect['work_order'],
-                        '產品': defect['product_name'],
-                        '部門': defect['responsible_dept']
-                    })
-            else:
-                # 其他處理方式
-                method = resolution.split(' - ')[0]  # 去除備註部分
-                resolution_data.append({
-                    '處理方式': method,
-                    '數量': quantity,
-                    '工單': defect['work_order'],
-                    '產品': defect['product_name'],
-                    '部門': defect['responsible_dept']
-                })
-
-        if resolution_data:
-            resolution_df = pd.DataFrame(resolution_data)
+        if not resolution_df.empty:
 
             # 處理方式統計圖表
             col1, col2 = st.columns(2)
@@ -3233,8 +5586,7 @@ def analytics_page():
                 # 計算平均處理時間
                 completed_cases = assignee_defects[assignee_defects['status'] == '已完成']
                 if not completed_cases.empty:
-                    avg_processing_time = (pd.to_datetime(completed_cases['completion_time']) -
-                                         pd.to_datetime(completed_cases['created_time'])).dt.total_seconds().mean() / 3600
+                    avg_processing_time = (completed_cases['completion_epoch'] - completed_cases['created_epoch']).mean() / 3600
                 else:
                     avg_processing_time = 0
 
@@ -3242,10 +5594,9 @@ def analytics_page():
                 pending_cases = len(assignee_defects[assignee_defects['status'].isin(['待處理', '處理中'])])
 
                 # 計算逾期案件數
-                current_time = datetime.now()
                 overdue_cases = len(assignee_defects[
                     (assignee_defects['status'].isin(['待處理', '處理中'])) &
-                    (pd.to_datetime(assignee_defects['deadline']) < current_time)
+                    (assignee_defects['deadline_epoch'] < time.time())
                 ])
 
                 detailed_assignee_analysis.append({
@@ -3303,8 +5654,7 @@ def analytics_page():
             # 計算平均處理時間
             completed_dept = dept_defects[dept_defects['status'] == '已完成']
             if not completed_dept.empty:
-                avg_time = (pd.to_datetime(completed_dept['completion_time']) -
-                           pd.to_datetime(completed_dept['created_time'])).dt.total_seconds().mean() / 3600
+                avg_time = (completed_dept['completion_epoch'] - completed_dept['created_epoch']).mean() / 3600
             else:
                 avg_time = 0
 
@@ -3337,38 +5687,23 @@ def analytics_page():
 
     with col3:
         if st.button("📥 匯出詳細資料"):
-            # 重複導出邏輯，但這裡只針對當前篩選的資料
-            if not all_defects.empty:
-                export_data = all_defects[[
-                    'id', 'work_order', 'package_number', 'product_name', 'defect_type',
-                    'defect_level', 'quantity', 'description', 'responsible_dept',
-                    'assigned_person', 'status', 'resolution', 'created_time',
-                    'deadline', 'completion_time'
-                ]].copy()
-
-                export_data.columns = [
-                    '編號', '工單號碼', '包數', '產品名稱', '不良類型',
-                    '不良等級', '數量(pcs)', '問題描述', '責任部門',
-                    '負責人', '處理狀態', '處理結果', '建立時間',
-                    '處理截止時間', '完成時間'
-                ]
-
-                csv = export_data.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="📥 下載詳細資料CSV",
-                    data=csv,
-                    file_name=f"不良品詳細資料_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv",
-                    help="包含包數信息的詳細不良品記錄"
-                )
+            # 只匯出目前分析時間範圍內的資料，由資料庫分批讀取
+            export_download_button(
+                "📥 下載詳細資料CSV",
+                key="analytics_export_download",
+                help="包含包數信息的詳細不良品記錄",
+                file_prefix="不良品詳細資料",
+                include_archive=include_archive,
+                created_from=cutoff_epoch
+            )
 
     # 排序資料
     display_defects = all_defects.copy()
 
     if sort_by == "建立時間(新→舊)":
-        display_defects = display_defects.sort_values('created_time', ascending=False)
+        display_defects = display_defects.sort_values('created_epoch', ascending=False)
     elif sort_by == "建立時間(舊→新)":
-        display_defects = display_defects.sort_values('created_time', ascending=True)
+        display_defects = display_defects.sort_values('created_epoch', ascending=True)
     elif sort_by == "包數(小→大)":
         display_defects = display_defects.sort_values(['work_order', 'package_number'], ascending=[True, True])
     elif sort_by == "包數(大→小)":
@@ -3388,7 +5723,7 @@ def analytics_page():
         detail_data = display_defects[[
             'work_order', 'package_number', 'product_name', 'defect_type',
             'defect_level', 'quantity', 'responsible_dept', 'assigned_person',
-            'status', 'created_time'
+            'status', 'created_at'
         ]].copy()
 
         # 格式化包數顯示
@@ -3398,7 +5733,7 @@ def analytics_page():
         detail_data_display = detail_data[[
             'work_order', 'package_display', 'product_name', 'defect_type',
             'defect_level', 'quantity', 'responsible_dept', 'assigned_person',
-            'status', 'created_time'
+            'status', 'created_at'
         ]].copy()
 
         detail_data_display.columns = [
@@ -3408,7 +5743,7 @@ def analytics_page():
         ]
 
         # 格式化時間顯示
-        detail_data_display['建立時間'] = pd.to_datetime(detail_data_display['建立時間']).dt.strftime('%Y-%m-%d %H:%M')
+        detail_data_display['建立時間'] = detail_data_display['建立時間'].dt.strftime('%Y-%m-%d %H:%M')
 
         st.write(f"**📊 顯示 {len(detail_data_display)} 筆記錄** (共 {len(all_defects)} 筆)")
         st.dataframe(detail_data_display, use_container_width=True, height=400)
@@ -3426,8 +5761,8 @@ def analytics_page():
             'status': lambda x: f"{sum(x=='已完成')}/{len(x)}",
             'responsible_dept': lambda x: ', '.join(x.unique()),
             'assigned_person': lambda x: ', '.join(x.unique()),
-            'created_time': ['min', 'max'],
-            'completion_time': lambda x: sum(pd.notna(x))
+            'created_at': ['min', 'max'],
+            'completion_epoch': lambda x: sum(pd.notna(x))
         }).reset_index()
 
         # 重新命名欄位
@@ -3459,10 +5794,7 @@ def analytics_page():
         )
 
         # 計算處理天數
-        work_order_stats['處理天數'] = (
-            pd.to_datetime(work_order_stats['最晚建立']) -
-            pd.to_datetime(work_order_stats['最早建立'])
-        ).dt.days + 1
+        work_order_stats['處理天數'] = (work_order_stats['最晚建立'] - work_order_stats['最早建立']).dt.days + 1
 
         # 重新排列欄位順序 - 突出數量資訊與處理進度
         work_order_display = work_order_stats[[
@@ -3660,19 +5992,18 @@ def analytics_page():
 
         # 計算每筆記錄的處理時間
         processing_time_data = []
+        current_time = time.time()
         for _, defect in display_defects.iterrows():
-            created_time = pd.to_datetime(defect['created_time'])
+            created_time = defect['created_at']
 
             # 處理時間計算
-            if defect['status'] == '已完成' and pd.notna(defect.get('completion_time')):
-                completion_time = pd.to_datetime(defect['completion_time'])
-                processing_hours = (completion_time - created_time).total_seconds() / 3600
+            if defect['status'] == '已完成' and pd.notna(defect['completion_epoch']):
+                processing_hours = (defect['completion_epoch'] - defect['created_epoch']) / 3600
                 processing_days = processing_hours / 24
                 status_desc = "已完成"
             else:
                 # 對於未完成的案件，計算到目前為止的時間
-                current_time = datetime.now()
-                processing_hours = (current_time - created_time).total_seconds() / 3600
+                processing_hours = (current_time - defect['created_epoch']) / 3600
                 processing_days = processing_hours / 24
                 status_desc = defect['status']
 
@@ -3915,9 +6246,8 @@ def analytics_page():
 
         # 計算處理時間統計（基於已完成的記錄）
         completed_defects = all_defects[all_defects['status'] == '已完成']
-        if not completed_defects.empty and 'completion_time' in completed_defects.columns:
-            processing_days = (pd.to_datetime(completed_defects['completion_time']) -
-                             pd.to_datetime(completed_defects['created_time'])).dt.total_seconds().mean() / (24 * 3600)
+        if not completed_defects.empty:
+            processing_days = (completed_defects['completion_epoch'] - completed_defects['created_epoch']).mean() / (24 * 3600)
         else:
             processing_days = 0
 
@@ -3970,39 +6300,26 @@ def analytics_page():
                 else:
                     findings.append(f"⏰ 平均處理時間為 **{processing_days:.1f}** 天，處理效率良好")
 
-            # 零件不良分析
-            # 先檢查 defective_component 欄位是否存在
-            if 'defective_component' in all_defects.columns:
-                component_data = all_defects[all_defects['defective_component'].notna() & (all_defects['defective_component'] != '')]
+            # 零件不良分析（全部工單的零件彙總，改善建議共用）
+            if use_component_table:
+                all_comp_df = get_component_stats(created_from=cutoff_epoch)
             else:
-                component_data = pd.DataFrame()  # 建立空的 DataFrame
-            if not component_data.empty:
-                # 處理複合零件
-                component_expanded = []
-                for _, row in component_data.iterrows():
-                    components = str(row['defective_component']).split(';')
-                    for comp in components:
-                        comp = comp.strip()
-                        if comp:
-                            component_expanded.append({'component': comp, 'quantity': row['quantity']})
-
-                if component_expanded:
-                    comp_df = pd.DataFrame(component_expanded)
-                    comp_stats = comp_df.groupby('component')['quantity'].sum().sort_values(ascending=False)
-                    
-                    if not comp_stats.empty:
-                        top_component = comp_stats.index[0]
-                        top_quantity = comp_stats.iloc[0]
-                        total_comp_quantity = comp_stats.sum()
-                        top_percentage = (top_quantity / total_comp_quantity * 100)
-                        
-                        findings.append(f"🔧 **{top_component}** 是最常見的不良零件，佔零件不良的 **{top_percentage:.1f}%** ({top_quantity} pcs)")
-                        
-                        # 如果有多個零件類型，顯示前三名
-                        if len(comp_stats) > 1:
-                            top_3 = comp_stats.head(3)
-                            top_3_names = ", ".join(top_3.index)
-                            findings.append(f"🔧 主要不良零件為：**{top_3_names}**，合計佔 **{(top_3.sum()/total_comp_quantity*100):.1f}%**")
+                all_comp_df = component_stats_from_frame(all_defects)
+            all_comp_stats = all_comp_df.groupby('component')['quantity'].sum().sort_values(ascending=False)
+
+            if not all_comp_stats.empty:
+                top_component = all_comp_stats.index[0]
+                top_quantity = all_comp_stats.iloc[0]
+                total_comp_quantity = all_comp_stats.sum()
+                top_percentage = (top_quantity / total_comp_quantity * 100)
+
+                findings.append(f"🔧 **{top_component}** 是最常見的不良零件，佔零件不良的 **{top_percentage:.1f}%** ({top_quantity} pcs)")
+
+                # 如果有多個零件類型，顯示前三名
+                if len(all_comp_stats) > 1:
+                    top_3 = all_comp_stats.head(3)
+                    top_3_names = ", ".join(top_3.index)
+                    findings.append(f"🔧 主要不良零件為：**{top_3_names}**，合計佔 **{(top_3.sum()/total_comp_quantity*100):.1f}%**")
 
             for finding in findings:
                 st.markdown(f"• {finding}")
@@ -4060,27 +6377,8 @@ def analytics_page():
                 })
 
             # 零件不良建議
-            # 確保 component_data 變數已定義
-            if 'defective_component' in all_defects.columns:
-                temp_component_data = all_defects[all_defects['defective_component'].notna() & (all_defects['defective_component'] != '')]
-                
-                # 處理複合零件
-                temp_component_expanded = []
-                for _, row in temp_component_data.iterrows():
-                    components = str(row['defective_component']).split(';')
-                    for comp in components:
-                        comp = comp.strip()
-                        if comp:
-                            temp_component_expanded.append({'component': comp, 'quantity': row['quantity']})
-                
-                if temp_component_expanded:
-                    comp_df = pd.DataFrame(temp_component_expanded)
-                    comp_stats = comp_df.groupby('component')['quantity'].sum().sort_values(ascending=False)
-            else:
-                temp_component_expanded = []
-                comp_stats = pd.Series(dtype='int64')
-            
-            if len(temp_component_expanded) > 0 and not comp_stats.empty:
+            comp_stats = all_comp_stats
+            if not comp_stats.empty:
                     top_component = comp_stats.index[0]
                     top_percentage = (comp_stats.iloc[0] / comp_stats.sum() * 100)
                     
@@ -4220,7 +6518,7 @@ def settings_page():
     st.subheader("📧 通知設定")
 
     # 載入當前設定
-    current_settings = notification_manager.settings.copy()
+    current_settings = notification_manager.load_notification_settings()
 
     # 通知方式選擇
     st.write("**📱 通知方式選擇**")
@@ -4337,8 +6635,13 @@ def settings_page():
             }
         }
 
-        notification_manager.save_notification_settings(new_settings)
-        st.success("✅ 通知設定已儲存！")
+        deadlines_changed = new_settings['processing_deadlines'] != current_settings.get('processing_deadlines')
+        # 只寫入本頁修改的項目；處理時限變更時於同一交易重新計算所有未結案記錄的截止時間
+        updated_count = notification_manager.save_notification_settings(new_settings, current_settings)
+        if deadlines_changed:
+            st.success(f"✅ 通知設定已儲存！已依新處理時限更新 {updated_count} 筆未結案記錄的截止時間")
+        else:
+            st.success("✅ 通知設定已儲存！")
         st.rerun()
 
     # 測試通知功能
@@ -4445,10 +6748,8 @@ def settings_page():
         st.write("**⚠️ 當前逾期案件**")
 
         display_overdue = overdue_defects.copy()
-        display_overdue['逾期時間'] = display_overdue.apply(
-            lambda row: f"{((datetime.now() - pd.to_datetime(row['created_time']) - timedelta(hours=current_settings['processing_deadlines'][row['defect_level']])).total_seconds() / 3600):.1f} 小時",
-            axis=1
-        )
+        display_overdue['逾期時間'] = ((time.time() - display_overdue['deadline_epoch']) / 3600).map(
+            lambda hours: f"{hours:.1f} 小時")
 
         display_cols = ['work_order', 'product_name', 'defect_level', 'quantity', 'responsible_dept', 'created_time', '逾期時間']
         display_overdue_renamed = display_overdue[display_cols].rename(columns={
@@ -4506,21 +6807,12 @@ def settings_page():
 
         if st.button("➕ 新增人員", key="add_person"):
             if new_name:
-                new_person = {
-                    "name": new_name,
-                    "department": new_dept,
-                    "display_name": f"{new_dept}-{new_name}"
-                }
+                display_name = f"{new_dept}-{new_name}"
 
-                # 檢查是否已存在
-                existing_names = [p['display_name'] for p in personnel_settings.get('responsible_persons', [])]
-                if new_person['display_name'] not in existing_names:
-                    personnel_settings['responsible_persons'].append(new_person)
-                    if save_personnel_settings(personnel_settings):
-                        st.success(f"✅ 已新增 {new_person['display_name']}")
-                        st.rerun()
-                    else:
-                        st.error("❌ 新增失敗")
+                # 顯示名稱為唯一鍵，已存在時不會新增
+                if add_responsible_persons([(new_dept, new_name)]):
+                    st.success(f"✅ 已新增 {display_name}")
+                    st.rerun()
                 else:
                     st.warning("⚠️ 此人員已存在")
             else:
@@ -4537,15 +6829,11 @@ def settings_page():
 
             if st.button("🗑️ 刪除人員", key="delete_person"):
                 if person_to_delete != "請選擇人員":
-                    personnel_settings['responsible_persons'] = [
-                        p for p in personnel_settings['responsible_persons']
-                        if p['display_name'] != person_to_delete
-                    ]
-                    if save_personnel_settings(personnel_settings):
+                    if delete_responsible_person(person_to_delete):
                         st.success(f"✅ 已刪除 {person_to_delete}")
                         st.rerun()
                     else:
-                        st.error("❌ 刪除失敗")
+                        st.error("❌ 刪除失敗，此人員可能已被刪除")
                 else:
                     st.error("❌ 請選擇要刪除的人員")
         else:
@@ -4569,41 +6857,33 @@ def settings_page():
         if st.button("📥 批量匯入", key="batch_import"):
             if import_text:
                 lines = [line.strip() for line in import_text.split('\n') if line.strip()]
-                imported_count = 0
+                new_persons = []
                 errors = []
+                existing_names = set(get_personnel_index()['display_name_set'])
 
                 for line in lines:
                     if '-' in line:
-                        try:
-                            dept, name = line.split('-', 1)
-                            new_person = {
-                                "name": name,
-                                "department": dept,
-                                "display_name": f"{dept}-{name}"
-                            }
-
-                            # 檢查是否已存在
-                            existing_names = [p['display_name'] for p in personnel_settings.get('responsible_persons', [])]
-                            if new_person['display_name'] not in existing_names:
-                                personnel_settings['responsible_persons'].append(new_person)
-                                imported_count += 1
-                            else:
-                                errors.append(f"已存在: {new_person['display_name']}")
-                        except:
-                            errors.append(f"格式錯誤: {line}")
+                        dept, name = line.split('-', 1)
+                        display_name = f"{dept}-{name}"
+
+                        # 檢查是否已存在
+                        if display_name not in existing_names:
+                            new_persons.append((dept, name))
+                            existing_names.add(display_name)
+                        else:
+                            errors.append(f"已存在: {display_name}")
                     else:
                         errors.append(f"格式錯誤: {line}")
 
+                # 一次交易寫入，其他工作階段同時新增的人員會略過
+                imported_count = add_responsible_persons(new_persons) if new_persons else 0
                 if imported_count > 0:
-                    if save_personnel_settings(personnel_settings):
-                        st.success(f"✅ 成功匯入 {imported_count} 位人員")
-                        if errors:
-                            st.warning(f"⚠️ {len(errors)} 個項目有問題：")
-                            for error in errors:
-                                st.write(f"• {error}")
-                        st.rerun()
-                    else:
-                        st.error("❌ 儲存失敗")
+                    st.success(f"✅ 成功匯入 {imported_count} 位人員")
+                    if errors:
+                        st.warning(f"⚠️ {len(errors)} 個項目有問題：")
+                        for error in errors:
+                            st.write(f"• {error}")
+                    st.rerun()
                 else:
                     st.error("❌ 沒有成功匯入任何人員")
                     if errors:
@@ -4639,13 +6919,9 @@ def settings_page():
 
             if st.button("➕ 新增", key="add_operator"):
                 if new_operator:
-                    if new_operator not in operator_settings.get('operators', []):
-                        operator_settings['operators'].append(new_operator)
-                        if save_operator_settings(operator_settings):
-                            st.success(f"✅ 已新增 {new_operator}")
-                            st.rerun()
-                        else:
-                            st.error("❌ 新增失敗")
+                    if add_operators([new_operator]):
+                        st.success(f"✅ 已新增 {new_operator}")
+                        st.rerun()
                     else:
                         st.warning("⚠️ 此人員已存在")
                 else:
@@ -4662,12 +6938,11 @@ def settings_page():
 
                 if st.button("🗑️ 刪除", key="delete_operator"):
                     if operator_to_delete != "請選擇人員":
-                        operator_settings['operators'].remove(operator_to_delete)
-                        if save_operator_settings(operator_settings):
+                        if delete_operator(operator_to_delete):
                             st.success(f"✅ 已刪除 {operator_to_delete}")
                             st.rerun()
                         else:
-                            st.error("❌ 刪除失敗")
+                            st.error("❌ 刪除失敗，可能已被刪除")
                     else:
                         st.error("❌ 請選擇要刪除的人員")
             else:
@@ -4691,24 +6966,15 @@ def settings_page():
         if st.button("📥 批量匯入", key="batch_import_operators"):
             if import_operators_text:
                 lines = [line.strip() for line in import_operators_text.split('\n') if line.strip()]
-                imported_count = 0
-                existing_count = 0
-
-                for operator_name in lines:
-                    if operator_name not in operator_settings.get('operators', []):
-                        operator_settings['operators'].append(operator_name)
-                        imported_count += 1
-                    else:
-                        existing_count += 1
+                # 重複及已存在的名稱由資料表唯一鍵略過
+                imported_count = add_operators(lines)
+                existing_count = len(lines) - imported_count
 
                 if imported_count > 0:
-                    if save_operator_settings(operator_settings):
-                        st.success(f"✅ 成功匯入 {imported_count} 位登錄人員")
-                        if existing_count > 0:
-                            st.info(f"ℹ️ {existing_count} 位人員已存在，跳過匯入")
-                        st.rerun()
-                    else:
-                        st.error("❌ 儲存失敗")
+                    st.success(f"✅ 成功匯入 {imported_count} 位登錄人員")
+                    if existing_count > 0:
+                        st.info(f"ℹ️ {existing_count} 位人員已存在，跳過匯入")
+                    st.rerun()
                 else:
                     st.warning("⚠️ 所有人員都已存在，沒有新增任何人員")
             else:
@@ -4741,13 +7007,9 @@ def settings_page():
 
             if st.button("➕ 新增", key="add_product"):
                 if new_product:
-                    if new_product not in product_settings.get('products', []):
-                        product_settings['products'].append(new_product)
-                        if save_product_settings(product_settings):
-                            st.success(f"✅ 已新增 {new_product}")
-                            st.rerun()
-                        else:
-                            st.error("❌ 新增失敗")
+                    if add_products([new_product]):
+                        st.success(f"✅ 已新增 {new_product}")
+                        st.rerun()
                     else:
                         st.warning("⚠️ 此產品名稱已存在")
                 else:
@@ -4764,12 +7026,11 @@ def settings_page():
 
                 if st.button("🗑️ 刪除", key="delete_product"):
                     if product_to_delete != "請選擇產品":
-                        product_settings['products'].remove(product_to_delete)
-                        if save_product_settings(product_settings):
+                        if delete_product(product_to_delete):
                             st.success(f"✅ 已刪除 {product_to_delete}")
                             st.rerun()
                         else:
-                            st.error("❌ 刪除失敗")
+                            st.error("❌ 刪除失敗，可能已被刪除")
                     else:
                         st.error("❌ 請選擇要刪除的產品")
             else:
@@ -4793,24 +7054,15 @@ def settings_page():
         if st.button("📥 批量匯入", key="batch_import_products"):
             if import_products_text:
                 lines = [line.strip() for line in import_products_text.split('\n') if line.strip()]
-                imported_count = 0
-                existing_count = 0
-
-                for product_name in lines:
-                    if product_name not in product_settings.get('products', []):
-                        product_settings['products'].append(product_name)
-                        imported_count += 1
-                    else:
-                        existing_count += 1
+                # 重複及已存在的名稱由資料表唯一鍵略過
+                imported_count = add_products(lines)
+                existing_count = len(lines) - imported_count
 
                 if imported_count > 0:
-                    if save_product_settings(product_settings):
-                        st.success(f"✅ 成功匯入 {imported_count} 個產品名稱")
-                        if existing_count > 0:
-                            st.info(f"ℹ️ {existing_count} 個產品名稱已存在，跳過匯入")
-                        st.rerun()
-                    else:
-                        st.error("❌ 儲存失敗")
+                    st.success(f"✅ 成功匯入 {imported_count} 個產品名稱")
+                    if existing_count > 0:
+                        st.info(f"ℹ️ {existing_count} 個產品名稱已存在，跳過匯入")
+                    st.rerun()
                 else:
                     st.warning("⚠️ 所有產品名稱都已存在，沒有新增任何產品")
             else:
@@ -4825,36 +7077,18 @@ def settings_page():
     col1, col2 = st.columns(2)
 
     with col1:
+        export_format = st.selectbox("匯出格式", ["CSV", "CSV (gzip壓縮)", "CSV (zip壓縮)"],
+                                     key="settings_export_format")
         if st.button("📊 匯出資料"):
-            all_defects = get_defects()
-            if not all_defects.empty:
-                # 重新排列欄位順序並設定中文欄位名稱
-                export_data = all_defects[[
-                    'id', 'work_order', 'package_number', 'product_name', 'defect_type',
-                    'defect_level', 'quantity', 'description', 'responsible_dept',
-                    'assigned_person', 'status', 'resolution', 'created_time',
-                    'deadline', 'completion_time'
-                ]].copy()
-
-                # 設定中文欄位名稱
-                export_data.columns = [
-                    '編號', '工單號碼', '包數', '產品名稱', '不良類型',
-                    '不良等級', '數量(pcs)', '問題描述', '責任部門',
-                    '負責人', '處理狀態', '處理結果', '建立時間',
-                    '處理截止時間', '完成時間'
-                ]
-
-                csv = export_data.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="📥 下載CSV檔案",
-                    data=csv,
-                    file_name=f"不良品管理資料_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv",
-                    help="包含包數信息的完整不良品管理資料"
-                )
-                st.info(f"📋 準備匯出 {len(export_data)} 筆記錄，包含包數資訊")
-            else:
-                st.warning("沒有資料可匯出")
+            # 分批讀取並寫入暫存檔，避免一次載入全部資料
+            row_count = export_download_button(
+                "📥 下載匯出檔案",
+                compression={"CSV": 'csv', "CSV (gzip壓縮)": 'gzip', "CSV (zip壓縮)": 'zip'}[export_format],
+                key="settings_export_download",
+                help="包含包數信息的完整不良品管理資料"
+            )
+            if row_count:
+                st.info(f"📋 準備匯出 {row_count} 筆記錄，包含包數資訊")
 
     with col2:
         if st.button("🗑️ 清除測試資料", type="secondary"):
@@ -4866,73 +7100,76 @@ def settings_page():
                 st.session_state['confirm_delete'] = True
                 st.warning("⚠️ 請再次點擊確認清除")
 
+    # 歷史資料匯入
+    st.write("**📥 匯入歷史資料**")
+    st.caption("支援CSV及Excel（需安裝openpyxl），欄位：" +
+               "、".join(list(BULK_UPLOAD_COLUMNS.keys()) + list(IMPORT_OPTIONAL_COLUMNS.keys())) +
+               f"。資料分批寫入，每批 {IMPORT_CHUNK_SIZE} 筆，錯誤資料列會略過並列出")
+
+    import_file = st.file_uploader("選擇匯入檔案", type=['csv', 'xlsx'], key="history_import_file")
+    if import_file is not None and st.button("🚀 開始匯入", key="history_import_start"):
+        progress_bar = st.progress(0.0)
+        status_text = st.empty()
+        file_size = max(import_file.size, 1)
+
+        def update_progress(total, imported, error_count):
+            # 以檔案讀取位置估算進度
+            position = import_file.tell() if not import_file.closed else file_size
+            progress_bar.progress(min(position / file_size, 1.0))
+            status_text.write(f"已讀取 {total} 筆，匯入 {imported} 筆，錯誤 {error_count} 筆")
+
+        file_type = 'xlsx' if import_file.name.lower().endswith('.xlsx') else 'csv'
+        operator = st.session_state.user['name']
+        try:
+            result = import_defects_stream(import_file, file_type=file_type, operator=operator,
+                                           progress_callback=update_progress)
+        except Exception as e:
+            st.error(f"❌ 匯入失敗: {str(e)}")
+        else:
+            progress_bar.progress(1.0)
+            st.success(f"✅ 匯入完成！共讀取 {result['total']} 筆，成功匯入 {result['imported']} 筆")
+            if result['error_count']:
+                st.warning(f"⚠️ {result['error_count']} 筆資料未匯入：")
+                st.text('\n'.join(result['errors'][:100]))
+
 # 新增：登錄人員管理函數
 
 
 def load_operator_settings():
-    """載入登錄人員設定"""
-    try:
-        with open('operator_settings.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # 預設登錄人員列表
-        default_operators = {
-            "operators": []
-        }
-        save_operator_settings(default_operators)
-        return default_operators
-    except Exception as e:
-        st.error(f"載入登錄人員設定時發生錯誤: {e}")
-        return {"operators": []}
+    """載入登錄人員設定（回傳副本）"""
+    return copy.deepcopy(get_settings_store().get('operators')[0])
 
-def save_operator_settings(settings):
-    """儲存登錄人員設定"""
-    try:
-        with open('operator_settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        st.error(f"儲存登錄人員設定時發生錯誤: {e}")
-        return False
+def add_operators(names):
+    """新增登錄人員，已存在的姓名略過，回傳新增筆數"""
+    return _execute_settings_write(_add_setting_names_tx, 'operators', list(names))
+
+def delete_operator(name):
+    """刪除登錄人員，回傳是否有刪除"""
+    return _execute_settings_write(_delete_setting_name_tx, 'operators', name) > 0
 
 def get_operators_list():
     """獲取登錄人員列表"""
-    settings = load_operator_settings()
-    return settings.get('operators', [])
+    return list(get_settings_store().get('operators')[0]['operators'])
 
 # 新增：產品名稱管理函數
 
 
 def load_product_settings():
-    """載入產品名稱設定"""
-    try:
-        with open('product_settings.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # 預設產品名稱列表
-        default_products = {
-            "products": []
-        }
-        save_product_settings(default_products)
-        return default_products
-    except Exception as e:
-        st.error(f"載入產品名稱設定時發生錯誤: {e}")
-        return {"products": []}
+    """載入產品名稱設定（回傳副本）"""
+    return copy.deepcopy(get_settings_store().get('products')[0])
 
-def save_product_settings(settings):
-    """儲存產品名稱設定"""
-    try:
-        with open('product_settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        st.error(f"儲存產品名稱設定時發生錯誤: {e}")
-        return False
+def add_products(names):
+    """新增產品名稱，已存在的名稱略過，回傳新增筆數"""
+    return _execute_settings_write(_add_setting_names_tx, 'products', list(names))
+
+def delete_product(name):
+    """刪除產品名稱，回傳是否有刪除"""
+    return _execute_settings_write(_delete_setting_name_tx, 'products', name) > 0
 
 def get_products_list():
     """獲取產品名稱列表"""
-    settings = load_product_settings()
-    return settings.get('products', [])
+    return list(get_settings_store().get('products')[0]['products'])
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+不良品歷史資料匯入工具
+從MES/ERP匯出的CSV或Excel檔案分批匯入不良品記錄
+
+使用方式：python import_defects.py 檔案路徑 [--chunk-size 筆數] [--map 來源欄位=資料欄位 ...]
+資料庫路徑可透過環境變數 DEFECT_DB_PATH 指定
+"""
+
+import argparse
+import sys
+import time
+
+import defect_management_system as dms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='匯入不良品歷史資料')
+    parser.add_argument('path', help='CSV 或 Excel (.xlsx) 檔案路徑')
+    parser.add_argument('--chunk-size', type=int, default=dms.IMPORT_CHUNK_SIZE, help='每批匯入筆數')
+    parser.add_argument('--operator', default='系統匯入', help='登錄人員名稱')
+    parser.add_argument('--map', action='append', default=[], metavar='來源欄位=資料欄位',
+                        help='外部系統欄位對應，例如 --map MO_NO=work_order')
+    args = parser.parse_args()
+
+    column_mapping = {}
+    for item in args.map:
+        if '=' not in item:
+            parser.error(f"欄位對應格式錯誤: {item}")
+        source, target = item.split('=', 1)
+        column_mapping[source.strip()] = target.strip()
+
+    file_type = 'xlsx' if args.path.lower().endswith('.xlsx') else 'csv'
+    start_time = time.time()
+
+    def report(total, imported, error_count):
+        elapsed = time.time() - start_time
+        print(f"\r已讀取 {total} 筆，匯入 {imported} 筆，錯誤 {error_count} 筆（{elapsed:.1f} 秒）", end='', flush=True)
+
+    dms.run_migrations()
+    result = dms.import_defects_stream(args.path, file_type=file_type, chunk_size=args.chunk_size,
+                                       operator=args.operator, column_mapping=column_mapping,
+                                       progress_callback=report)
+    print()
+
+    for error in result['errors']:
+        print(error)
+    if result['error_count'] > len(result['errors']):
+        print(f"... 另有 {result['error_count'] - len(result['errors'])} 筆錯誤")
+
+    print(f"匯入完成：共 {result['total']} 筆，成功 {result['imported']} 筆，耗時 {time.time() - start_time:.1f} 秒")
+    return 0 if result['error_count'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
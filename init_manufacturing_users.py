@@ -5,12 +5,16 @@
 用於創建製造二部和製造三部的預設用戶帳號，以便進行最終簽核
 """
 
+import os
 import sqlite3
 import hashlib
 
+# 與主程式使用相同的資料庫路徑
+DB_PATH = os.environ.get('DEFECT_DB_PATH', os.path.join('data', 'defect_management.db'))
+
 def create_manufacturing_users():
     """創建製造二部和製造三部的預設用戶"""
-    conn = sqlite3.connect('defect_management.db')
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # 製造二部和製造三部的預設用戶
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 匯入模組時背景執行緒會初始化資料庫，指向暫存目錄避免在專案目錄建立 data/
+os.environ.setdefault('DEFECT_DB_PATH', os.path.join(tempfile.mkdtemp(), 'defect_management.db'))
+
+import defect_management_system as dms
+
+
+def _create_db(path, defects=0, users=0):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE defects (id INTEGER PRIMARY KEY, work_order TEXT)')
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+    conn.executemany('INSERT INTO defects (work_order) VALUES (?)', [(f'WO{i}',) for i in range(defects)])
+    conn.executemany('INSERT INTO users (username) VALUES (?)', [(f'user{i}',) for i in range(users)])
+    conn.commit()
+    conn.close()
+
+
+def test_adopts_populated_legacy_db_over_empty_unified_db(tmp_path):
+    # 舊版 init_database() 在 data/ 建立的空資料庫（只有預設管理員），實際資料在根目錄
+    os.makedirs(tmp_path / 'data')
+    db_path = str(tmp_path / 'data' / 'defect_management.db')
+    legacy_path = str(tmp_path / 'defect_management.db')
+    _create_db(db_path, defects=0, users=1)
+    _create_db(legacy_path, defects=5, users=3)
+
+    assert dms._adopt_legacy_db(db_path, legacy_path) == f'{legacy_path}.migrated'
+    assert dms._count_db_rows(db_path) == (5, 3)
+    assert not os.path.exists(legacy_path)
+    assert os.path.exists(f'{legacy_path}.migrated')
+    replaced = [name for name in os.listdir(tmp_path / 'data') if name.startswith('defect_management.db.replaced-')]
+    assert len(replaced) == 1
+
+
+def test_keeps_unified_db_when_it_has_more_data(tmp_path):
+    db_path = str(tmp_path / 'unified.db')
+    legacy_path = str(tmp_path / 'legacy.db')
+    _create_db(db_path, defects=10, users=2)
+    _create_db(legacy_path, defects=4, users=2)
+
+    assert dms._adopt_legacy_db(db_path, legacy_path) == db_path
+    assert dms._count_db_rows(db_path) == (10, 2)
+    # 已處理過的舊檔改名後不再比較
+    assert dms._adopt_legacy_db(db_path, legacy_path) is None